@@ -0,0 +1,344 @@
+"""
+Integer factorization with exact integer arithmetic.
+
+factorize(x) returns the prime factors of x in ascending order, with repetition,
+the same list prime_decomposition.py prints. Small primes come from a cached sieve of
+Eratosthenes, numbers below a bound are split with a smallest-prime-factor table,
+and larger numbers use deterministic Miller-Rabin and Pollard's rho (Brent), which are
+exact for every 64-bit input.
+
+factorize_many(values) factors a NumPy array of many values on all cores and returns
+the factors in CSR form: the factors of values[i] are factors[offsets[i]:offsets[i+1]].
+"""
+
+import math
+import os
+import random
+from multiprocessing import Pool
+
+import numpy as np
+
+# Miller-Rabin with these bases is deterministic for n < 3.3 * 10**24
+_MR_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+# and with these for n < 4,759,123,141, where products of two residues fit in uint64
+_MR_BASES_32 = (2, 7, 61)
+# numbers below this bound are split with the smallest-prime-factor table
+DEFAULT_SPF_BOUND = 1 << 22
+# trial division limit used before the table or Pollard's rho
+TRIAL_LIMIT = 1000
+
+_prime_cache = np.array([], dtype=np.int64)
+_prime_cache_bound = 0
+_spf_cache = np.array([], dtype=np.int32)
+
+
+def primes_up_to(n):
+    # sieve of Eratosthenes, cached and only recomputed when a larger bound is asked for
+    global _prime_cache, _prime_cache_bound
+    if n <= _prime_cache_bound:
+        return _prime_cache[:np.searchsorted(_prime_cache, n, side='right')]
+    is_prime = np.ones(n + 1, dtype=np.bool_)
+    is_prime[:2] = False
+    for p in range(2, math.isqrt(n) + 1):
+        if is_prime[p]:
+            is_prime[p * p::p] = False
+    _prime_cache = np.flatnonzero(is_prime).astype(np.int64)
+    _prime_cache_bound = n
+    return _prime_cache
+
+
+def spf_table(bound):
+    # smallest prime factor of every number below bound, 0 for 0 and 1
+    global _spf_cache
+    if bound <= _spf_cache.size:
+        return _spf_cache
+    spf = np.zeros(bound, dtype=np.int32)
+    for p in primes_up_to(math.isqrt(bound - 1) + 1):
+        p = int(p)
+        block = spf[p * p::p]
+        block[block == 0] = p
+    spf[2:][spf[2:] == 0] = np.flatnonzero(spf[2:] == 0) + 2
+    _spf_cache = spf
+    return spf
+
+
+def is_prime(n):
+    n = int(n)
+    if n < 2:
+        return False
+    for p in _MR_BASES:
+        if n % p == 0:
+            return n == p
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in _MR_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _is_prime_vec(n):
+    # Vectorized Miller-Rabin for n < 2**32 without a factor below TRIAL_LIMIT
+    if n.size == 0:
+        return np.zeros(0, dtype=np.bool_)
+    n = n.astype(np.uint64)
+    d = n - np.uint64(1)
+    s = np.zeros(n.size, dtype=np.uint64)
+    while True:
+        even = (d & np.uint64(1)) == 0
+        if not even.any():
+            break
+        d[even] >>= np.uint64(1)
+        s[even] += np.uint64(1)
+    prime = np.ones(n.size, dtype=np.bool_)
+    one = np.uint64(1)
+    n_minus_1 = n - one
+    for a in _MR_BASES_32:
+        # x = a ** d mod n by square and multiply over the bits of d
+        x = np.ones(n.size, dtype=np.uint64)
+        base = np.full(n.size, a, dtype=np.uint64) % n
+        e = d.copy()
+        while e.any():
+            odd = (e & one) == one
+            x[odd] = x[odd] * base[odd] % n[odd]
+            base = base * base % n
+            e >>= one
+        passed = (x == one) | (x == n_minus_1)
+        for r in range(1, int(s.max())):
+            x = x * x % n
+            passed |= (x == n_minus_1) & (s > np.uint64(r))
+        prime &= passed
+    return prime
+
+
+def pollard_rho(n):
+    # Brent's variant, returns a non-trivial factor of the composite n
+    if n % 2 == 0:
+        return 2
+    while True:
+        y = random.randrange(1, n)
+        c = random.randrange(1, n)
+        m = 128
+        g = r = q = 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(m, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = math.gcd(q, n)
+                k += m
+            r *= 2
+        if g == n:
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+        if g != n:
+            return g
+
+
+def _pollard_rho_vec(n):
+    # Vectorized Pollard's rho (Floyd) for composite n < 2**32 without a factor below
+    # TRIAL_LIMIT. Squares of residues fit in uint64, gcds are checked every 32 steps,
+    # and the arrays shrink as factors are found.
+    factor = np.zeros(n.size, dtype=np.uint64)
+    rng = np.random.default_rng(n.size)
+    todo = np.arange(n.size)
+    m = n.astype(np.uint64)
+    c = rng.integers(1, m, dtype=np.uint64) if m.size else m
+    x = rng.integers(0, m, dtype=np.uint64) if m.size else m
+    y = x.copy()
+    q = np.ones(m.size, dtype=np.uint64)
+    while todo.size:
+        saved_x, saved_y = x.copy(), y.copy()
+        for _ in range(32):
+            x = (x * x % m + c) % m
+            y = (y * y % m + c) % m
+            y = (y * y % m + c) % m
+            q = q * np.where(x > y, x - y, y - x) % m
+        g = np.gcd(q, m)
+        found = (g > 1) & (g < m)
+        factor[todo[found]] = g[found]
+        overshoot = g == m
+        if overshoot.any():
+            # the block went past the factor, step again one at a time from the saved state
+            ox, oy, om, oc = saved_x[overshoot], saved_y[overshoot], m[overshoot], c[overshoot]
+            owner = todo[overshoot]
+            for _ in range(32):
+                ox = (ox * ox % om + oc) % om
+                oy = (oy * oy % om + oc) % om
+                oy = (oy * oy % om + oc) % om
+                g1 = np.gcd(np.where(ox > oy, ox - oy, oy - ox), om)
+                hit = (g1 > 1) & (g1 < om) & (factor[owner] == 0)
+                factor[owner[hit]] = g1[hit]
+            # sequences that cycled without a factor start again with another c
+            restart = np.flatnonzero(overshoot)
+            restart = restart[factor[todo[restart]] == 0]
+            c[restart] = rng.integers(1, m[restart], dtype=np.uint64)
+            x[restart] = rng.integers(0, m[restart], dtype=np.uint64)
+            y[restart] = x[restart]
+            q[restart] = 1
+        keep = factor[todo] == 0
+        todo, m, c, x, y, q = todo[keep], m[keep], c[keep], x[keep], y[keep], q[keep]
+    return factor.astype(np.int64)
+
+
+def _split(n, factors):
+    # n has no prime factor below TRIAL_LIMIT
+    if n == 1:
+        return
+    if n < _spf_cache.size:
+        while n > 1:
+            p = int(_spf_cache[n])
+            factors.append(p)
+            n //= p
+        return
+    if is_prime(n):
+        factors.append(n)
+        return
+    d = pollard_rho(n)
+    _split(d, factors)
+    _split(n // d, factors)
+
+
+def factorize(x):
+    x = int(x)
+    if x < 1:
+        raise ValueError('Can only factorize positive integers: ' + str(x))
+    factors = []
+    for p in primes_up_to(TRIAL_LIMIT):
+        p = int(p)
+        if p * p > x:
+            break
+        while x % p == 0:
+            factors.append(p)
+            x //= p
+    if x > 1:
+        if x < TRIAL_LIMIT * TRIAL_LIMIT:
+            # no factor up to sqrt(x), so x is prime
+            factors.append(x)
+        else:
+            _split(x, factors)
+    factors.sort()
+    return factors
+
+
+def _factor_chunk(args):
+    values, spf_bound = args
+    spf = spf_table(spf_bound)
+    rem = values.astype(np.int64)
+    owners = []
+    primes = []
+
+    # trial division by the small primes, only on the values that still have a cofactor
+    active = np.flatnonzero(rem > 1)
+    for p in primes_up_to(TRIAL_LIMIT):
+        if active.size == 0:
+            break
+        hit = active[rem[active] % p == 0]
+        while hit.size:
+            owners.append(hit)
+            primes.append(np.full(hit.size, p, dtype=np.int64))
+            rem[hit] //= p
+            hit = hit[rem[hit] % p == 0]
+        active = active[rem[active] > 1]
+
+    # cofactors below 2**32 are split with vectorized kernels, the rest one by one
+    below_32 = active[rem[active] < (1 << 32)]
+    large = active[rem[active] >= (1 << 32)]
+    pending_owner = below_32
+    pending = rem[below_32]
+    while pending_owner.size:
+        # cofactors inside the table are split by repeated lookups
+        small = pending < spf.size
+        small_owner = pending_owner[small]
+        small_rem = pending[small]
+        while small_owner.size:
+            p = spf[small_rem].astype(np.int64)
+            owners.append(small_owner)
+            primes.append(p)
+            small_rem = small_rem // p
+            left = small_rem > 1
+            small_owner = small_owner[left]
+            small_rem = small_rem[left]
+
+        # larger cofactors are mostly primes, test them all at once
+        pending_owner = pending_owner[~small]
+        pending = pending[~small]
+        prime = _is_prime_vec(pending)
+        owners.append(pending_owner[prime])
+        primes.append(pending[prime])
+
+        # and split the composites into two parts for the next round
+        pending_owner = pending_owner[~prime]
+        pending = pending[~prime]
+        d = _pollard_rho_vec(pending)
+        pending_owner = np.concatenate([pending_owner, pending_owner])
+        pending = np.concatenate([d, pending // d])
+
+    # the few left go through Miller-Rabin and Pollard's rho one by one
+    for i in large:
+        factors = []
+        _split(int(rem[i]), factors)
+        owners.append(np.full(len(factors), i, dtype=np.int64))
+        primes.append(np.array(factors, dtype=np.int64))
+
+    if owners:
+        owners = np.concatenate(owners)
+        primes = np.concatenate(primes)
+    else:
+        owners = np.array([], dtype=np.int64)
+        primes = np.array([], dtype=np.int64)
+    order = np.lexsort((primes, owners))
+    counts = np.bincount(owners, minlength=values.size)
+    return counts, primes[order]
+
+
+def factorize_many(values, workers=None, spf_bound=DEFAULT_SPF_BOUND):
+    values = np.asarray(values, dtype=np.int64).ravel()
+    if values.size and values.min() < 1:
+        raise ValueError('Can only factorize positive integers')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunk_count = max(1, min(workers * 4, values.size // 10000))
+    chunks = [(c, spf_bound) for c in np.array_split(values, chunk_count)]
+    if workers > 1 and chunk_count > 1:
+        # build the table before the pool, forked workers share it
+        spf_table(spf_bound)
+        with Pool(workers) as pool:
+            results = pool.map(_factor_chunk, chunks)
+    else:
+        results = [_factor_chunk(c) for c in chunks]
+    counts = np.concatenate([r[0] for r in results])
+    factors = np.concatenate([r[1] for r in results])
+    offsets = np.zeros(values.size + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, factors
+
+
+if __name__ == '__main__':
+    import time
+    print(factorize(23232))
+    print(factorize(2**64 - 59), factorize(2**61 - 1), factorize(1000000007 * 998244353))
+
+    values = np.random.randint(10000000, 1000000000, 1000000)
+    start = time.time()
+    offsets, factors = factorize_many(values)
+    end = time.time()
+    print('factorize_many', values.size, 'values', (end-start) * 1000, 'ms')
+    print(values[0], factors[offsets[0]:offsets[1]])
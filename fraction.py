@@ -1,13 +1,305 @@
+"""
+Exact rational arithmetic.
+
+Fractions are (numerator, denominator) pairs. The functions below work on single pairs,
+Rational is a small value class, and the batch_* functions work on NumPy int64 arrays of
+numerators and denominators. When an int64 result could overflow, the batch functions
+fall back to arrays of Python ints, so the results are always exact.
+"""
+
 import math
+import numbers
+import sys
+import time
+
+import numpy as np
+
+# int64 results are only trusted below this bound, otherwise Python ints are used
+_INT64_SAFE = 2.0 ** 62
+
+
+def reduce(n, d):
+    if d == 0:
+        raise ZeroDivisionError('Fraction with zero denominator')
+    if d < 0:
+        n, d = -n, -d
+    s = math.gcd(n, d)
+    if s > 1:
+        n = n // s
+        d = d // s
+    return n, d
+
 
 def add(n1, d1, n2, d2):
-    d = d1 * d2 // math.gcd(d1,d2)
+    d = d1 * d2 // math.gcd(d1, d2)
     n = n1 * d // d1 + n2 * d // d2
-    s = math.gcd (d,n)
-    if s != 1:
-        d = d//s
-        n = n//s
-    return n,d
-
-# test
-print(add(2,4,1,6))
+    return reduce(n, d)
+
+
+def sub(n1, d1, n2, d2):
+    return add(n1, d1, -n2, d2)
+
+
+def mul(n1, d1, n2, d2):
+    # cancel across first, so the products stay small
+    g1 = math.gcd(n1, d2) or 1
+    g2 = math.gcd(n2, d1) or 1
+    return reduce((n1 // g1) * (n2 // g2), (d1 // g2) * (d2 // g1))
+
+
+def div(n1, d1, n2, d2):
+    if n2 == 0:
+        raise ZeroDivisionError('Division by a zero fraction')
+    return mul(n1, d1, d2, n2)
+
+
+def compare(n1, d1, n2, d2):
+    # returns -1, 0 or 1, like the old cmp()
+    n1, d1 = reduce(n1, d1)
+    n2, d2 = reduce(n2, d2)
+    left = n1 * d2
+    right = n2 * d1
+    return (left > right) - (left < right)
+
+
+class Rational:
+    __slots__ = ('n', 'd')
+
+    def __init__(self, n, d=1):
+        self.n, self.d = reduce(int(n), int(d))
+
+    @staticmethod
+    def _pair(other):
+        if isinstance(other, Rational):
+            return other.n, other.d
+        if isinstance(other, int):
+            return other, 1
+        # fractions.Fraction and the other exact rationals
+        if isinstance(other, numbers.Rational):
+            return other.numerator, other.denominator
+        return NotImplemented
+
+    def _apply(self, op, other, swap=False):
+        pair = Rational._pair(other)
+        if pair is NotImplemented:
+            return NotImplemented
+        if swap:
+            n, d = op(pair[0], pair[1], self.n, self.d)
+        else:
+            n, d = op(self.n, self.d, pair[0], pair[1])
+        r = Rational.__new__(Rational)
+        r.n, r.d = n, d
+        return r
+
+    def __add__(self, other):
+        return self._apply(add, other)
+
+    def __radd__(self, other):
+        return self._apply(add, other, swap=True)
+
+    def __sub__(self, other):
+        return self._apply(sub, other)
+
+    def __rsub__(self, other):
+        return self._apply(sub, other, swap=True)
+
+    def __mul__(self, other):
+        return self._apply(mul, other)
+
+    def __rmul__(self, other):
+        return self._apply(mul, other, swap=True)
+
+    def __truediv__(self, other):
+        return self._apply(div, other)
+
+    def __rtruediv__(self, other):
+        return self._apply(div, other, swap=True)
+
+    def __neg__(self):
+        return Rational(-self.n, self.d)
+
+    def _compare(self, other):
+        pair = Rational._pair(other)
+        if pair is NotImplemented:
+            return NotImplemented
+        return compare(self.n, self.d, pair[0], pair[1])
+
+    def __eq__(self, other):
+        c = self._compare(other)
+        return c if c is NotImplemented else c == 0
+
+    def __lt__(self, other):
+        c = self._compare(other)
+        return c if c is NotImplemented else c < 0
+
+    def __le__(self, other):
+        c = self._compare(other)
+        return c if c is NotImplemented else c <= 0
+
+    def __gt__(self, other):
+        c = self._compare(other)
+        return c if c is NotImplemented else c > 0
+
+    def __ge__(self, other):
+        c = self._compare(other)
+        return c if c is NotImplemented else c >= 0
+
+    def __hash__(self):
+        # the hash of the equal int or fractions.Fraction, since they compare equal
+        if self.d == 1:
+            return hash(self.n)
+        # n / d modulo the hash modulus, as fractions.Fraction does it
+        modulus = sys.hash_info.modulus
+        try:
+            inverse = pow(self.d, -1, modulus)
+        except ValueError:
+            # d is a multiple of the modulus
+            h = sys.hash_info.inf
+        else:
+            h = hash(hash(abs(self.n)) * inverse)
+        h = h if self.n >= 0 else -h
+        return -2 if h == -1 else h
+
+    def __float__(self):
+        return self.n / self.d
+
+    def __repr__(self):
+        return 'Rational({0}, {1})'.format(self.n, self.d)
+
+    def __str__(self):
+        return '{0}/{1}'.format(self.n, self.d)
+
+
+# Batch operations over arrays of numerators and denominators
+
+def _as_int_array(a):
+    a = np.asarray(a)
+    if a.dtype != object:
+        a = a.astype(np.int64)
+    return a
+
+
+def _is_object(*arrays):
+    return any(a.dtype == object for a in arrays)
+
+
+def _mag(a):
+    return np.abs(a.astype(np.float64))
+
+
+def _fits_int64(*estimates):
+    # estimates are float64 magnitudes of the values an int64 computation would produce
+    for e in estimates:
+        if e.size and not np.all(e < _INT64_SAFE):
+            return False
+    return True
+
+
+def _to_object(*arrays):
+    return [np.array([int(x) for x in a.ravel()], dtype=object).reshape(a.shape) for a in arrays]
+
+
+def batch_reduce(n, d):
+    n = _as_int_array(n)
+    d = _as_int_array(d)
+    if np.any(d == 0):
+        raise ZeroDivisionError('Fraction with zero denominator')
+    sign = np.where(d < 0, -1, 1)
+    n = n * sign
+    d = d * sign
+    g = np.gcd(n, d)
+    g = np.where(g == 0, 1, g)
+    return n // g, d // g
+
+
+def batch_add(n1, d1, n2, d2):
+    n1, d1, n2, d2 = [_as_int_array(a) for a in (n1, d1, n2, d2)]
+    g = np.gcd(d1, d2)
+    a = d2 // g
+    b = d1 // g
+    if _is_object(n1, d1, n2, d2) or not _fits_int64(_mag(n1) * _mag(a) + _mag(n2) * _mag(b),
+                                                       _mag(b) * _mag(d2)):
+        n1, d1, n2, d2, a, b = _to_object(n1, d1, n2, d2, a, b)
+    return batch_reduce(n1 * a + n2 * b, b * d2)
+
+
+def batch_sub(n1, d1, n2, d2):
+    return batch_add(n1, d1, -_as_int_array(n2), d2)
+
+
+def batch_mul(n1, d1, n2, d2):
+    n1, d1, n2, d2 = [_as_int_array(a) for a in (n1, d1, n2, d2)]
+    g1 = np.gcd(n1, d2)
+    g1 = np.where(g1 == 0, 1, g1)
+    g2 = np.gcd(n2, d1)
+    g2 = np.where(g2 == 0, 1, g2)
+    n1, d2 = n1 // g1, d2 // g1
+    n2, d1 = n2 // g2, d1 // g2
+    if _is_object(n1, d1, n2, d2) or not _fits_int64(_mag(n1) * _mag(n2), _mag(d1) * _mag(d2)):
+        n1, d1, n2, d2 = _to_object(n1, d1, n2, d2)
+    return batch_reduce(n1 * n2, d1 * d2)
+
+
+def batch_div(n1, d1, n2, d2):
+    n2 = _as_int_array(n2)
+    if np.any(n2 == 0):
+        raise ZeroDivisionError('Division by a zero fraction')
+    return batch_mul(n1, d1, d2, n2)
+
+
+def batch_compare(n1, d1, n2, d2):
+    n1, d1 = batch_reduce(n1, d1)
+    n2, d2 = batch_reduce(n2, d2)
+    if _is_object(n1, d1, n2, d2) or not _fits_int64(_mag(n1) * _mag(d2), _mag(n2) * _mag(d1)):
+        n1, d1, n2, d2 = _to_object(n1, d1, n2, d2)
+    left = n1 * d2
+    right = n2 * d1
+    return ((left > right).astype(np.int8) - (left < right).astype(np.int8))
+
+
+def sum_fractions(n, d):
+    # Tree reduction: add neighbours level by level, so intermediate denominators
+    # stay small instead of growing with every addition of a running total.
+    n, d = batch_reduce(np.ravel(n), np.ravel(d))
+    if n.size == 0:
+        return 0, 1
+    while n.size > 1:
+        if n.size % 2 == 1:
+            # carry the odd element to the next level
+            n = np.append(n, np.zeros(1, dtype=n.dtype))
+            d = np.append(d, np.ones(1, dtype=d.dtype))
+        n, d = batch_add(n[0::2], d[0::2], n[1::2], d[1::2])
+    return int(n[0]), int(d[0])
+
+
+def benchmark(count=1000000, max_denominator=1000):
+    from fractions import Fraction
+    rng = np.random.default_rng(0)
+    n = rng.integers(-max_denominator, max_denominator, count)
+    d = rng.integers(1, max_denominator, count)
+
+    start = time.time()
+    result = sum_fractions(n, d)
+    end = time.time()
+    print('sum_fractions', (end-start) * 1000, 'ms')
+
+    start = time.time()
+    total = sum((Fraction(int(a), int(b)) for a, b in zip(n, d)), Fraction(0))
+    end = time.time()
+    print('fractions.Fraction', (end-start) * 1000, 'ms')
+    print('Same result', result == (total.numerator, total.denominator))
+
+
+if __name__ == '__main__':
+    # Usage: python fraction.py [--benchmark]
+    from fractions import Fraction
+    print(add(2, 4, 1, 6))
+    # equal values hash alike, so Rational(4, 2) and 2 are one key of a dict
+    assert hash(Rational(4, 2)) == hash(2) and len({Rational(4, 2), 2}) == 1
+    for n, d in [(1, 3), (-7, 5), (3, sys.hash_info.modulus), (-1, sys.hash_info.modulus)]:
+        assert hash(Rational(n, d)) == hash(Fraction(n, d))
+    assert Rational(1, 2) == Fraction(1, 2) and Fraction(1, 2) == Rational(1, 2)
+    assert Rational(1, 2) + Fraction(1, 3) == Rational(5, 6)
+    print('ok')
+    if '--benchmark' in sys.argv[1:]:
+        benchmark()
@@ -1,19 +1,22 @@
 # Prime Decomposition
-import math
 from random import *
+from factorization import factorize
 x = randint(10000000, 1000000000)
 x= 23232
 print(x)
+source = x
 count = 0
 i = 2
 primes = []
-while(i <= math.sqrt(x)):
+while(i * i <= x):
     if(x % i == 0):
         primes.append(i)
-        x /= i
+        x //= i
     else:
         i += 1
     count += 1
-primes.append(int(x))
+primes.append(x)
 print(primes)
 print(count)
+# compare with the factorization module
+print(factorize(source))
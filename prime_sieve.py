@@ -0,0 +1,193 @@
+"""
+Segmented, bit-packed prime sieve persisted to a memory-mapped file.
+
+Only odd numbers are stored, one bit each: bit i of the table is set when 2i+1 is prime,
+so the primes up to 10**10 take 625 MB on disk and are never fully loaded in memory.
+The table is built segment by segment, every segment small enough to stay in cache,
+and segments can be sieved in parallel processes which write straight into the file.
+
+open_prime_table(limit) reuses the file from an earlier run when it covers the limit,
+and the returned PrimeTable answers is_prime, prime_count and prime range queries.
+"""
+
+import math
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from factorization import primes_up_to
+
+MAGIC = b'OSIEVE01'
+HEADER_BYTES = 16
+# bytes of packed bits per segment, the working bool array is 8 times larger
+SEGMENT_BYTES = 1 << 18
+# prime counts are kept for every block of this many bytes
+COUNT_BLOCK_BYTES = 1 << 16
+DEFAULT_PATH = 'primes.bits'
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(data):
+    return int(_POPCOUNT[data].sum(dtype=np.uint64))
+
+
+def _table_bytes(limit):
+    # odd numbers 1, 3, ..., up to limit
+    return ((limit + 1) // 2 + 7) // 8
+
+
+def _sieve_segment(args):
+    path, limit, lo_byte, hi_byte = args
+    lo = lo_byte * 8
+    hi = min(hi_byte * 8, (limit + 1) // 2)
+    segment = np.ones(hi_byte * 8 - lo, dtype=np.bool_)
+    # odd indices past the limit stay clear
+    segment[hi - lo:] = False
+    if lo == 0:
+        segment[0] = False  # 1 is not a prime
+    lo_number = 2 * lo + 1
+    hi_number = 2 * hi - 1
+    for p in primes_up_to(math.isqrt(limit))[1:]:
+        p = int(p)
+        if p * p > hi_number:
+            break
+        # first odd multiple of p inside the segment, not below p * p
+        m = max(p * p, (lo_number + p - 1) // p * p)
+        if m % 2 == 0:
+            m += p
+        segment[(m - 1) // 2 - lo::p] = False
+    data = np.memmap(path, dtype=np.uint8, mode='r+', offset=HEADER_BYTES,
+                     shape=(_table_bytes(limit),))
+    data[lo_byte:hi_byte] = np.packbits(segment, bitorder='little')[:hi_byte - lo_byte]
+    data.flush()
+    del data
+    return hi_byte - lo_byte
+
+
+def _read_limit(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_BYTES)
+    if len(header) < HEADER_BYTES or header[:8] != MAGIC:
+        return 0
+    return int(np.frombuffer(header[8:], dtype=np.uint64)[0])
+
+
+def build_prime_table(limit, path=DEFAULT_PATH, workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    size = _table_bytes(limit)
+    # the header is written last, so an interrupted build is never reused
+    with open(path, 'wb') as f:
+        f.write(b'\0' * HEADER_BYTES)
+        f.truncate(HEADER_BYTES + size)
+    primes_up_to(math.isqrt(limit))
+    segments = [(path, limit, lo, min(lo + SEGMENT_BYTES, size))
+                for lo in range(0, size, SEGMENT_BYTES)]
+    if workers > 1 and len(segments) > 1:
+        with Pool(workers) as pool:
+            for _ in pool.imap_unordered(_sieve_segment, segments):
+                pass
+    else:
+        for s in segments:
+            _sieve_segment(s)
+
+    # cumulative counts per block make prime_count a lookup plus one partial block
+    data = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_BYTES, shape=(size,))
+    counts = np.zeros(size // COUNT_BLOCK_BYTES + 1, dtype=np.int64)
+    for k in range(size // COUNT_BLOCK_BYTES):
+        block = data[k * COUNT_BLOCK_BYTES:(k + 1) * COUNT_BLOCK_BYTES]
+        counts[k + 1] = counts[k] + _popcount(block)
+    del data
+    np.save(path + '.counts.npy', counts)
+
+    with open(path, 'r+b') as f:
+        f.write(MAGIC + np.array([limit], dtype=np.uint64).tobytes())
+    return PrimeTable(path)
+
+
+def open_prime_table(limit, path=DEFAULT_PATH, workers=None):
+    # reuse the table from a previous run when it is large enough
+    if _read_limit(path) >= limit and os.path.exists(path + '.counts.npy'):
+        return PrimeTable(path)
+    return build_prime_table(limit, path, workers)
+
+
+class PrimeTable:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.limit = _read_limit(path)
+        if self.limit == 0:
+            raise ValueError('Not a complete prime table: ' + path)
+        self.data = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_BYTES,
+                              shape=(_table_bytes(self.limit),))
+        self.counts = np.load(path + '.counts.npy')
+
+    def _check(self, n):
+        if np.any(np.asarray(n) > self.limit):
+            raise ValueError('Prime table only goes up to ' + str(self.limit))
+
+    def is_prime(self, n):
+        # works for a single number or an array of numbers
+        self._check(n)
+        a = np.asarray(n, dtype=np.int64)
+        idx = np.maximum(a - 1, 0) // 2
+        bit = (self.data[idx >> 3] >> (idx & 7).astype(np.uint8)) & 1
+        result = (a == 2) | ((a % 2 == 1) & (bit == 1))
+        return bool(result) if result.ndim == 0 else result
+
+    def prime_count(self, n):
+        # number of primes <= n
+        self._check(n)
+        if n < 2:
+            return 0
+        bits = (n - 1) // 2 + 1
+        full_bytes = bits >> 3
+        k = full_bytes // COUNT_BLOCK_BYTES
+        total = int(self.counts[k])
+        total += _popcount(self.data[k * COUNT_BLOCK_BYTES:full_bytes])
+        rest = bits & 7
+        if rest:
+            total += int(_POPCOUNT[self.data[full_bytes] & ((1 << rest) - 1)])
+        # 2 is the only even prime
+        return total + 1
+
+    def prime_chunks(self, lo, hi, chunk_bytes=SEGMENT_BYTES):
+        # yields arrays of the primes in [lo, hi), one chunk of the file at a time
+        hi = min(hi, self.limit + 1)
+        if lo <= 2 < hi:
+            yield np.array([2], dtype=np.int64)
+        lo_idx = max(lo, 1) // 2
+        hi_idx = max(hi, 1) // 2
+        for start in range(lo_idx >> 3, (hi_idx + 7) >> 3, chunk_bytes):
+            stop = min(start + chunk_bytes, (hi_idx + 7) >> 3)
+            bits = np.unpackbits(self.data[start:stop], bitorder='little')
+            numbers = (np.flatnonzero(bits) + start * 8) * 2 + 1
+            numbers = numbers[(numbers >= lo) & (numbers < hi)]
+            if numbers.size:
+                yield numbers
+
+    def primes_between(self, lo, hi):
+        chunks = list(self.prime_chunks(lo, hi))
+        if not chunks:
+            return np.array([], dtype=np.int64)
+        return np.concatenate(chunks)
+
+    def iter_primes(self, lo, hi):
+        for chunk in self.prime_chunks(lo, hi):
+            for p in chunk:
+                yield int(p)
+
+
+if __name__ == '__main__':
+    import time
+    start = time.time()
+    table = open_prime_table(10 ** 9)
+    end = time.time()
+    print('Prime table up to', table.limit, (end-start) * 1000, 'ms')
+    start = time.time()
+    print('pi(10**9) =', table.prime_count(10 ** 9), (time.time()-start) * 1000, 'ms')
+    print(table.is_prime(999999937), table.primes_between(10 ** 9 - 100, 10 ** 9))
@@ -0,0 +1,165 @@
+"""
+Compare decision and trade times of the sma_ema.py strategy in one pass over minute bars.
+
+ma_different_time.py exists to decide at market_close(minutes=30) and trade at
+market_close(minutes=20) instead of doing both together like sma_ema.py, and every other
+choice would be one more full backtest. Here the minute bars are loaded once, the daily
+pipeline values (which all variants share) are computed once, and every
+(signal minute, trade minute) pair becomes one price column of the vectorized engine of
+sma_ema_backtest.py: the decision price is the bar at the signal minute, the fill price
+the bar after the trade minute, where the order placed at the trade minute is filled.
+The minutes count back from the close of every session of trading_calendar.py, so on an
+early close day market_close(minutes=30) is at 12:30, as in the algorithms.
+All variants and parameter sets advance together, so 36 offsets cost little more than one.
+
+Usage: python decision_sweep.py <minute bars.csv> [<out-of-market minute bars.csv>]
+The csv files have a datetime column and a close column, one row per minute labelled with
+the end of the minute; without files the sweep runs on random bars.
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import sma_ema_backtest
+import trading_calendar
+
+calendar = trading_calendar.US_EQUITIES
+# bars of a regular session; an early close session fills only the first ones
+bars_per_day = trading_calendar.regular_close - trading_calendar.regular_open
+# (signal, trade) minutes before the close: sma_ema.py is (30, 30), ma_different_time.py (30, 20)
+sweep_minutes = (60, 45, 30, 20, 15, 10, 5, 1)
+default_offsets = [(s, t) for s in sweep_minutes for t in sweep_minutes if t <= s]
+
+
+def load_minute_bars(path, column='close'):
+    # calendar indexes of the sessions and (sessions, bars_per_day) closes. A row goes to its
+    # bar of the session, the bars being labelled with the end of the minute (09:31 to 16:00
+    # New York time); rows on other days or outside of the session are dropped
+    frame = pd.read_csv(path, parse_dates=[0])
+    times = frame.iloc[:, 0]
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert('America/New_York').dt.tz_localize(None)
+    days = times.dt.normalize().to_numpy().astype('datetime64[D]')
+    index = calendar.session_index(days)
+    bar = (times.dt.hour * 60 + times.dt.minute).to_numpy() - calendar.opens[index] - 1
+    keep = (calendar.sessions[index] == days) & (bar >= 0) & (bar < calendar.minutes[index])
+    sessions, rows = np.unique(index[keep], return_inverse=True)
+    bars = np.full((sessions.size, bars_per_day), np.nan)
+    bars[rows, bar[keep]] = frame[column].to_numpy(dtype=np.float64)[keep]
+    # a minute without a trade keeps the last price
+    bars = pd.DataFrame(bars).ffill(axis=1).to_numpy()
+    return sessions, bars
+
+
+def close_prices(sessions, bars):
+    # the last bar of every session, at 13:00 on the early close days
+    return bars[np.arange(len(sessions)), calendar.close_bar(sessions)]
+
+
+def offset_prices(sessions, bars, offsets):
+    # decision and fill prices, (days, offsets): the bar of market_close(minutes=signal) of
+    # every session, and the bar after market_close(minutes=trade), where its order fills
+    rows = np.arange(len(sessions))
+    last = calendar.close_bar(sessions)
+    decision = np.stack([bars[rows, calendar.close_bar(sessions, signal)]
+                         for signal, _ in offsets], axis=1)
+    fill = np.stack([bars[rows, np.minimum(calendar.close_bar(sessions, trade) + 1, last)]
+                     for _, trade in offsets], axis=1)
+    return decision, fill
+
+
+def _max_drawdown(equity):
+    peak = np.maximum.accumulate(equity, axis=1)
+    return (equity / peak - 1).min(axis=1)
+
+
+def sweep(sessions, bars, offsets=default_offsets, grid=None, out_bars=None):
+    # one row per (offset, parameter set), best total return first; out_bars are on the
+    # same sessions as bars
+    for signal, trade in offsets:
+        if trade > signal:
+            raise ValueError('The trade minute {0} is before the signal minute {1}'.format(trade, signal))
+    if grid is None:
+        grid = [dict(sma_ema_backtest.DEFAULTS)]
+    close = close_prices(sessions, bars)
+    decision, fill = offset_prices(sessions, bars, offsets)
+    out_close = out_fill = None
+    if out_bars is not None:
+        out_close = close_prices(sessions, out_bars)
+        _, out_fill = offset_prices(sessions, out_bars, offsets)
+
+    pipe = sma_ema_backtest.pipeline_values(close, grid)
+    # every parameter set once per offset; the pipeline rows repeat, the variant picks the prices
+    runs = len(offsets) * len(grid)
+    variant = np.repeat(np.arange(len(offsets)), len(grid))
+    expanded = {name: np.tile(pipe[name], len(offsets)) for name in ('fast_ma', 'slow_ma', 'rsi')}
+    expanded.update(price=pipe['price'], table=pipe['table'])
+    equity, trades = sma_ema_backtest.run_vectorized(
+        close, decision, fill, grid * len(offsets), out_close, out_fill, expanded, variant)
+
+    years = len(close) / 252.0
+    total = equity[:, -1] - 1
+    table = pd.DataFrame({
+        'signal_minute': [offsets[v][0] for v in variant],
+        'trade_minute': [offsets[v][1] for v in variant],
+        'params': np.tile(np.arange(len(grid)), len(offsets)),
+        'total_return': total,
+        'annual_return': (1 + total) ** (1 / years) - 1,
+        'max_drawdown': _max_drawdown(equity),
+        'trades': np.bincount(trades['params'], minlength=runs),
+    })
+    benchmark = close[-1] / close[0] - 1
+    table['vs_buy_and_hold'] = table['total_return'] - benchmark
+    return table.sort_values('total_return', ascending=False).reset_index(drop=True)
+
+
+def random_minute_bars(days, seed=0, end='2024-12-31'):
+    # the last days sessions up to end and their bars, with none after an early close
+    rng = np.random.default_rng(seed)
+    last = int(calendar.session_index(end))
+    sessions = np.arange(last - days + 1, last + 1)
+    steps = rng.normal(0.0003 / bars_per_day, 0.015 / np.sqrt(bars_per_day), (days, bars_per_day))
+    bars = 100 * np.exp(np.cumsum(steps.ravel()).reshape(days, bars_per_day))
+    bars[np.arange(bars_per_day) >= calendar.minutes[sessions][:, None]] = np.nan
+    return sessions, bars
+
+
+def _check():
+    # every bar holds its number, so the prices are the bars picked
+    sessions = calendar.session_index(['2024-11-27', '2024-11-29'])
+    bars = np.tile(np.arange(bars_per_day, dtype=np.float64), (2, 1))
+    decision, fill = offset_prices(sessions, bars, [(30, 30), (30, 20), (1, 1)])
+    # 15:30 and 12:30 on the day after Thanksgiving, which closes at 13:00
+    assert (decision == [[359, 359, 388], [179, 179, 208]]).all()
+    assert (fill == [[360, 370, 389], [180, 190, 209]]).all()
+    assert (close_prices(sessions, bars) == [389, 209]).all()
+
+
+def main(paths):
+    _check()
+    if paths:
+        sessions, bars = load_minute_bars(paths[0])
+        out_bars = None
+        if len(paths) > 1:
+            out_sessions, out_bars = load_minute_bars(paths[1])
+            # only the sessions with bars of both
+            sessions, rows, out_rows = np.intersect1d(sessions, out_sessions, return_indices=True)
+            bars, out_bars = bars[rows], out_bars[out_rows]
+    else:
+        sessions, bars = random_minute_bars(2520)
+        out_bars = random_minute_bars(2520, 1)[1] * 0.8
+    start = time.time()
+    sweep(sessions, bars, offsets=[(30, 30)], out_bars=out_bars)
+    one = time.time() - start
+    start = time.time()
+    table = sweep(sessions, bars, out_bars=out_bars)
+    print(table.to_string(float_format=lambda x: '{0:.4f}'.format(x)))
+    print('1 offset in {0:.3f} s, {1} offsets in {2:.3f} s'.format(
+        one, len(default_offsets), time.time() - start))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,177 @@
+"""
+Cross-sectional factor transforms: rank, demean, zscore, winsorize and weighted combine.
+
+Every function takes a factor as an (assets,) array for one date or a (dates, assets)
+array for a history and works across the assets of each date, with no loop over dates.
+NaN means no value: it is ignored by the statistics and stays NaN in the result.
+A mask of the same shape (the universe, or the survivors of a screen) can be passed to
+treat everything outside of it as NaN.
+
+The factors are the column dict which from_pipeline_result in screen_funnel.py builds,
+so composite scores are new columns of that dict:
+
+    factors['score'] = combine(factors, {'return_6m': 1.0, 'return_1m': 0.5, 'rsi': -0.5},
+                               transform='zscore', limits=(0.05, 0.95))
+    mask = run_funnel(factors, [top_k('score', 5)])
+"""
+
+import numpy as np
+
+
+def _prepare(values, mask):
+    values = np.asarray(values, dtype=np.float64)
+    single = values.ndim == 1
+    values = np.atleast_2d(values)
+    if mask is not None:
+        values = np.where(np.atleast_2d(mask), values, np.nan)
+    return values, single
+
+
+def _finish(result, single):
+    return result[0] if single else result
+
+
+def rank(values, mask=None, ascending=True, pct=False):
+    # rank of every asset within its date, ties get the average rank like scipy.stats.rankdata
+    values, single = _prepare(values, mask)
+    n = values.shape[1]
+    if not ascending:
+        values = -values
+    # NaN sorts last
+    order = np.argsort(values, axis=1, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=1)
+    columns = np.arange(n)
+    starts = np.ones(ordered.shape, dtype=np.bool_)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    ends = np.ones(ordered.shape, dtype=np.bool_)
+    ends[:, :-1] = starts[:, 1:]
+    # first and last position of the run of equal values every position is in
+    first = np.maximum.accumulate(np.where(starts, columns, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, columns, n - 1)[:, ::-1], axis=1)[:, ::-1]
+    ranks = (first + last) / 2.0 + 1.0
+    ranks[np.isnan(ordered)] = np.nan
+    if pct:
+        count = (~np.isnan(values)).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ranks = ranks / count[:, None]
+    result = np.empty_like(ranks)
+    np.put_along_axis(result, order, ranks, axis=1)
+    return _finish(result, single)
+
+
+def _group_keys(values, groupby):
+    # one key per (date, group), so a bincount gives the statistics of every group at once
+    groups = np.atleast_2d(np.asarray(groupby))
+    groups = np.broadcast_to(groups, values.shape)
+    labels, codes = np.unique(groups, return_inverse=True)
+    codes = codes.reshape(values.shape)
+    keys = np.arange(values.shape[0])[:, None] * labels.size + codes
+    return keys, values.shape[0] * labels.size
+
+
+def _means(values, groupby):
+    # mean of every date, or of every group of every date, broadcast back to the values
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    if groupby is None:
+        total = filled.sum(axis=1, keepdims=True)
+        count = valid.sum(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / count, count
+    keys, size = _group_keys(values, groupby)
+    total = np.bincount(keys.ravel(), weights=filled.ravel(), minlength=size)
+    count = np.bincount(keys.ravel(), weights=valid.ravel(), minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    return mean[keys], count[keys]
+
+
+def demean(values, mask=None, groupby=None):
+    # subtract the mean of the date, or of the group of the asset within the date
+    values, single = _prepare(values, mask)
+    mean, _ = _means(values, groupby)
+    return _finish(values - mean, single)
+
+
+def zscore(values, mask=None, groupby=None):
+    # (value - mean) / standard deviation within the date or group, population std like np.nanstd
+    values, single = _prepare(values, mask)
+    mean, count = _means(values, groupby)
+    centered = values - mean
+    variance, _ = _means(centered * centered, groupby)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = centered / np.sqrt(variance)
+    # a single asset or a constant factor has no spread
+    result[np.broadcast_to((count < 2) | (variance == 0), result.shape)] = np.nan
+    result[np.isnan(values)] = np.nan
+    return _finish(result, single)
+
+
+def quantiles(values, qs, mask=None):
+    # quantiles of every date, (dates, len(qs)), linear interpolation like np.nanquantile
+    values, _ = _prepare(values, mask)
+    qs = np.atleast_1d(np.asarray(qs, dtype=np.float64))
+    ordered = np.sort(values, axis=1)
+    count = (~np.isnan(values)).sum(axis=1)
+    pos = (count[:, None] - 1) * qs[None, :]
+    lo = np.floor(pos).astype(np.int64).clip(0)
+    hi = np.ceil(pos).astype(np.int64).clip(0)
+    a = np.take_along_axis(ordered, lo, axis=1)
+    b = np.take_along_axis(ordered, hi, axis=1)
+    result = a + (b - a) * (pos - lo)
+    result[count == 0] = np.nan
+    return result
+
+
+def winsorize(values, min_percentile=0.0, max_percentile=1.0, mask=None):
+    # clip every date to its own percentiles, all dates sorted at once
+    values, single = _prepare(values, mask)
+    bounds = quantiles(values, [min_percentile, max_percentile])
+    with np.errstate(invalid='ignore'):
+        result = np.clip(values, bounds[:, :1], bounds[:, 1:])
+    return _finish(result, single)
+
+
+_TRANSFORMS = {
+    'rank': lambda v, mask: rank(v, mask, pct=True),
+    'demean': lambda v, mask: demean(v, mask),
+    'zscore': lambda v, mask: zscore(v, mask),
+    'raw': lambda v, mask: _finish(*_prepare(v, mask)),
+}
+
+
+def combine(factors, weights, transform='zscore', limits=None, mask=None, min_factors=1):
+    # weighted blend of several columns of the factor dict; a negative weight prefers low values.
+    # Every column is winsorized to limits (if given) and transformed first. NaN columns of an
+    # asset are left out and the weights of the others are scaled up, unless fewer than
+    # min_factors are left, then the score is NaN.
+    if transform not in _TRANSFORMS:
+        raise ValueError('Unknown transform: ' + str(transform))
+    total = None
+    for column, weight in weights.items():
+        values = factors[column]
+        if limits is not None:
+            values = winsorize(values, limits[0], limits[1], mask)
+        score = np.atleast_2d(_TRANSFORMS[transform](values, mask))
+        valid = ~np.isnan(score)
+        if total is None:
+            single = np.ndim(factors[column]) == 1
+            total = np.zeros(score.shape)
+            weight_sum = np.zeros(score.shape)
+            used = np.zeros(score.shape, dtype=np.int64)
+        total += np.where(valid, score * weight, 0.0)
+        weight_sum += np.where(valid, abs(weight), 0.0)
+        used += valid
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = total / weight_sum
+    result[used < min_factors] = np.nan
+    return _finish(result, single)
+
+
+def add_columns(factors, specs, mask=None):
+    # add transformed columns to the factor dict, specs is {new name: (transform, column)}
+    for name, (transform, column) in specs.items():
+        if transform not in _TRANSFORMS:
+            raise ValueError('Unknown transform: ' + str(transform))
+        factors[name] = _TRANSFORMS[transform](factors[column], mask)
+    return factors
@@ -0,0 +1,378 @@
+"""
+Incremental indicators which advance by one bar in O(1) instead of recomputing their window.
+
+The pipelines of daily_check_ma.py and screen_etf.py compute SimpleMovingAverage, EWMA,
+RSI, PercentChange and the FastStochasticOscillator from the full window every day.
+Here every indicator keeps a small state and update() adds one bar:
+
+    SMA               ring buffer of the window and a running sum
+    EWMA              exact recursion of the weighted sums, with or without a window_length
+    WilderRSI         Wilder smoothing of the gains and losses
+    PercentChange     lag buffer of window_length prices
+    FastStochastic    rolling min of the lows and max of the highs with monotonic deques
+
+Every updater holds n_assets columns and update() takes one value per asset, so a single
+call advances thousands of assets with numpy; update_many() feeds a (bars, assets) array.
+Until the window is full the result is NaN. state() and from_state() (or save() and
+load() for a dict of updaters) let a daily job resume where the last run stopped.
+Prices should be finite, fill the gaps before updating.
+
+Running this file checks every updater against a full recomputation.
+"""
+
+import numpy as np
+
+
+class _Updater(object):
+
+    def __init__(self, n_assets):
+        self.n_assets = n_assets
+
+    def _row(self, value):
+        return np.broadcast_to(np.asarray(value, dtype=np.float64), (self.n_assets,))
+
+    def update_many(self, *bars):
+        # feed (bars, assets) arrays bar by bar, returns the (bars, assets) results
+        bars = [np.atleast_2d(np.asarray(b, dtype=np.float64)) for b in bars]
+        out = np.empty(bars[0].shape)
+        for i in range(bars[0].shape[0]):
+            out[i] = self.update(*[b[i] for b in bars])
+        return out
+
+    def state(self):
+        state = {}
+        # np.load cannot read np.array(None) without pickle, so the attributes which are
+        # None (window_length of an EWMA without a window) are listed under 'none'
+        none = []
+        for key, value in self.__dict__.items():
+            if isinstance(value, _Updater):
+                for inner_key, inner in value.state().items():
+                    state[key + '.' + inner_key] = inner
+            elif value is None:
+                none.append(key)
+            else:
+                state[key] = np.array(value, copy=True)
+        state['class'] = np.array(type(self).__name__)
+        state['none'] = np.array(none, dtype=str)
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        updater = cls.__new__(cls)
+        nested = {}
+        for key, value in state.items():
+            if key == 'class':
+                continue
+            if key == 'none':
+                for none_key in value:
+                    updater.__dict__[str(none_key)] = None
+                continue
+            if '.' in key:
+                outer, inner = key.split('.', 1)
+                nested.setdefault(outer, {})[inner] = value
+                continue
+            value = np.array(value, copy=True)
+            updater.__dict__[key] = value.item() if value.ndim == 0 else value
+        for key, inner in nested.items():
+            updater.__dict__[key] = _CLASSES[str(inner['class'])].from_state(inner)
+        return updater
+
+
+class SMA(_Updater):
+    # re-add the window from the buffer this often, so rounding errors of the running sum
+    # cannot pile up over years of bars
+    resync_every = 1024
+
+    def __init__(self, window, n_assets=1):
+        _Updater.__init__(self, n_assets)
+        self.window = window
+        self.buffer = np.zeros((window, n_assets))
+        self.total = np.zeros(n_assets)
+        self.pos = 0
+        self.count = 0
+
+    def update(self, value):
+        value = self._row(value)
+        if self.count >= self.window:
+            self.total -= self.buffer[self.pos]
+        self.total += value
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % self.window
+        self.count += 1
+        if self.count % self.resync_every == 0:
+            self.total = self.buffer.sum(axis=0)
+        if self.count < self.window:
+            return np.full(self.n_assets, np.nan)
+        return self.total / self.window
+
+
+class EWMA(_Updater):
+    # Weighted average with weights decay ** age, like EWMA of the pipeline.
+    # With a window_length only the last window_length values count, exactly as in the
+    # pipeline; the value leaving the window is removed with its weight decay ** window_length.
+    # Without a window_length all values count, like pandas ewm(adjust=True).
+
+    def __init__(self, decay, window_length=None, n_assets=1):
+        _Updater.__init__(self, n_assets)
+        self.decay = decay
+        self.window_length = window_length
+        self.numerator = np.zeros(n_assets)
+        self.denominator = 0.0
+        self.count = 0
+        if window_length is not None:
+            self.lag = _Lag(window_length, n_assets)
+
+    @classmethod
+    def from_span(cls, span, window_length=None, n_assets=1):
+        return cls(1 - 2.0 / (span + 1), window_length, n_assets)
+
+    def update(self, value):
+        value = self._row(value)
+        self.numerator = self.decay * self.numerator + value
+        self.denominator = self.decay * self.denominator + 1
+        self.count += 1
+        if self.window_length is None:
+            return self.numerator / self.denominator
+        old = self.lag.push(value)
+        if self.count > self.window_length:
+            tail = self.decay ** self.window_length
+            self.numerator -= tail * old
+            self.denominator -= tail
+        if self.count < self.window_length:
+            return np.full(self.n_assets, np.nan)
+        return self.numerator / self.denominator
+
+
+class _Lag(_Updater):
+    # ring buffer which returns the value pushed window_length bars ago
+
+    def __init__(self, window_length, n_assets=1):
+        _Updater.__init__(self, n_assets)
+        self.buffer = np.full((window_length, n_assets), np.nan)
+        self.pos = 0
+
+    def push(self, value):
+        old = self.buffer[self.pos].copy()
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % len(self.buffer)
+        return old
+
+
+class PercentChange(_Updater):
+    # change over the last window_length prices, like PercentChange of the pipeline
+
+    def __init__(self, window_length, n_assets=1):
+        _Updater.__init__(self, n_assets)
+        self.lag = _Lag(window_length - 1, n_assets)
+
+    def update(self, value):
+        value = self._row(value)
+        old = self.lag.push(value)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (value - old) / np.abs(old)
+
+
+class WilderRSI(_Updater):
+    # The first average gain and loss is the mean of the first window changes, after that
+    # average = (previous * (window - 1) + change) / window.
+
+    def __init__(self, window=14, n_assets=1):
+        _Updater.__init__(self, n_assets)
+        self.window = window
+        self.previous = np.full(n_assets, np.nan)
+        self.gain = np.zeros(n_assets)
+        self.loss = np.zeros(n_assets)
+        self.count = 0
+
+    def update(self, value):
+        value = self._row(value)
+        if self.count == 0:
+            self.previous = value.copy()
+            self.count = 1
+            return np.full(self.n_assets, np.nan)
+        change = value - self.previous
+        self.previous = value.copy()
+        gain = np.maximum(change, 0)
+        loss = np.maximum(-change, 0)
+        if self.count <= self.window:
+            self.gain += gain / self.window
+            self.loss += loss / self.window
+        else:
+            self.gain += (gain - self.gain) / self.window
+            self.loss += (loss - self.loss) / self.window
+        self.count += 1
+        if self.count <= self.window:
+            return np.full(self.n_assets, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.loss == 0, 100.0, 100 - 100 / (1 + self.gain / self.loss))
+
+
+class _MonotonicWindow(_Updater):
+    # Rolling min (or max) of the last window values of every asset. Every asset has a
+    # deque of (bar, value) in a ring of size window, whose values only increase (for the
+    # min) from front to back: the front is the minimum, a new value first removes the
+    # larger values at the back and the front expires after window bars. Each value is
+    # pushed and popped at most once, so one bar costs O(1) per asset amortized; the pops
+    # run for all assets together until no asset has one left.
+
+    def __init__(self, window, largest=False, n_assets=1):
+        _Updater.__init__(self, n_assets)
+        self.window = window
+        self.largest = largest
+        self.values = np.zeros((n_assets, window))
+        self.bars = np.zeros((n_assets, window), dtype=np.int64)
+        self.head = np.zeros(n_assets, dtype=np.int64)
+        self.size = np.zeros(n_assets, dtype=np.int64)
+        self.count = 0
+
+    def update(self, value):
+        value = self._row(value)
+        key = -value if self.largest else value
+        rows = np.arange(self.n_assets)
+        # at most one value expires per bar
+        expired = (self.size > 0) & (self.bars[rows, self.head] <= self.count - self.window)
+        self.head[expired] = (self.head[expired] + 1) % self.window
+        self.size[expired] -= 1
+        while True:
+            back = (self.head + self.size - 1) % self.window
+            pop = (self.size > 0) & (self.values[rows, back] >= key)
+            if not pop.any():
+                break
+            self.size[pop] -= 1
+        back = (self.head + self.size) % self.window
+        self.values[rows, back] = key
+        self.bars[rows, back] = self.count
+        self.size += 1
+        self.count += 1
+        front = self.values[rows, self.head]
+        return -front if self.largest else front
+
+
+class FastStochastic(_Updater):
+    # %K = (close - lowest low) / (highest high - lowest low) * 100 over window bars, like the
+    # FastStochasticOscillator of the pipeline; update() returns %K and keeps %D, the SMA of
+    # %K over d_window bars, in self.d
+
+    def __init__(self, window=14, d_window=3, n_assets=1):
+        _Updater.__init__(self, n_assets)
+        self.window = window
+        self.lowest = _MonotonicWindow(window, False, n_assets)
+        self.highest = _MonotonicWindow(window, True, n_assets)
+        self.d_sma = SMA(d_window, n_assets)
+        self.d = np.full(n_assets, np.nan)
+        self.count = 0
+
+    def update(self, close, high=None, low=None):
+        close = self._row(close)
+        low = self.lowest.update(close if low is None else low)
+        high = self.highest.update(close if high is None else high)
+        self.count += 1
+        if self.count < self.window:
+            return np.full(self.n_assets, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            k = (close - low) / (high - low) * 100
+        self.d = self.d_sma.update(k)
+        return k
+
+
+_CLASSES = {c.__name__: c for c in (SMA, EWMA, _Lag, PercentChange, WilderRSI,
+                                    _MonotonicWindow, FastStochastic)}
+
+
+def save(updaters, path):
+    # one .npz file for a dict of named updaters
+    arrays = {}
+    for name, updater in updaters.items():
+        for key, value in updater.state().items():
+            arrays[name + '/' + key] = value
+    np.savez(path, **arrays)
+
+
+def load(path):
+    states = {}
+    with np.load(path) as data:
+        for key in data.files:
+            name, field = key.split('/', 1)
+            states.setdefault(name, {})[field] = data[key]
+    return {name: _CLASSES[str(state['class'])].from_state(state)
+            for name, state in states.items()}
+
+
+def _check():
+    import os
+    import tempfile
+    import time
+
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    bars, assets = 600, 2000
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (bars, assets)), axis=0))
+    high = close * (1 + rng.random((bars, assets)) * 0.01)
+    low = close * (1 - rng.random((bars, assets)) * 0.01)
+    frame = pd.DataFrame(close)
+
+    def compare(name, got, expected):
+        both = ~np.isnan(expected)
+        assert (np.isnan(got) == ~both).all(), name + ': warm-up differs'
+        error = np.max(np.abs(got[both] - expected[both]) / np.maximum(np.abs(expected[both]), 1))
+        print('{0:<16} max relative error {1:.2e}'.format(name, error))
+        assert error < 1e-9, name
+
+    start = time.time()
+    compare('SMA', SMA(20, assets).update_many(close), frame.rolling(20).mean().to_numpy())
+
+    decay = 1 - 2.0 / 21
+    window_length = 60
+    weights = decay ** np.arange(window_length)[::-1]
+    windows = np.lib.stride_tricks.sliding_window_view(close, window_length, axis=0)
+    expected = np.full(close.shape, np.nan)
+    expected[window_length - 1:] = windows @ weights / weights.sum()
+    compare('EWMA window', EWMA.from_span(20, window_length, assets).update_many(close), expected)
+    compare('EWMA', EWMA.from_span(20, None, assets).update_many(close),
+            frame.ewm(span=20, adjust=True).mean().to_numpy())
+
+    compare('PercentChange', PercentChange(126, assets).update_many(close),
+            frame.pct_change(125).to_numpy())
+
+    change = np.diff(close, axis=0)
+    gain, loss = np.maximum(change, 0), np.maximum(-change, 0)
+    expected = np.full(close.shape, np.nan)
+    average_gain, average_loss = gain[:14].mean(axis=0), loss[:14].mean(axis=0)
+    expected[14] = 100 - 100 / (1 + average_gain / average_loss)
+    for i in range(14, bars - 1):
+        average_gain = (average_gain * 13 + gain[i]) / 14
+        average_loss = (average_loss * 13 + loss[i]) / 14
+        expected[i + 1] = 100 - 100 / (1 + average_gain / average_loss)
+    compare('WilderRSI', WilderRSI(14, assets).update_many(close), expected)
+
+    lowest = pd.DataFrame(low).rolling(14).min().to_numpy()
+    highest = pd.DataFrame(high).rolling(14).max().to_numpy()
+    stochastic = FastStochastic(14, 3, assets)
+    compare('FastStochastic', stochastic.update_many(close, high, low),
+            (close - lowest) / (highest - lowest) * 100)
+    print('{0} bars x {1} assets in {2:.2f} s'.format(bars, assets, time.time() - start))
+
+    # stop halfway, save, load and finish: the same result as one run
+    updaters = {'sma': SMA(20, assets), 'ema': EWMA.from_span(20, 60, assets),
+                'ewm': EWMA.from_span(20, None, assets),
+                'stoch': FastStochastic(14, 3, assets), 'rsi': WilderRSI(14, assets)}
+    for updater in updaters.values():
+        updater.update_many(*([close[:300]] if not isinstance(updater, FastStochastic)
+                              else [close[:300], high[:300], low[:300]]))
+    path = os.path.join(tempfile.mkdtemp(), 'indicators.npz')
+    save(updaters, path)
+    resumed = load(path)
+    os.remove(path)
+    assert np.allclose(resumed['stoch'].update_many(close[300:], high[300:], low[300:]),
+                       ((close - lowest) / (highest - lowest) * 100)[300:])
+    assert np.allclose(resumed['sma'].update_many(close[300:]),
+                       frame.rolling(20).mean().to_numpy()[300:])
+    assert resumed['ewm'].window_length is None
+    assert np.allclose(resumed['ewm'].update_many(close[300:]),
+                       frame.ewm(span=20, adjust=True).mean().to_numpy()[300:])
+    print('state saved and resumed')
+
+
+if __name__ == '__main__':
+    _check()
@@ -0,0 +1,524 @@
+"""
+Local pipeline which computes every distinct factor once and keeps the results between runs.
+
+The pipelines of daily_check_ma.py, sma_ema.py and ma_different_time.py all build
+EquityPricing.close.latest and SimpleMovingAverage of the close over the same windows, and
+screen_etf.py takes stoch_d as a SimpleMovingAverage of stoch_k. The terms here are written
+like the quantopian ones, but every term gets a key which hashes its type, its parameters
+and the keys of its inputs. compile_plan() walks the columns and the screen into a DAG with one
+node per key, so a factor built twice, in the same or in another pipeline, is one node.
+
+Plan.run() computes the nodes in topological order over the whole (dates, assets) history
+and looks every node up in a NodeCache first. The cache is keyed on (data version, node
+key), so new prices never return old results; it evicts the least recently used results
+when they take more than max_bytes, and with a directory it also writes every result to
+an .npy file there, so the next notebook run or the other workers of a sweep load a window
+instead of computing it again. The files are bounded the same way by max_disk_bytes, with
+the modification time of a file as the time it was last used.
+
+The columns of several pipelines compiled together keep their own names: run() returns
+one dict of columns per pipeline.
+
+Every term has the value of the close of its row; the result of run() is shifted by one
+day like the pipeline, the values of a date come from the data before it.
+
+Running this file compiles the three pipelines together and checks them against direct
+computations.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import rolling_stats
+
+default_cache_bytes = 512 << 20
+default_disk_bytes = 4 << 30
+# the order of the inputs of these terms does not change their key
+_COMMUTATIVE = ('add', 'mul', 'and', 'or')
+
+
+class Term(object):
+
+    def __init__(self, kind, inputs=(), **params):
+        self.kind = kind
+        self.inputs = tuple(inputs)
+        self.params = params
+        input_keys = [term.key for term in self.inputs]
+        if kind in _COMMUTATIVE:
+            input_keys.sort()
+        definition = repr((kind, sorted(params.items()), input_keys))
+        self.key = hashlib.sha1(definition.encode('utf-8')).hexdigest()
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.kind, self.key[:8])
+
+    @property
+    def latest(self):
+        return Term('latest', (self,))
+
+    def _binary(self, kind, other):
+        if not isinstance(other, Term):
+            other = Term('constant', value=float(other))
+        return Term(kind, (self, other))
+
+    def __lt__(self, other):
+        return self._binary('lt', other)
+
+    def __le__(self, other):
+        return self._binary('le', other)
+
+    def __gt__(self, other):
+        return self._binary('gt', other)
+
+    def __ge__(self, other):
+        return self._binary('ge', other)
+
+    def __add__(self, other):
+        return self._binary('add', other)
+
+    def __sub__(self, other):
+        return self._binary('sub', other)
+
+    def __mul__(self, other):
+        return self._binary('mul', other)
+
+    def __truediv__(self, other):
+        return self._binary('div', other)
+
+    def __and__(self, other):
+        return self._binary('and', other)
+
+    def __or__(self, other):
+        return self._binary('or', other)
+
+    def __invert__(self):
+        return Term('not', (self,))
+
+    # terms are graph nodes, == builds no comparison term, so they stay usable as dict keys
+    __hash__ = object.__hash__
+
+
+class EquityPricing(object):
+    open = Term('column', name='open')
+    high = Term('column', name='high')
+    low = Term('column', name='low')
+    close = Term('column', name='close')
+    volume = Term('column', name='volume')
+
+
+def SimpleMovingAverage(inputs, window_length):
+    return Term('sma', inputs, window_length=int(window_length))
+
+
+def EWMA(inputs, window_length, decay_rate):
+    return Term('ewma', inputs, window_length=int(window_length), decay_rate=float(decay_rate))
+
+
+def ewma_from_span(inputs, window_length, span):
+    # EWMA.from_span
+    return EWMA(inputs, window_length, 1 - 2.0 / (span + 1))
+
+
+def PercentChange(inputs, window_length):
+    return Term('percent_change', inputs, window_length=int(window_length))
+
+
+def RSI(inputs=(EquityPricing.close,), window_length=15):
+    return Term('rsi', inputs, window_length=int(window_length))
+
+
+def FastStochasticOscillator(inputs=(EquityPricing.close, EquityPricing.low, EquityPricing.high),
+                             window_length=14):
+    return Term('fast_stochastic', inputs, window_length=int(window_length))
+
+
+def _windows(values, window_length):
+    # (rows - window_length + 1, assets, window_length) view of every complete window
+    return np.lib.stride_tricks.sliding_window_view(values, window_length, axis=0)
+
+
+def _ending_at(values, window_length, result):
+    # the result of every complete window in the row of its last day, NaN before
+    out = np.full(values.shape, np.nan)
+    out[window_length - 1:] = result
+    return out
+
+
+def _sma(params, values):
+    return rolling_stats.rolling_mean(values, params['window_length'], workers=1)
+
+
+def _ewma(params, values):
+    window_length = params['window_length']
+    if len(values) < window_length:
+        return np.full(values.shape, np.nan)
+    weights = params['decay_rate'] ** np.arange(window_length)[::-1]
+    averages = _windows(values, window_length) @ weights / weights.sum()
+    return _ending_at(values, window_length, averages)
+
+
+def _percent_change(params, values):
+    window_length = params['window_length']
+    if len(values) < window_length:
+        return np.full(values.shape, np.nan)
+    old = values[:len(values) - window_length + 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return _ending_at(values, window_length, (values[window_length - 1:] - old) / np.abs(old))
+
+
+def _rsi(params, values):
+    # mean gain against mean loss of the diffs of window_length values
+    window_length = params['window_length']
+    diffs = np.diff(values, axis=0)
+    ups = rolling_stats.rolling_mean(np.clip(diffs, 0, None), window_length - 1, workers=1)
+    downs = -rolling_stats.rolling_mean(np.clip(diffs, None, 0), window_length - 1, workers=1)
+    result = np.full(values.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result[1:] = 100 - 100 / (1 + ups / downs)
+    return result
+
+
+def _fast_stochastic(params, close, low, high):
+    window_length = params['window_length']
+    if len(close) < window_length:
+        return np.full(close.shape, np.nan)
+    lowest = _ending_at(close, window_length, np.nanmin(_windows(low, window_length), axis=-1))
+    highest = _ending_at(close, window_length, np.nanmax(_windows(high, window_length), axis=-1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (close - lowest) / (highest - lowest) * 100
+
+
+_COMPUTE = {
+    'latest': lambda params, values: values,
+    'sma': _sma,
+    'ewma': _ewma,
+    'percent_change': _percent_change,
+    'rsi': _rsi,
+    'fast_stochastic': _fast_stochastic,
+    'lt': lambda params, a, b: a < b,
+    'le': lambda params, a, b: a <= b,
+    'gt': lambda params, a, b: a > b,
+    'ge': lambda params, a, b: a >= b,
+    'add': lambda params, a, b: a + b,
+    'sub': lambda params, a, b: a - b,
+    'mul': lambda params, a, b: a * b,
+    'div': lambda params, a, b: a / b,
+    'and': lambda params, a, b: a & b,
+    'or': lambda params, a, b: a | b,
+    'not': lambda params, a: ~a,
+}
+
+
+def data_version(data):
+    # digest of the arrays of a dataset; a file name and its modification time work as well
+    digest = hashlib.sha1()
+    for name in sorted(data):
+        array = np.ascontiguousarray(data[name])
+        digest.update('{0}{1}{2}'.format(name, array.shape, array.dtype.str).encode('utf-8'))
+        digest.update(array.data)
+    return digest.hexdigest()
+
+
+class NodeCache(object):
+    # least recently used node results up to max_bytes, optionally backed by .npy files up
+    # to max_disk_bytes
+
+    def __init__(self, max_bytes=default_cache_bytes, directory=None,
+                 max_disk_bytes=default_disk_bytes):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{0}-{1}.npy'.format(*key))
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.directory and os.path.exists(self._path(key)):
+            value = np.load(self._path(key), mmap_mode='r')
+            # the file was used now, so it is evicted last
+            os.utime(self._path(key))
+            self._remember(key, value)
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if (self.directory and value.nbytes <= self.max_disk_bytes and
+                not os.path.exists(self._path(key))):
+            # write and rename, so a worker never loads a half written file
+            temporary = self._path(key) + '.{0}.tmp'.format(os.getpid())
+            with open(temporary, 'wb') as f:
+                np.save(f, value)
+            os.replace(temporary, self._path(key))
+            self._evict_files()
+        self._remember(key, value)
+
+    def _evict_files(self):
+        # the least recently used files first, until they fit in max_disk_bytes; other
+        # processes may remove the same files at the same time
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _remember(self, key, value):
+        if key in self.entries or value.nbytes > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.bytes += value.nbytes
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+
+# shared by every plan which is run without its own cache
+shared_cache = NodeCache()
+
+
+class Plan(object):
+    # the unique nodes of some pipelines in topological order
+
+    def __init__(self, nodes, outputs, screen, single=True):
+        # outputs: one {column: node key} per pipeline
+        self.nodes = nodes
+        self.outputs = outputs
+        self.screen = screen
+        self.single = single
+        self.computed = 0
+
+    def run(self, data, version=None, cache=None):
+        # data: {'close', 'high', ...} arrays of (dates, assets); returns {column: (dates, assets)}
+        # with 'screen' as a boolean column, shifted by one day like the pipeline, or a list
+        # of them for a plan of several pipelines
+        if cache is None:
+            cache = shared_cache
+        if version is None:
+            version = data_version(data)
+        values = {}
+        self.computed = 0
+        for node in self.nodes:
+            if node.kind == 'column':
+                values[node.key] = np.asarray(data[node.params['name']], dtype=np.float64)
+                continue
+            if node.kind == 'constant':
+                values[node.key] = node.params['value']
+                continue
+            value = cache.get((version, node.key))
+            if value is None:
+                inputs = [values[term.key] for term in node.inputs]
+                value = _COMPUTE[node.kind](node.params, *inputs)
+                cache.put((version, node.key), value)
+                self.computed += 1
+            values[node.key] = value
+        results = []
+        for outputs in self.outputs:
+            result = {name: _yesterday(values[key]) for name, key in outputs.items()}
+            if self.screen is not None:
+                result['screen'] = _yesterday(values[self.screen])
+            results.append(result)
+        return results[0] if self.single else results
+
+
+def _yesterday(values):
+    values = np.asarray(values)
+    if values.dtype == np.bool_:
+        shifted = np.zeros(values.shape, dtype=np.bool_)
+    else:
+        shifted = np.full(values.shape, np.nan)
+    shifted[1:] = values[:-1]
+    return shifted
+
+
+def compile_plan(columns, screen=None):
+    # columns: {name: term}, or a list of such dicts for pipelines which run together
+    single = isinstance(columns, dict)
+    if single:
+        columns = [columns]
+    nodes = OrderedDict()
+
+    def visit(term):
+        # iterative depth first walk, a node is added after all of its inputs
+        stack = [(term, False)]
+        while stack:
+            current, ready = stack.pop()
+            if current.key in nodes:
+                continue
+            if ready:
+                nodes[current.key] = current
+                continue
+            stack.append((current, True))
+            for inner in reversed(current.inputs):
+                if inner.key not in nodes:
+                    stack.append((inner, False))
+
+    outputs = []
+    for pipeline in columns:
+        outputs.append(OrderedDict())
+        for name, term in pipeline.items():
+            visit(term)
+            outputs[-1][name] = term.key
+    if screen is not None:
+        visit(screen)
+        screen = screen.key
+    return Plan(list(nodes.values()), outputs, screen, single)
+
+
+def _sma_ema_columns(fast_ma_periods=10, slow_ma_periods=20, fast_ma_type='sma',
+                     slow_ma_type='sma', rsi_period=5):
+    # make_pipeline() of sma_ema.py, with its column names, which trade() reads
+    def moving_average(periods, kind):
+        if kind == 'sma':
+            return SimpleMovingAverage([EquityPricing.close], periods)
+        return ewma_from_span([EquityPricing.close], periods * 2 + 20, periods)
+    return {
+        'price': EquityPricing.close.latest,
+        'fast_ma': moving_average(fast_ma_periods, fast_ma_type),
+        'slow_ma': moving_average(slow_ma_periods, slow_ma_type),
+        'rsi': RSI([EquityPricing.close], rsi_period),
+    }
+
+
+def _daily_check_ma_columns():
+    fast_ma = SimpleMovingAverage([EquityPricing.close], 10)
+    slow_ma = SimpleMovingAverage([EquityPricing.close], 20)
+    price = EquityPricing.close.latest
+    return {
+        'yersterday_price': price,
+        'ma_fast': fast_ma,
+        'ma_slow': slow_ma,
+        'rsi': RSI([EquityPricing.close], 5),
+        'signal_sell': (price < fast_ma) & (price < slow_ma),
+        'signal_buy': (price > fast_ma) & (price > slow_ma),
+    }
+
+
+def _screen_etf_columns():
+    stoch_k = FastStochasticOscillator([EquityPricing.close, EquityPricing.low, EquityPricing.high])
+    return {
+        'return_6m': PercentChange([EquityPricing.close], 126),
+        'return_1m': PercentChange([EquityPricing.close], 21),
+        'return_2w': PercentChange([EquityPricing.close], 10),
+        'stoch_d': SimpleMovingAverage([stoch_k], 4),
+        'rsi_15': RSI([EquityPricing.close]),
+    }
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    import pandas as pd
+
+    import universe_runner
+
+    rng = np.random.default_rng(0)
+    dates, assets = 2520, 200
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, (dates, assets)), axis=0))
+    high = close * (1 + rng.uniform(0, 0.01, close.shape))
+    low = close * (1 - rng.uniform(0, 0.01, close.shape))
+    data = {'close': close, 'high': high, 'low': low}
+
+    pipelines = [_daily_check_ma_columns(), _screen_etf_columns()]
+    # the same column names in every pipeline of sma_ema.py
+    for fast, slow, kind in [(10, 20, 'sma'), (10, 20, 'ewma'), (5, 20, 'sma'), (10, 30, 'sma')]:
+        pipelines.append(_sma_ema_columns(fast, slow, kind, kind))
+    screen = PercentChange([EquityPricing.close], 10) >= PercentChange([EquityPricing.close], 21)
+    plan = compile_plan(pipelines, screen)
+    terms = sum(len(p) for p in pipelines) + 1
+    print('{0} columns compile to {1} nodes'.format(terms, len(plan.nodes)))
+
+    memory = NodeCache()
+    start = time.time()
+    results = plan.run(data, cache=memory)
+    result = dict(results[0], **results[1])
+    first, computed = time.time() - start, plan.computed
+    start = time.time()
+    again = plan.run(data, cache=memory)
+    print('first run {0:.3f} s ({1} nodes computed), second run {2:.3f} s ({3} computed)'.format(
+        first, computed, time.time() - start, plan.computed))
+    assert plan.computed == 0
+
+    # a new data version computes again
+    changed = dict(data, close=close * 1.01)
+    plan.run(changed, cache=memory)
+    assert plan.computed == computed
+
+    # a small cache keeps to its bound
+    small = NodeCache(max_bytes=close.nbytes * 3)
+    plan.run(data, cache=small)
+    assert small.bytes <= small.max_bytes and len(small.entries) == 3
+
+    # a second process finds the results in the directory
+    with tempfile.TemporaryDirectory() as directory:
+        plan.run(data, cache=NodeCache(directory=directory))
+        other = compile_plan(_screen_etf_columns())
+        other.run(data, cache=NodeCache(directory=directory))
+        assert other.computed == 0
+    # and the files keep to their bound, the ones used last stay
+    with tempfile.TemporaryDirectory() as directory:
+        bounded = NodeCache(directory=directory, max_disk_bytes=close.nbytes * 3)
+        plan.run(data, cache=bounded)
+        files = [os.path.join(directory, name) for name in os.listdir(directory)]
+        assert len(files) == 3 and sum(os.path.getsize(f) for f in files) <= close.nbytes * 3
+        kept = bounded.entries
+        assert all(os.path.exists(bounded._path(key)) for key in list(kept)[-3:])
+
+    # against direct computations
+    frame = pd.DataFrame(close)
+    expected = frame.rolling(10).mean().shift(1).to_numpy()
+    assert np.allclose(result['ma_fast'], expected, equal_nan=True)
+    assert np.allclose(result['yersterday_price'][1:], close[:-1])
+    assert (result['signal_buy'][1:] == ((close > frame.rolling(10).mean().to_numpy()) &
+                                         (close > frame.rolling(20).mean().to_numpy()))[:-1]).all()
+    for column in range(0, assets, 37):
+        windows = np.lib.stride_tricks.sliding_window_view(close[:, column], 40)
+        weights = (1 - 2.0 / 11) ** np.arange(40)[::-1]
+        assert np.allclose(results[3]['fast_ma'][40:, column],
+                           (windows @ weights / weights.sum())[:-1])
+    assert sorted(results[2]) == ['fast_ma', 'price', 'rsi', 'screen', 'slow_ma']
+    assert np.allclose(results[2]['price'][1:], close[:-1])
+    # every pipeline keeps its own columns of the same name
+    assert np.allclose(results[2]['fast_ma'], result['ma_fast'], equal_nan=True)
+    assert not np.allclose(results[4]['fast_ma'], result['ma_fast'], equal_nan=True)
+    last = dates - 1
+    history = slice(0, last)
+    assert np.allclose(result['return_6m'][last],
+                       universe_runner.percent_change(close[history], 126))
+    assert np.allclose(result['rsi_15'][last], universe_runner.rsi(close[history]))
+    assert np.allclose(result['stoch_d'][last],
+                       universe_runner.stoch_d(close[history], high[history], low[history]))
+    with np.errstate(invalid='ignore'):
+        assert (result['screen'] == (result['return_2w'] >= result['return_1m'])).all()
+    print('ok')
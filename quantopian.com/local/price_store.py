@@ -0,0 +1,213 @@
+"""
+Raw daily bars with splits and dividends applied at read time, as of the query date.
+
+get_pricing()['price'] and EquityPricing.close were adjusted on quantopian; with raw
+prices the 126 day pct_change of screen_etf.py and every moving average of the
+algorithms jump on a split day. PriceStore keeps the raw bars as they were traded and the
+corporate actions as a list of events, and nothing stored is ever rewritten:
+
+    raw bars        one (dates, assets) .npy file per field, read with mmap
+    actions.csv     ticker, ex_date, kind (split or dividend), value; a split of 4 for 1 has
+                    value 4, a dividend the cash amount per share
+
+From the events it builds, once and in memory, the cumulative factor of every asset up
+to every date (the product of the ratios of all ex dates up to it; a dividend ratio is
+1 - amount / close before the ex date). The price of date t adjusted as of date q is then
+
+    raw[t] * cumulative[q] / cumulative[t]
+
+like the pipeline, which adjusts a window for the actions up to the simulation date
+only. A window of any length as of any date is a slice of the raw bars and the same
+slice of the factors, so only the bars which are read are adjusted and nothing of the
+size of the whole store is copied. Volumes are adjusted for the splits only, inversely.
+"""
+
+import csv
+import json
+import os
+
+import numpy as np
+
+price_fields = ('open', 'high', 'low', 'close')
+
+
+class PriceStore(object):
+
+    def __init__(self, dates, tickers, fields, actions=()):
+        # fields: {'close', ...} arrays of (dates, assets) raw prices, actions: (ticker,
+        # ex_date, kind, value) tuples
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.tickers = list(tickers)
+        self.column = {t: i for i, t in enumerate(self.tickers)}
+        self.fields = fields
+        self.actions = []
+        self._cumulative = None
+        for action in actions:
+            self.add_action(*action)
+
+    def add_action(self, ticker, ex_date, kind, value):
+        if kind not in ('split', 'dividend'):
+            raise ValueError('Unknown corporate action: {0}'.format(kind))
+        self.actions.append((ticker, str(np.datetime64(ex_date, 'D')), kind, float(value)))
+        self._cumulative = None
+
+    def _build(self):
+        # cumulative price and split factors of (dates, assets), from the log ratios of the
+        # ex dates summed up over the dates
+        logs = {'price': np.zeros((len(self.dates), len(self.tickers))),
+                'split': np.zeros((len(self.dates), len(self.tickers)))}
+        known = [a for a in self.actions if a[0] in self.column]
+        if known:
+            columns = np.array([self.column[a[0]] for a in known], dtype=np.int64)
+            rows = np.searchsorted(self.dates, np.array([a[1] for a in known],
+                                                        dtype='datetime64[D]'))
+            values = np.array([a[3] for a in known])
+            split = np.array([a[2] == 'split' for a in known])
+            # an ex date before the first date changes every row alike, after the last none
+            inside = (rows > 0) & (rows < len(self.dates))
+            close = self.fields['close']
+            before = close[np.maximum(rows - 1, 0), columns]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ratios = np.where(split, 1 / values, 1 - values / before)
+            inside &= np.isfinite(ratios) & (ratios > 0)
+            np.add.at(logs['price'], (rows[inside], columns[inside]), np.log(ratios[inside]))
+            inside &= split
+            np.add.at(logs['split'], (rows[inside], columns[inside]), np.log(ratios[inside]))
+        self._cumulative = {kind: np.exp(np.cumsum(value, axis=0))
+                            for kind, value in logs.items()}
+
+    def _factors(self, field):
+        if self._cumulative is None:
+            self._build()
+        return self._cumulative['split' if field == 'volume' else 'price']
+
+    def _row(self, date, side):
+        return int(np.searchsorted(self.dates, np.datetime64(date, 'D'), side=side))
+
+    def window(self, field, start=None, end=None, tickers=None, as_of=None):
+        # (dates, assets) of the field from start to end, adjusted as of as_of (default end)
+        first = 0 if start is None else self._row(start, 'left')
+        stop = len(self.dates) if end is None else self._row(end, 'right')
+        # an as_of before the first date applies nothing, like the first row
+        query = max(stop - 1 if as_of is None else self._row(as_of, 'right') - 1, 0)
+        columns = slice(None) if tickers is None else [self.column[t] for t in tickers]
+        factors = self._factors(field)
+        block = self.fields[field][first:stop][:, columns]
+        ratios = factors[query][columns] / factors[first:stop][:, columns]
+        if field == 'volume':
+            return block / ratios
+        return block * ratios
+
+    def raw(self, field, start=None, end=None, tickers=None):
+        first = 0 if start is None else self._row(start, 'left')
+        stop = len(self.dates) if end is None else self._row(end, 'right')
+        columns = slice(None) if tickers is None else [self.column[t] for t in tickers]
+        return self.fields[field][first:stop][:, columns]
+
+    def save(self, directory):
+        # a field file is written when it is new or its bars differ (more dates or tickers,
+        # a corrected bar) and left alone when it is the same, it may be the file a loaded
+        # store maps; actions.csv is rewritten with the whole list of events
+        os.makedirs(directory, exist_ok=True)
+        for name, values in self.fields.items():
+            if values.shape != (len(self.dates), len(self.tickers)):
+                raise ValueError('{0} has shape {1}, not dates x tickers {2}'.format(
+                    name, values.shape, (len(self.dates), len(self.tickers))))
+        np.save(os.path.join(directory, 'dates.npy'), self.dates)
+        with open(os.path.join(directory, 'tickers.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.tickers, f)
+        for name, values in self.fields.items():
+            path = os.path.join(directory, name + '.npy')
+            if os.path.exists(path):
+                stored = np.load(path, mmap_mode='r')
+                same = stored.shape == values.shape and stored.dtype == values.dtype and \
+                    np.array_equal(stored, values, equal_nan=values.dtype.kind == 'f')
+                del stored
+                if same:
+                    continue
+            # a new file replaces the old one, a store which maps the old one keeps it
+            np.save(path + '.tmp.npy', values)
+            os.replace(path + '.tmp.npy', path)
+        path = os.path.join(directory, 'actions.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ticker', 'ex_date', 'kind', 'value'])
+            writer.writerows(self.actions)
+
+
+def load(directory):
+    dates = np.load(os.path.join(directory, 'dates.npy'))
+    with open(os.path.join(directory, 'tickers.json'), 'r', encoding='utf-8') as f:
+        tickers = json.load(f)
+    fields = {}
+    for name in price_fields + ('volume',):
+        path = os.path.join(directory, name + '.npy')
+        if os.path.exists(path):
+            fields[name] = np.load(path, mmap_mode='r')
+    actions = []
+    path = os.path.join(directory, 'actions.csv')
+    if os.path.exists(path):
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            actions = [(r['ticker'], r['ex_date'], r['kind'], r['value'])
+                       for r in csv.DictReader(f)]
+    return PriceStore(dates, tickers, fields, actions)
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    rng = np.random.default_rng(0)
+    days, assets = 2520, 500
+    dates = np.arange(np.datetime64('2010-01-04'), np.datetime64('2010-01-04') + days)
+    adjusted = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, (days, assets)), axis=0))
+    tickers = ['T{0}'.format(i) for i in range(assets)]
+
+    # raw prices of an asset with a 4 for 1 split on day 1000 and a dividend on day 1500
+    raw = adjusted.copy()
+    raw[:1000, 0] *= 4
+    dividend = 0.02 * raw[1499, 0]
+    raw[:1500, 0] += dividend * raw[:1500, 0] / raw[1499, 0]
+    volume = np.full((days, assets), 1000.0)
+    volume[1000:, 0] = 4000.0
+    store = PriceStore(dates, tickers, {'close': raw, 'volume': volume},
+                       [('T0', dates[1000], 'split', 4), ('T0', dates[1500], 'dividend', dividend),
+                        ('UNKNOWN', dates[10], 'split', 2)])
+
+    # as of the last date the 126 day change over the split and the dividend is the real one
+    close = store.window('close', tickers=['T0'])[:, 0]
+    assert np.allclose(close[1126] / close[1000 - 1] - 1, adjusted[1126, 0] / adjusted[999, 0] - 1)
+    assert np.allclose(close[1500:], raw[1500:, 0])
+    assert np.allclose(store.window('volume')[:, 0], 4000.0)
+    # point in time: a window which ends before the split is not adjusted for it
+    assert np.allclose(store.window('close', end=dates[999])[:, 0], raw[:1000, 0])
+    # a window as of the day after the split sees the split only
+    after = store.window('close', dates[900], dates[1100], as_of=dates[1001])[:, 0]
+    assert np.allclose(after[:100], raw[900:1000, 0] / 4)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store.save(directory)
+        loaded = load(directory)
+        assert np.allclose(loaded.window('close'), store.window('close'))
+        # saving the loaded store again keeps its files, a longer history rewrites them
+        loaded.save(directory)
+        longer = PriceStore(np.append(dates, dates[-1] + 1), tickers,
+                            {'close': np.vstack([raw, raw[-1:]]),
+                             'volume': np.vstack([volume, volume[-1:]])}, store.actions)
+        longer.save(directory)
+        assert np.allclose(loaded.window('close'), store.window('close'))
+        assert load(directory).fields['close'].shape == (days + 1, assets)
+        assert np.allclose(load(directory).window('close', end=dates[-1]), store.window('close'))
+
+        loops = 200
+        start = time.time()
+        for i in range(loops):
+            np.array(loaded.raw('close', dates[i], dates[i + 252]))
+        unadjusted = time.time() - start
+        loaded.window('close')
+        start = time.time()
+        for i in range(loops):
+            loaded.window('close', dates[i], dates[i + 252])
+        print('{0} windows of 252 x {1}: raw {2:.3f} s, adjusted {3:.3f} s'.format(
+            loops, assets, unadjusted, time.time() - start))
+    print('ok')
@@ -0,0 +1,137 @@
+"""
+Turn target weights into whole share orders, in place of order_optimal_portfolio(TargetWeights).
+
+handle_transactions() of sma_ema.py only asks for {asset: 1.0}, {asset: 0} or
+{out_of_market: 1.0}, but a strategy over many assets needs the orders for a whole vector
+of weights, with the constraints a broker has: whole lots, no more than the cash there is,
+and a cap on how much is traded in one day. rebalance() does that without an optimizer,
+in a fixed number of array operations over all assets (and over a leading axis of runs,
+so all parameter sets of a sweep rebalance together):
+
+1. target shares = weight * (value - cash_buffer) / price, rounded toward zero to lots
+2. with max_turnover, all trades are scaled by the same factor so the traded value stays
+   within max_turnover * value, again rounded toward zero to lots
+3. when the buys need more cash than the cash plus the sells bring, the buys are scaled
+   down by the same factor and rounded down to lots
+4. greedy top up: the rounding leaves every asset less than one lot from its scaled
+   target; the assets whose missing value is at least half a lot get one more lot, most
+   missing first, while the cash and the turnover left pay for it
+
+Weights of assets which are not given are 0 like in TargetWeights. An asset without a
+price is not traded. Turnover is the sum of the absolute traded values over the value.
+"""
+
+import numpy as np
+
+
+def _to_lots(shares, lots):
+    # toward zero, so neither a buy nor a sell grows by the rounding
+    return np.trunc(shares / lots) * lots
+
+
+def rebalance(weights, prices, positions, cash, lot_size=1, max_turnover=None, cash_buffer=0.0):
+    # weights, prices, positions: (..., assets), cash: (...); they broadcast to one shape, so
+    # shared prices and positions go with a batch of cash. Returns the orders in shares
+    # (..., assets) and the cash after them
+    weights, prices, positions, cash, lots = [np.asarray(a, dtype=np.float64) for a in
+                                              (weights, prices, positions, cash, lot_size)]
+    weights, prices, positions, cash, lots = np.broadcast_arrays(weights, prices, positions,
+                                                                 cash[..., None], lots)
+    cash = cash[..., 0]
+    shape = weights.shape
+
+    priced = np.isfinite(prices) & (prices > 0)
+    safe_prices = np.where(priced, prices, 1.0)
+    value = cash + np.where(priced, positions * safe_prices, 0).sum(axis=-1)
+    investable = np.maximum(value - cash_buffer, 0)[..., None]
+
+    target = np.where(priced, weights * investable / safe_prices, positions)
+    orders = np.where(priced, _to_lots(target - positions, lots), 0)
+
+    budget = np.full(value.shape, np.inf)
+    if max_turnover is not None:
+        budget = max_turnover * value
+        traded = (np.abs(orders) * safe_prices).sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scale = np.where(traded > budget, budget / traded, 1.0)[..., None]
+        orders = _to_lots(orders * scale, lots)
+        target = positions + (target - positions) * scale
+
+    buys = np.clip(orders, 0, None) * safe_prices
+    available = cash + (np.clip(-orders, 0, None) * safe_prices).sum(axis=-1) - cash_buffer
+    needed = buys.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(needed > available, np.maximum(available, 0) / needed, 1.0)[..., None]
+    orders = np.where(orders > 0, np.floor(orders * scale / lots) * lots, orders)
+    target = np.where(target > positions, positions + (target - positions) * scale, target)
+
+    # one more lot for the assets furthest below their target, while the cash and the
+    # turnover left pay for it
+    cash_left = cash - (orders * safe_prices).sum(axis=-1) - cash_buffer
+    turnover_left = budget - (np.abs(orders) * safe_prices).sum(axis=-1)
+    lot_values = lots * safe_prices
+    missing = (target - positions - orders) * safe_prices
+    wanted = priced & (missing >= lot_values / 2)
+    order = np.argsort(-np.where(wanted, missing, -np.inf), axis=-1)
+    costs = np.take_along_axis(np.where(wanted, lot_values, 0), order, axis=-1)
+    spent = np.cumsum(costs, axis=-1)
+    fits = (spent <= cash_left[..., None]) & (spent <= turnover_left[..., None])
+    fits &= np.take_along_axis(wanted, order, axis=-1)
+    extra = np.zeros(shape)
+    np.put_along_axis(extra, order, fits * np.take_along_axis(lots, order, axis=-1), axis=-1)
+    orders = orders + extra
+
+    return orders.astype(np.int64), cash - (orders * safe_prices).sum(axis=-1)
+
+
+def target_weights(objective, assets):
+    # the weights array of opt.TargetWeights({asset: weight}), 0 for the assets not in it
+    column = {asset: i for i, asset in enumerate(assets)}
+    weights = np.zeros(len(assets))
+    for asset, weight in objective.items():
+        weights[column[asset]] = weight
+    return weights
+
+
+if __name__ == '__main__':
+    import time
+
+    # handle_transactions of sma_ema.py: all in VGT, then switch to the out of market fund
+    assets = ['VGT', 'BIL']
+    prices = np.array([300.0, 91.5])
+    orders, cash = rebalance(target_weights({'VGT': 1.0}, assets), prices, [0, 0], 100000)
+    assert list(orders) == [333, 0] and cash == 100000 - 333 * 300.0
+    orders, cash = rebalance(target_weights({'BIL': 1.0}, assets), prices, [333, 0], cash)
+    assert list(orders) == [-333, 1092] and 0 <= cash < 91.5
+
+    rng = np.random.default_rng(0)
+    runs, n = 200, 3000
+    prices = rng.uniform(5, 500, (runs, n))
+    prices[:, :10] = np.nan
+    positions = rng.integers(0, 50, (runs, n)) * 10
+    weights = rng.dirichlet(np.ones(n), runs)
+    cash = rng.uniform(0, 1e5, runs)
+    lots = 10
+    start = time.time()
+    orders, cash_after = rebalance(weights, prices, positions, cash, lot_size=lots,
+                                   max_turnover=0.5, cash_buffer=100)
+    print('{0} runs x {1} assets in {2:.3f} s'.format(runs, n, time.time() - start))
+
+    value = cash + np.nansum(positions * prices, axis=-1)
+    traded = np.nansum(np.abs(orders) * prices, axis=-1)
+    assert (orders % lots == 0).all() and (orders[:, :10] == 0).all()
+    assert (cash_after >= 100 - 1e-6).all()
+    assert (traded <= 0.5 * value + 1e-6).all()
+
+    # with 5% left in cash and no turnover cap every asset ends within one lot of its weight
+    weights *= 0.95
+    orders, cash_after = rebalance(weights, prices, positions, cash, lot_size=lots)
+    held = np.where(np.isnan(prices), 0, (positions + orders) * np.nan_to_num(prices))
+    wanted = weights * value[:, None]
+    assert (np.abs(held - wanted)[:, 10:] <= lots * prices[:, 10:] + 1e-6).all()
+    assert (cash_after >= -1e-6).all()
+
+    # one set of weights, prices and positions with a batch of cash
+    orders, cash_after = rebalance([1.0], [10.0], [0], np.array([100.0, 5.0]))
+    assert orders.tolist() == [[10], [0]] and cash_after.tolist() == [0.0, 5.0]
+    print('ok')
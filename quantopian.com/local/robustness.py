@@ -0,0 +1,213 @@
+"""
+Robustness of the sma_ema.py strategy over thousands of resampled price histories.
+
+One backtest on the history of VGT is one draw. Here the days of the history are
+resampled into new paths and the vectorized engine of sma_ema_backtest.py runs the
+parameter sets on every path:
+
+    bootstrap   stationary block bootstrap (Politis and Romano): a path copies blocks of
+                consecutive days of random start and geometric length (mean_block days on
+                average), so the autocorrelation within a block, which the moving averages
+                trade on, is kept
+    regimes     the history is cut where the sign of the trailing regime_days return
+                changes, and the regimes are put together in a random order
+
+A day is resampled as a whole: the return of the close and of the out-of-market fund, and
+the decision and fill prices relative to the close, so their relations stay real.
+
+The source arrays are put into shared memory once and every worker of the pool attaches
+to them. The paths are cut into batches and every batch draws from its own stream of a
+SeedSequence spawned from the seed, so the result does not depend on the number of workers
+or the order the batches run in. The summary gives the distribution of the total return,
+the max drawdown and the number of trades of every parameter set, and where the real
+history falls in it.
+
+Usage: python robustness.py [<prices.csv> [paths]]
+prices.csv has a date column and the close, decision, fill and out_close columns; without
+it the paths are drawn from random prices.
+"""
+
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+import sma_ema_backtest
+
+# shared_arrays.py is in the top directory of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+import shared_arrays  # noqa: E402
+
+mean_block = 20
+regime_days = 63
+batch_paths = 25
+
+# arrays of the pool workers, attached to the shared memory by shared_arrays.attach
+_shared = shared_arrays.attached
+
+
+def day_table(close, decision, fill, out_close):
+    # (days - 1, 4): log return of the close, decision / close, fill / close, log return
+    # of the out-of-market fund; a day is drawn as one row
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.column_stack([np.diff(np.log(close)), decision[1:] / close[1:],
+                                fill[1:] / close[1:], np.diff(np.log(out_close))])
+
+
+def bootstrap_index(rng, n, paths, days, mean_block=mean_block):
+    # (paths, days) source rows of the stationary block bootstrap
+    new_block = rng.random((paths, days)) < 1.0 / mean_block
+    new_block[:, 0] = True
+    starts = rng.integers(0, n, (paths, days))
+    position = np.arange(days)
+    # the position where the block of every day starts
+    block_start = np.maximum.accumulate(np.where(new_block, position, 0), axis=1)
+    first = np.take_along_axis(starts, block_start, axis=1)
+    return (first + position - block_start) % n
+
+
+def regimes(log_returns, days=regime_days):
+    # (start, stop) of every run of days with the same sign of the trailing return
+    trailing = pd.Series(np.cumsum(log_returns)).diff(days).to_numpy()
+    sign = np.sign(np.nan_to_num(trailing))
+    cuts = np.flatnonzero(np.diff(sign) != 0) + 1
+    bounds = np.concatenate([[0], cuts, [len(log_returns)]])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def regime_index(rng, bounds, paths):
+    rows = []
+    for _ in range(paths):
+        order = rng.permutation(len(bounds))
+        rows.append(np.concatenate([np.arange(*bounds[i]) for i in order]))
+    return np.array(rows)
+
+
+def build_path(table, rows, start_close, start_out):
+    # the prices of one path from the drawn rows of the day table
+    drawn = table[rows]
+    close = start_close * np.exp(np.concatenate([[0], np.cumsum(drawn[:, 0])]))
+    out_close = start_out * np.exp(np.concatenate([[0], np.cumsum(drawn[:, 3])]))
+    decision = close * np.concatenate([[np.nan], drawn[:, 1]])
+    fill = close * np.concatenate([[np.nan], drawn[:, 2]])
+    return close, decision, fill, out_close
+
+
+def _max_drawdown(equity):
+    peak = np.maximum.accumulate(equity, axis=-1)
+    return (equity / peak - 1).min(axis=-1)
+
+
+def run_path(close, decision, fill, out_close, grid):
+    # total return, max drawdown and trades of every parameter set, (3, params)
+    equity, trades = sma_ema_backtest.run_vectorized(close, decision, fill, grid,
+                                                     out_close, out_close)
+    return np.array([equity[:, -1] - 1, _max_drawdown(equity),
+                     np.bincount(trades['params'], minlength=len(grid))])
+
+
+def run_batch(job):
+    # (paths, 3, params) results of the paths of one batch
+    kind, paths, seed, grid, bounds = job
+    rng = np.random.default_rng(seed)
+    table = _shared['table']
+    days = len(table)
+    if kind == 'bootstrap':
+        index = bootstrap_index(rng, days, paths, days)
+    else:
+        index = regime_index(rng, bounds, paths)
+    start_close, start_out = _shared['start']
+    return np.array([run_path(*build_path(table, rows, start_close, start_out), grid=grid)
+                     for rows in index])
+
+
+def run_all(close, decision, fill, out_close, grid=None, paths=1000, kind='bootstrap',
+            seed=0, workers=None):
+    # (paths, 3, params) results on the resampled paths and (3, params) on the history
+    if grid is None:
+        grid = [dict(sma_ema_backtest.DEFAULTS)]
+    table = day_table(close, decision, fill, out_close)
+    bounds = regimes(table[:, 0]) if kind == 'regimes' else None
+    sizes = [min(batch_paths, paths - i) for i in range(0, paths, batch_paths)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(kind, size, s, grid, bounds) for size, s in zip(sizes, seeds)]
+
+    blocks, specs = shared_arrays.share({'table': table,
+                                         'start': np.array([close[0], out_close[0]])})
+    try:
+        if workers is None:
+            workers = min(os.cpu_count() or 1, len(jobs))
+        with Pool(max(workers, 1), initializer=shared_arrays.attach,
+                  initargs=(specs,)) as pool:
+            results = pool.map(run_batch, jobs, chunksize=1)
+    finally:
+        shared_arrays.release(blocks)
+    history = run_path(close, decision, fill, out_close, grid)
+    return np.concatenate(results), history
+
+
+def summarize(results, history, grid_size):
+    rows = []
+    names = ('total_return', 'max_drawdown', 'trades')
+    for params in range(grid_size):
+        for i, name in enumerate(names):
+            values = results[:, i, params]
+            q = np.percentile(values, [5, 25, 50, 75, 95])
+            rows.append({'params': params, 'measure': name, 'mean': values.mean(),
+                         'std': values.std(), 'p5': q[0], 'p25': q[1], 'median': q[2],
+                         'p75': q[3], 'p95': q[4], 'history': history[i, params],
+                         'history_percentile': (values < history[i, params]).mean() * 100})
+        rows.append({'params': params, 'measure': 'loss_probability',
+                     'mean': (results[:, 0, params] < 0).mean()})
+    return pd.DataFrame(rows)
+
+
+def load_prices(path):
+    frame = pd.read_csv(path, index_col=0, parse_dates=True).sort_index()
+    return [frame[c].to_numpy(dtype=np.float64) for c in ('close', 'decision', 'fill', 'out_close')]
+
+
+def _check():
+    rng = np.random.default_rng(0)
+    index = bootstrap_index(rng, 500, 200, 2000, mean_block=20)
+    continued = np.diff(index, axis=1) % 500 == 1
+    assert abs(continued.mean() - 0.95) < 0.01
+    assert abs(np.bincount(index.ravel(), minlength=500).std() /
+               np.bincount(index.ravel(), minlength=500).mean()) < 0.1
+    bounds = regimes(rng.normal(0, 0.01, 1000))
+    path = regime_index(rng, bounds, 3)
+    assert (np.sort(path, axis=1) == np.arange(1000)).all()
+    # the rows of the history in order rebuild the history
+    close, decision, fill, out_close = sma_ema_backtest.random_prices(300)
+    table = day_table(close, decision, fill, out_close)
+    rebuilt = build_path(table, np.arange(len(table)), close[0], out_close[0])
+    assert np.allclose(rebuilt[0], close) and np.allclose(rebuilt[3], out_close)
+    assert np.allclose(rebuilt[1][1:], decision[1:], equal_nan=True)
+
+
+def main(args):
+    _check()
+    if args:
+        close, decision, fill, out_close = load_prices(args[0])
+    else:
+        close, decision, fill, out_close = sma_ema_backtest.random_prices(2520)
+    paths = int(args[1]) if len(args) > 1 else 200
+    grid = sma_ema_backtest.param_grid(fast_ma_periods=[5, 10], slow_ma_periods=[20, 50])
+    for kind in ('bootstrap', 'regimes'):
+        start = time.time()
+        results, history = run_all(close, decision, fill, out_close, grid, paths, kind)
+        print('{0}: {1} paths x {2} parameter sets in {3:.1f} s'.format(
+            kind, paths, len(grid), time.time() - start))
+        print(summarize(results, history, len(grid)).to_string(
+            float_format=lambda x: '{0:.4f}'.format(x)))
+    # the same seed gives the same paths with another number of workers
+    one = run_all(close, decision, fill, out_close, grid[:1], 30, seed=1, workers=1)[0]
+    two = run_all(close, decision, fill, out_close, grid[:1], 30, seed=1, workers=2)[0]
+    assert np.array_equal(one, two)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,199 @@
+"""
+Rolling mean, variance, covariance and correlation which stay accurate over long histories.
+
+A running sum over decades of minute bars subtracts the value leaving the window from a
+total which keeps growing, and the rounding errors of every step stay in it. Here:
+
+- the series is split into chunks; every chunk restarts its sums (re-anchoring) and is
+  shifted by its own mean, so the sums stay small and the variance formula does not
+  subtract two large numbers (the same protection the Welford update gives);
+- the prefix sums of a chunk are compensated: the rounding error of every addition is
+  recovered exactly (TwoSum) and summed separately, like Kahan summation but vectorized;
+- chunks overlap by window - 1 rows, so every window lies completely inside one chunk,
+  chunks need nothing from each other and run in parallel threads, and stitching them
+  is a plain concatenation;
+- NaN values are left out of the sums and a window with a NaN gives NaN.
+
+Arrays are (rows, series) or 1-d; x and y of the pairwise functions are matched column by
+column. correlation_matrix() is the one-date correlation of screen_etf.py, with the
+pairwise complete observations of DataFrame.corr().
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# rows per chunk, and so how often the sums restart
+chunk_rows = 1 << 16
+
+
+def _compensated_cumsum(values):
+    # cumulative sums plus the exact rounding error of every addition, summed on its own
+    sums = np.cumsum(values, axis=0)
+    previous = np.zeros_like(sums)
+    previous[1:] = sums[:-1]
+    added = sums - previous
+    errors = (previous - (sums - added)) + (values - added)
+    return sums, np.cumsum(errors, axis=0)
+
+
+def _window_sums(values, window):
+    # sums of every complete window of the chunk, len(values) - window + 1 rows
+    sums, errors = _compensated_cumsum(values)
+    zero = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate([zero, sums])
+    errors = np.concatenate([zero, errors])
+    return (sums[window:] - sums[:-window]) + (errors[window:] - errors[:-window])
+
+
+def _chunk_stats(kind, x, y, window, ddof):
+    valid = ~np.isnan(x)
+    if y is not None:
+        valid &= ~np.isnan(y)
+    count = _window_sums(valid.astype(np.float64), window)
+    complete = count > window - 0.5
+    with np.errstate(invalid='ignore'):
+        anchor_x = np.nanmean(np.where(valid, x, np.nan), axis=0)
+    anchor_x = np.nan_to_num(anchor_x)
+    dx = np.where(valid, x - anchor_x, 0.0)
+    sx = _window_sums(dx, window)
+    if kind == 'mean':
+        result = anchor_x + sx / window
+    else:
+        if y is None:
+            dy, sy = dx, sx
+        else:
+            with np.errstate(invalid='ignore'):
+                anchor_y = np.nan_to_num(np.nanmean(np.where(valid, y, np.nan), axis=0))
+            dy = np.where(valid, y - anchor_y, 0.0)
+            sy = _window_sums(dy, window)
+        sxy = _window_sums(dx * dy, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = (sxy - sx * sy / window) / (window - ddof)
+            if kind in ('var', 'cov'):
+                result = cov
+            else:
+                var_x = (_window_sums(dx * dx, window) - sx * sx / window) / (window - ddof)
+                var_y = (_window_sums(dy * dy, window) - sy * sy / window) / (window - ddof)
+                result = cov / np.sqrt(np.maximum(var_x, 0) * np.maximum(var_y, 0))
+        if kind == 'var':
+            result = np.maximum(result, 0)
+    return np.where(complete, result, np.nan)
+
+
+def _rolling(kind, x, y, window, ddof, chunk, workers):
+    x = np.asarray(x, dtype=np.float64)
+    single = x.ndim == 1
+    x = x.reshape(len(x), -1)
+    if y is not None:
+        y = np.asarray(y, dtype=np.float64).reshape(x.shape)
+    rows = len(x)
+    result = np.full(x.shape, np.nan)
+    if rows >= window:
+        chunk = max(chunk, window)
+        # output rows [start, stop) need the input rows [start - window + 1, stop)
+        bounds = [(start, min(start + chunk, rows)) for start in range(window - 1, rows, chunk)]
+
+        def run(bound):
+            start, stop = bound
+            part = slice(start - window + 1, stop)
+            result[start:stop] = _chunk_stats(kind, x[part], None if y is None else y[part],
+                                              window, ddof)
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and len(bounds) > 1:
+            # numpy releases the GIL inside the array operations, so threads are enough
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(run, bounds))
+        else:
+            for bound in bounds:
+                run(bound)
+    return result[:, 0] if single else result
+
+
+def rolling_mean(x, window, chunk=chunk_rows, workers=None):
+    return _rolling('mean', x, None, window, 0, chunk, workers)
+
+
+def rolling_var(x, window, ddof=1, chunk=chunk_rows, workers=None):
+    return _rolling('var', x, None, window, ddof, chunk, workers)
+
+
+def rolling_std(x, window, ddof=1, chunk=chunk_rows, workers=None):
+    return np.sqrt(rolling_var(x, window, ddof, chunk, workers))
+
+
+def rolling_cov(x, y, window, ddof=1, chunk=chunk_rows, workers=None):
+    return _rolling('cov', x, y, window, ddof, chunk, workers)
+
+
+def rolling_corr(x, y, window, chunk=chunk_rows, workers=None):
+    return _rolling('corr', x, y, window, 1, chunk, workers)
+
+
+def correlation_matrix(x):
+    # Correlation of every pair of columns over the rows where both have values, like
+    # DataFrame.corr(). The columns are centered first (two pass), then every sum over the
+    # pairwise complete rows is one matrix product.
+    x = np.asarray(x, dtype=np.float64)
+    valid = ~np.isnan(x)
+    weights = valid.astype(np.float64)
+    with np.errstate(invalid='ignore'):
+        centered = np.where(valid, x - np.nanmean(x, axis=0), 0.0)
+    count = weights.T @ weights
+    sx = centered.T @ weights
+    sxx = (centered * centered).T @ weights
+    sxy = centered.T @ centered
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # sx[i, j] is the sum of column i over the rows where j has a value too
+        cov = sxy - sx * sx.T / count
+        var_x = sxx - sx * sx / count
+        cor = cov / np.sqrt(var_x * var_x.T)
+    cor[count < 2] = np.nan
+    return np.clip(cor, -1, 1)
+
+
+if __name__ == '__main__':
+    import time
+
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    # ten years of minute bars around a high price level, where running sums lose digits
+    rows = 252 * 390 * 10
+    prices = 1e4 + np.cumsum(rng.normal(0, 0.01, (rows, 2)), axis=0)
+    prices[1000:1003, 0] = np.nan
+    window = 390
+
+    start = time.time()
+    mean = rolling_mean(prices, window)
+    var = rolling_var(prices, window)
+    corr = rolling_corr(prices[:, 0], prices[:, 1], window)
+    print('{0} rows in {1:.2f} s'.format(rows, time.time() - start))
+
+    # exact reference on a sample of windows
+    ends = rng.integers(window - 1, rows, 200)
+    for end in ends:
+        block = prices[end - window + 1:end + 1]
+        if np.isnan(block).any():
+            assert np.isnan(mean[end, 0]) and np.isnan(corr[end])
+            continue
+        assert abs(mean[end, 1] - np.mean(block[:, 1])) < 1e-9
+        assert abs(var[end, 1] - np.var(block[:, 1], ddof=1)) < 1e-9 * np.var(block[:, 1])
+        assert abs(corr[end] - np.corrcoef(block, rowvar=False)[0, 1]) < 1e-9
+    assert np.isnan(mean[1000:1000 + window, 0]).all()
+
+    # the same result in one chunk and in many chunks
+    assert np.allclose(rolling_var(prices[:50000], window, chunk=4096),
+                       rolling_var(prices[:50000], window, chunk=50000), equal_nan=True)
+
+    naive = pd.Series(prices[:, 1]).rolling(window).var().to_numpy()
+    print('largest difference to the pandas running sums: {0:.2e}'.format(
+        np.nanmax(np.abs(naive - var[:, 1]))))
+
+    daily = rng.normal(0, 1, (252, 50)).cumsum(axis=0)
+    daily[rng.random(daily.shape) < 0.05] = np.nan
+    assert np.allclose(correlation_matrix(daily), pd.DataFrame(daily).corr().to_numpy())
+    print('ok')
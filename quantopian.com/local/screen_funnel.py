@@ -0,0 +1,158 @@
+"""
+Declarative multi-stage screening funnel.
+
+The tail of screen_etf.py keeps the ETFs above the median of return_6m, then above the
+median of return_1m, then of return_2w, and finally takes the 5 smallest rsi.
+Here the same funnel is a list of stages:
+
+    SCREEN_ETF_FUNNEL = [
+        compare('return_2w', '>=', 'return_1m'),
+        quantile_above('return_6m', 0.5),
+        quantile_above('return_1m', 0.5),
+        quantile_above('return_2w', 0.5),
+        bottom_k('rsi', 5),
+    ]
+
+The factors are a dict of column name -> array, either (assets,) for one date or
+(dates, assets) for a history. Stages only update a boolean mask over that matrix,
+nothing is copied. For one date, quantiles and top/bottom k use np.partition.
+For a history, all dates are screened at once: quantiles come from one sort per
+row, because the number of survivors differs from date to date, and top/bottom k
+use one np.argpartition call.
+"""
+
+import operator
+
+import numpy as np
+
+_OPS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+
+def quantile_above(column, q=0.5):
+    # keep values strictly above the q quantile of the survivors
+    return {'kind': 'quantile', 'column': column, 'q': q, 'op': '>'}
+
+
+def quantile_below(column, q=0.5):
+    return {'kind': 'quantile', 'column': column, 'q': q, 'op': '<'}
+
+
+def threshold(column, op, value):
+    return {'kind': 'threshold', 'column': column, 'op': op, 'value': value}
+
+
+def compare(column, op, other):
+    return {'kind': 'compare', 'column': column, 'op': op, 'other': other}
+
+
+def top_k(column, k):
+    return {'kind': 'top', 'column': column, 'k': k}
+
+
+def bottom_k(column, k):
+    return {'kind': 'bottom', 'column': column, 'k': k}
+
+
+SCREEN_ETF_FUNNEL = [
+    compare('return_2w', '>=', 'return_1m'),
+    quantile_above('return_6m', 0.5),
+    quantile_above('return_1m', 0.5),
+    quantile_above('return_2w', 0.5),
+    bottom_k('rsi', 5),
+]
+
+
+def _quantile(values, mask, q):
+    # q quantile of the masked values of every row, linear interpolation like np.quantile
+    count = mask.sum(axis=1)
+    padded = np.where(mask, values, np.inf)
+    pos = (count - 1) * q
+    lo = np.floor(pos).astype(np.int64).clip(0)
+    hi = np.ceil(pos).astype(np.int64).clip(0)
+    if values.shape[0] == 1:
+        kth = np.unique([lo[0], hi[0]])
+        ordered = np.partition(padded[0], kth)[None, :]
+    else:
+        ordered = np.sort(padded, axis=1)
+    a = np.take_along_axis(ordered, lo[:, None], axis=1)[:, 0]
+    b = np.take_along_axis(ordered, hi[:, None], axis=1)[:, 0]
+    with np.errstate(invalid='ignore'):
+        result = a + (b - a) * (pos - lo)
+    result[count == 0] = np.nan
+    return result
+
+
+def _select_k(values, mask, k, largest):
+    # k largest or smallest masked values of every row
+    keys = np.where(mask, -values if largest else values, np.inf)
+    n = keys.shape[1]
+    if k >= n:
+        return mask
+    picked = np.argpartition(keys, k - 1, axis=1)[:, :k]
+    selected = np.zeros_like(mask)
+    np.put_along_axis(selected, picked, True, axis=1)
+    return selected & mask
+
+
+def apply_stage(factors, mask, stage):
+    values = np.atleast_2d(factors[stage['column']])
+    valid = mask & ~np.isnan(values)
+    kind = stage['kind']
+    if kind == 'quantile':
+        cut = _quantile(values, valid, stage['q'])
+        with np.errstate(invalid='ignore'):
+            return valid & _OPS[stage['op']](values, cut[:, None])
+    if kind == 'threshold':
+        with np.errstate(invalid='ignore'):
+            return valid & _OPS[stage['op']](values, stage['value'])
+    if kind == 'compare':
+        other = np.atleast_2d(factors[stage['other']])
+        with np.errstate(invalid='ignore'):
+            return valid & _OPS[stage['op']](values, other)
+    if kind in ('top', 'bottom'):
+        return _select_k(values, valid, stage['k'], kind == 'top')
+    raise ValueError('Unknown stage: ' + str(kind))
+
+
+def run_funnel(factors, stages, universe=None):
+    # boolean mask of the survivors, shaped like the factor arrays
+    first = np.asarray(factors[stages[0]['column']])
+    mask = np.ones(np.atleast_2d(first).shape, dtype=np.bool_)
+    if universe is not None:
+        mask &= np.atleast_2d(universe)
+    for stage in stages:
+        mask = apply_stage(factors, mask, stage)
+    return mask[0] if first.ndim == 1 else mask
+
+
+def ranked(factors, mask, column, ascending=True):
+    # survivors of one date ordered by a column, like candidates['rsi'].nsmallest(5)
+    idx = np.flatnonzero(mask)
+    order = np.argsort(factors[column][idx], kind='stable')
+    if not ascending:
+        order = order[::-1]
+    return idx[order]
+
+
+def from_pipeline_result(frame, columns=None):
+    # factor dict of one date from a pipeline result DataFrame indexed by asset
+    if columns is None:
+        columns = list(frame.columns)
+    factors = {c: frame[c].to_numpy(dtype=np.float64) for c in columns}
+    return factors, list(frame.index)
+
+
+def backtest(factors, stages, forward_returns, universe=None):
+    # screen every date at once, return the selection and the mean forward return per date
+    mask = run_funnel(factors, stages, universe)
+    held = mask & ~np.isnan(forward_returns)
+    picked = np.where(held, forward_returns, 0.0)
+    count = held.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_return = picked.sum(axis=1) / count
+    return mask, mean_return
@@ -0,0 +1,529 @@
+"""
+Fast local backtest of the trade() rules of sma_ema.py for many parameter sets at once.
+
+trade() in sma_ema.py is a small state machine which advances one call per day: it counts
+consecutive buy and sell signals of yesterday's close against the moving averages, buys
+when the price 30 minutes before the close confirms, sells (into the out-of-market fund)
+when it confirms, the position is older than threshold_hold_days and the RSI gated
+extra_sell_req holds, re-buys aggressively after more than threshold_signal_count sells,
+and closes the position to stop a loss.
+
+run_vectorized() keeps that state as arrays over the parameter sets and advances all
+of them with one set of array operations per day. The indicators are computed once per
+distinct (periods, type) and shared by the parameter sets which use them, the signal
+counters once per group of parameter sets which count alike, and the arrays of all
+parameter sets are only touched on the days an order is possible. run_event() is
+the same rules written the way trade() is, one parameter set and one day per call;
+test_sma_ema_backtest.py checks that both give the same trades and equity curves, and
+those of trade() of sma_ema.py itself, and running this file times them.
+
+The prices are per day:
+    close       daily close, the pipeline values of a day come from the closes before it
+    decision    the price trade() sees when it decides (30 minutes before the close)
+    fill        the price the orders of the day are filled at
+decision and fill can also have one column per variant of the decision time, variant then
+gives the column every parameter set uses (see decision_sweep.py).
+"""
+
+import itertools
+import time
+
+import numpy as np
+
+import rolling_stats
+
+# the parameters of initialize() in sma_ema.py
+DEFAULTS = {
+    'fast_ma_periods': 10,
+    'slow_ma_periods': 20,
+    'rsi_period': 5,
+    'slow_ma_type': 'sma',
+    'fast_ma_type': 'sma',
+    'threshold_signal_count': 2,
+    'aggressive_buy': True,
+    'threshold_sell_loss': -0.05,
+    'threshold_sell_win': 0.1,
+    'threshold_stop_loss': -0.05,
+    'threshold_hold_days': 1,
+    'move_fund_out_of_market': True,
+}
+
+
+def param_grid(**values):
+    # every combination of the given lists, the other parameters keep their defaults
+    names = list(values)
+    grid = []
+    for combination in itertools.product(*[values[n] for n in names]):
+        params = dict(DEFAULTS)
+        params.update(zip(names, combination))
+        grid.append(params)
+    return grid
+
+
+def moving_average(close, periods, kind):
+    # SimpleMovingAverage, or EWMA.from_span with window_length = periods * 2 + 20
+    if kind == 'sma':
+        return rolling_stats.rolling_mean(close, periods, workers=1)
+    window_length = periods * 2 + 20
+    weights = (1 - 2.0 / (periods + 1)) ** np.arange(window_length)[::-1]
+    result = np.full(close.shape, np.nan)
+    if len(close) >= window_length:
+        windows = np.lib.stride_tricks.sliding_window_view(close, window_length)
+        result[window_length - 1:] = windows @ weights / weights.sum()
+    return result
+
+
+def rsi(close, window_length):
+    # RSI of the pipeline: mean gain against mean loss of the diffs of window_length closes
+    diffs = np.diff(close)
+    ups = rolling_stats.rolling_mean(np.clip(diffs, 0, None), window_length - 1, workers=1)
+    downs = -rolling_stats.rolling_mean(np.clip(diffs, None, 0), window_length - 1, workers=1)
+    result = np.full(close.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result[1:] = 100 - 100 / (1 + ups / downs)
+    return result
+
+
+def _yesterday(values):
+    shifted = np.full(values.shape, np.nan)
+    shifted[1:] = values[:-1]
+    return shifted
+
+
+def pipeline_values(close, grid):
+    # The pipeline columns every day: 'price' (days,) and a (days, indicators) table with
+    # every distinct moving average and RSI once; 'fast_ma', 'slow_ma' and 'rsi' give the
+    # column of every parameter set in that table.
+    columns = {}
+    table = []
+
+    def column(key, compute):
+        if key not in columns:
+            columns[key] = len(table)
+            table.append(_yesterday(compute()))
+        return columns[key]
+
+    index = {'fast_ma': [], 'slow_ma': [], 'rsi': []}
+    for p in grid:
+        for name in ('fast', 'slow'):
+            periods, kind = p[name + '_ma_periods'], p[name + '_ma_type']
+            index[name + '_ma'].append(column(('ma', periods, kind),
+                                              lambda: moving_average(close, periods, kind)))
+        index['rsi'].append(column(('rsi', p['rsi_period']), lambda: rsi(close, p['rsi_period'])))
+    pipe = {name: np.array(values, dtype=np.int64) for name, values in index.items()}
+    pipe['price'] = _yesterday(close)
+    pipe['table'] = np.ascontiguousarray(np.array(table).T)
+    return pipe
+
+
+KINDS = (None, 'buy', 'sell', 'stop')
+
+
+def _column(grid, name, dtype=np.float64):
+    return np.array([p[name] for p in grid], dtype=dtype)
+
+
+def _flags(pipe, decision, variant):
+    # The comparisons of the prices with the indicators do not depend on the state, so they
+    # are made for all days at once, once per distinct (fast, slow, rsi, variant) combination.
+    # Returns the (days, flags, combinations) flags, the combination of every parameter set
+    # and the variant of every combination.
+    keys = np.stack([pipe['fast_ma'], pipe['slow_ma'], pipe['rsi'], variant], axis=1)
+    combinations, combination = np.unique(keys, axis=0, return_inverse=True)
+    table = pipe['table']
+    fast = table[:, combinations[:, 0]]
+    slow = table[:, combinations[:, 1]]
+    rsi_today = table[:, combinations[:, 2]]
+    price = pipe['price'][:, None]
+    current = decision[:, combinations[:, 3]]
+    up = (price > fast) & (price > slow)        # yesterday's close above both averages
+    down = (price < slow) & (price < fast)
+    above = rsi_today >= 50
+    below = rsi_today < 50
+    flags = np.stack([
+        up, down, ~up, ~down,
+        fast > slow,
+        (current > fast) & (current > slow),    # the price 30 minutes before the close confirms
+        (current < slow) & (current < fast),
+        below,
+        ~(above | below),                       # NaN RSI
+    ], axis=1)
+    return flags, combination.ravel(), combinations[:, 3]
+
+
+def _by_day(values, days):
+    if values is None:
+        return np.ones((days, 1))
+    values = np.asarray(values, dtype=np.float64)
+    return values.reshape(days, -1)
+
+
+def _signals(buy_count, sell_count, flags, signal_count, aggressive):
+    # one day of the signal counters of trade(); returns the new counters and buy and sell
+    up, down, not_up, not_down, trend, confirm_buy, confirm_sell = flags[:7]
+    buy_count = (buy_count + up) * not_down
+    sell_count = (sell_count + down) * not_up
+    buy = (buy_count >= signal_count) & confirm_buy
+    buy_count *= ~buy
+    again = sell_count > signal_count
+    not_again = ~again
+    # aggressive buy
+    buy = (again & (aggressive | trend)) | (not_again & buy)
+    sell = (again & ~buy) | (not_again & (sell_count >= signal_count) & confirm_sell)
+    sell_count *= not_again
+    return buy_count, sell_count, buy, sell
+
+
+def run_vectorized(close, decision, fill, grid, out_close=None, out_fill=None, pipe=None,
+                   variant=None):
+    # Returns the (params, days) equity curves, starting from 1.0, and the trades as arrays
+    # 'params', 'day', 'kind' (a code of KINDS) and 'price', sorted by parameter set and day.
+    # Without out_close the money out of the market is cash.
+    if pipe is None:
+        pipe = pipeline_values(close, grid)
+    n, days = len(grid), len(close)
+    decision = _by_day(decision, days)
+    fill = np.broadcast_to(_by_day(fill, days), decision.shape)
+    out_fill = np.broadcast_to(_by_day(out_fill, days), decision.shape)
+    if variant is None:
+        variant = np.zeros(n, dtype=np.int64)
+    flags, combination, combination_variant = _flags(pipe, decision, variant)
+    # The signal counters only depend on the flags, threshold_signal_count and
+    # aggressive_buy, so they are kept once per group of parameter sets with the same three
+    # (a few hundred groups for thousands of sets). Only a stop loss, which resets the
+    # counters of one set, makes a set leave its group; its own counters are kept until they
+    # meet those of the group again, which the next day against the trend usually does.
+    keys = np.stack([combination, _column(grid, 'threshold_signal_count', np.int64),
+                     _column(grid, 'aggressive_buy', np.int64)], axis=1)
+    groups, group = np.unique(keys, axis=0, return_inverse=True)
+    group = group.ravel()
+    # the parameter sets are run ordered by group, so that the values of a group are spread
+    # to its parameter sets with np.repeat instead of a much slower gather
+    order = np.argsort(group, kind='stable')
+    repeats = np.bincount(group, minlength=len(groups))
+    group = group[order]
+    grid = [grid[i] for i in order]
+    variant = np.asarray(variant)[order]
+    group_variant = combination_variant[groups[:, 0]]
+    group_flags = flags[:, :, groups[:, 0]]
+    group_signal_count = groups[:, 1].astype(np.int32)
+    group_aggressive = groups[:, 2].astype(np.bool_)
+    sell_loss = _column(grid, 'threshold_sell_loss')
+    sell_win = _column(grid, 'threshold_sell_win')
+    stop_loss = _column(grid, 'threshold_stop_loss')
+    highest_stop_loss = stop_loss.max()
+    hold_limit = _column(grid, 'threshold_hold_days', np.int32)
+    move_out = _column(grid, 'move_fund_out_of_market', np.bool_) & (out_close is not None)
+
+    buy_count = np.zeros(len(groups), dtype=np.int32)
+    sell_count = np.zeros(len(groups), dtype=np.int32)
+    # the parameter sets with their own counters after a stop loss
+    own = np.zeros(0, dtype=np.int64)
+    own_buy_count = np.zeros(0, dtype=np.int32)
+    own_sell_count = np.zeros(0, dtype=np.int32)
+    hold_days = np.zeros(n, dtype=np.int32)
+    holding = np.zeros(n, dtype=np.bool_)
+    shares = np.zeros(n)
+    out_shares = np.zeros(n)
+    cash = np.ones(n)
+    cost = np.ones(n)
+    result = np.empty((n, days))
+    # the equity of the parameter sets is kept for 64 days at a time and then written to
+    # their rows of the result in one transposed copy, which is much faster than a copy of
+    # the whole (days, params) array at the end
+    block = np.empty((min(days, 64), n))
+    none = np.zeros(0, dtype=np.int64)
+    no_stop = np.zeros(0, dtype=np.bool_)
+    # the values of the groups which are spread to their parameter sets
+    group_values = np.empty((2, len(groups)))
+    group_masks = np.empty((3, len(groups)), dtype=np.bool_)
+    # the rows and kinds of the orders of every day
+    traded = []
+
+    # Masks are applied by multiplying with booleans, which is several times faster than
+    # np.where or a masked assignment when the mask changes from one parameter set to the
+    # next. Only a few parameter sets trade on a day, so the orders update just those.
+    for day in range(days):
+        today = decision[day]
+        if not np.isnan(today).all():
+            day_flags = group_flags[day]
+            group_current = today[group_variant]
+            # trade() returns at once without a price, nothing of that parameter set changes
+            group_missing = np.isnan(group_current)
+            any_missing = group_missing.any()
+            new_buy_count, new_sell_count, group_buy, group_sell = _signals(
+                buy_count, sell_count, day_flags, group_signal_count, group_aggressive)
+            if any_missing:
+                new_buy_count[group_missing] = buy_count[group_missing]
+                new_sell_count[group_missing] = sell_count[group_missing]
+                group_buy &= ~group_missing
+                group_sell &= ~group_missing
+            buy_count, sell_count = new_buy_count, new_sell_count
+            if len(own):
+                own_group = group[own]
+                counts = _signals(own_buy_count, own_sell_count, day_flags[:, own_group],
+                                  group_signal_count[own_group], group_aggressive[own_group])
+                if any_missing:
+                    own_missing = group_missing[own_group]
+                    own_buy_count = np.where(own_missing, own_buy_count, counts[0])
+                    own_sell_count = np.where(own_missing, own_sell_count, counts[1])
+                    own_buy, own_sell = counts[2] & ~own_missing, counts[3] & ~own_missing
+                else:
+                    own_buy_count, own_sell_count, own_buy, own_sell = counts
+
+            # Most days nobody can buy, sell or stop: a buy needs a buy signal, a sell a sell
+            # signal and a stop loss a drop of the price below the threshold. The arrays of
+            # all parameter sets are only made for the orders which are possible.
+            price = pipe['price'][day]
+            group_drop = (group_current - price) / price
+            opened = closed = stopped = parked = none
+            closed_stop = no_stop
+            if group_buy.any() or (len(own) and own_buy.any()):
+                buy = np.repeat(group_buy, repeats)
+                if len(own):
+                    buy[own] = own_buy
+                # a stop loss is only possible while holding, so it never meets a buy
+                opened = np.flatnonzero(buy & ~holding)
+            if (group_sell.any() or (len(own) and own_sell.any()) or
+                    (group_drop < highest_stop_loss).any()):
+                group_values[0], group_values[1] = group_current, group_drop
+                group_masks[0], group_masks[1:] = group_sell, day_flags[7:]
+                current, drop = np.repeat(group_values, repeats, axis=1)
+                sell, below, no_rsi = np.repeat(group_masks, repeats, axis=1)
+                if len(own):
+                    sell[own] = own_sell
+                # only read for the parameter sets which hold the asset
+                return_percent = (current - cost) / cost
+                losing = return_percent < sell_loss
+                stop = holding & losing & (drop < stop_loss)
+                # extra_sell_req; a NaN RSI is neither >= 50 nor < 50 and leaves the sell free
+                extra = (return_percent > sell_win) | (below & losing) | no_rsi
+                do_sell = sell & (hold_days > hold_limit) & extra & (holding ^ stop)
+                closed = np.flatnonzero(stop | do_sell)
+                closed_stop = stop[closed]
+                stopped = closed[closed_stop]
+                parked = closed[do_sell[closed] & move_out[closed]]
+
+            hold_days += 1
+            if any_missing:
+                hold_days[np.repeat(group_missing, repeats)] -= 1
+            if len(opened) or len(closed):
+                fill_today, out_today = fill[day], out_fill[day]
+                cash[closed] += shares[closed] * fill_today[variant[closed]]
+                shares[closed] = 0
+                out_shares[parked] = cash[parked] / out_today[variant[parked]]
+                cash[parked] = 0
+                price_fill = fill_today[variant[opened]]
+                shares[opened] = ((cash[opened] + out_shares[opened] * out_today[variant[opened]]) /
+                                  price_fill)
+                cash[opened] = 0
+                out_shares[opened] = 0
+                cost[opened] = price_fill
+                holding[closed] = False
+                holding[opened] = True
+                # a stop loss returns before the counters are kept and hold_days is counted
+                hold_days[closed] = 1
+                hold_days[opened] = 1
+                hold_days[stopped] = 0
+                rows = np.concatenate([opened, closed])
+                traded.append((day, rows, np.concatenate([np.ones(len(opened), dtype=np.int8),
+                                                          2 + closed_stop.astype(np.int8)])))
+            if len(stopped):
+                kept = ~stop[own]
+                own = np.concatenate([own[kept], stopped])
+                own_buy_count = np.concatenate([own_buy_count[kept], np.zeros(len(stopped),
+                                                                              dtype=np.int32)])
+                own_sell_count = np.concatenate([own_sell_count[kept], np.zeros(len(stopped),
+                                                                                dtype=np.int32)])
+            if len(own):
+                own_group = group[own]
+                apart = ((own_buy_count != buy_count[own_group]) |
+                         (own_sell_count != sell_count[own_group]))
+                own, own_buy_count, own_sell_count = (own[apart], own_buy_count[apart],
+                                                      own_sell_count[apart])
+        row = block[day % len(block)]
+        np.multiply(shares, close[day], out=row)
+        row += cash
+        if out_close is not None:
+            row += out_shares * out_close[day]
+        if day % len(block) == len(block) - 1 or day == days - 1:
+            first = day - day % len(block)
+            result[order, first:day + 1] = block[:day + 1 - first].T
+
+    days_traded = np.repeat(np.array([t[0] for t in traded], dtype=np.int64),
+                            [len(t[1]) for t in traded])
+    rows, kinds = [np.concatenate([t[i] for t in traded]) if traded else
+                   np.zeros(0, dtype=np.int64) for i in (1, 2)]
+    params = order[rows]
+    by_params = np.lexsort((days_traded, params))
+    rows, days_traded = rows[by_params], days_traded[by_params]
+    trades = {'params': params[by_params], 'day': days_traded,
+              'kind': kinds[by_params].astype(np.int8), 'price': fill[days_traded, variant[rows]]}
+    return result, trades
+
+
+def trade_list(trades, index):
+    # the trades of one parameter set as (day, kind, price), the form run_event returns
+    lo, hi = np.searchsorted(trades['params'], [index, index + 1])
+    return [(int(d), KINDS[k], float(p)) for d, k, p in
+            zip(trades['day'][lo:hi], trades['kind'][lo:hi], trades['price'][lo:hi])]
+
+
+class _Context(object):
+    pass
+
+
+def _trade(context, day):
+    # trade() of sma_ema.py for one day, with the order functions replaced by the bookkeeping
+    current_price = context.decision[day]
+    if current_price != current_price:
+        return
+    context.current_price = current_price
+    context.return_percent = 0
+    if context.shares > 0:
+        context.return_percent = (current_price - context.cost) / context.cost
+    pipe = context.pipe
+
+    # stop loss
+    if ((current_price - pipe['price']) / pipe['price'] < context.threshold_stop_loss and
+            context.return_percent < context.threshold_sell_loss and context.shares > 0):
+        _order(context, day, 'stop')
+        context.hold_days = 0
+        context.sell_signal_count = 0
+        context.buy_signal_count = 0
+        return
+
+    price_compare = pipe['price']
+    if price_compare > pipe['fast_ma'] and price_compare > pipe['slow_ma']:
+        context.buy_signal_count += 1
+        context.sell_signal_count = 0
+    if price_compare < pipe['slow_ma'] and price_compare < pipe['fast_ma']:
+        context.buy_signal_count = 0
+        context.sell_signal_count += 1
+
+    buy = False
+    sell = False
+    if (context.buy_signal_count >= context.threshold_signal_count and
+            current_price > pipe['fast_ma'] and current_price > pipe['slow_ma']):
+        buy = True
+        context.buy_signal_count = 0
+    if context.sell_signal_count > context.threshold_signal_count:
+        # aggressive buy
+        buy = context.aggressive_buy or pipe['fast_ma'] > pipe['slow_ma']
+        sell = not buy
+        context.sell_signal_count = 0
+    elif (context.sell_signal_count >= context.threshold_signal_count and
+          current_price < pipe['slow_ma'] and current_price < pipe['fast_ma']):
+        sell = True
+
+    if pipe['rsi'] >= 50:
+        extra_sell_req = context.return_percent > context.threshold_sell_win
+    elif pipe['rsi'] < 50:
+        extra_sell_req = (context.return_percent > context.threshold_sell_win or
+                          context.return_percent < context.threshold_sell_loss)
+    else:
+        extra_sell_req = True
+
+    holding = context.shares > 0
+    if buy and not holding:
+        _order(context, day, 'buy')
+        context.hold_days = 0
+    if sell and holding and context.hold_days > context.threshold_hold_days and extra_sell_req:
+        _order(context, day, 'sell')
+        context.hold_days = 0
+    context.hold_days += 1
+
+
+def _order(context, day, kind):
+    price = context.fill[day]
+    out_price = context.out_fill[day] if context.out_fill is not None else 1.0
+    if kind == 'buy':
+        value = context.cash + context.out_shares * out_price
+        context.shares = value / price
+        context.cash = 0.0
+        context.out_shares = 0.0
+        context.cost = price
+    else:
+        context.cash += context.shares * price
+        context.shares = 0.0
+        if kind == 'sell' and context.move_fund_out_of_market and context.out_fill is not None:
+            context.out_shares = context.cash / out_price
+            context.cash = 0.0
+    context.trades.append((day, kind, float(price)))
+
+
+def run_event(close, decision, fill, params, out_close=None, out_fill=None, pipe=None, index=0):
+    # one parameter set, one _trade call per day; returns the equity curve and the trades.
+    # pipe can be the pipeline values of a whole grid, index is then the row of params in it.
+    if pipe is None:
+        pipe = pipeline_values(close, [params])
+        index = 0
+    columns = [(name, pipe[name][index]) for name in ('fast_ma', 'slow_ma', 'rsi')]
+    context = _Context()
+    context.__dict__.update(params)
+    context.decision, context.fill, context.out_fill = decision, fill, out_fill
+    context.buy_signal_count = 0
+    context.sell_signal_count = 0
+    context.hold_days = 0
+    context.shares = 0.0
+    context.out_shares = 0.0
+    context.cash = 1.0
+    context.cost = 0.0
+    context.trades = []
+    equity = []
+    for day in range(len(close)):
+        context.pipe = {name: pipe['table'][day, column] for name, column in columns}
+        context.pipe['price'] = pipe['price'][day]
+        _trade(context, day)
+        out_price = out_close[day] if out_close is not None else 1.0
+        equity.append(context.cash + context.shares * close[day] + context.out_shares * out_price)
+    return np.array(equity), context.trades
+
+
+def random_prices(days, seed=0):
+    # daily close, decision and fill prices of a random walk, and of a calm out-of-market fund
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, days)))
+    decision = close * np.exp(rng.normal(0, 0.004, days))
+    fill = decision * np.exp(rng.normal(0, 0.0005, days))
+    decision[rng.random(days) < 0.01] = np.nan
+    out_close = 80 * np.exp(np.cumsum(rng.normal(0.0001, 0.003, days)))
+    return close, decision, fill, out_close
+
+
+def sweep_grid():
+    # 9216 parameter sets around the defaults
+    return param_grid(fast_ma_periods=[5, 10], slow_ma_periods=[20, 50],
+                      fast_ma_type=['sma', 'ema'], slow_ma_type=['sma', 'ema'],
+                      rsi_period=[5, 14], threshold_signal_count=[1, 2, 3],
+                      aggressive_buy=[True, False], threshold_hold_days=[0, 1, 3],
+                      threshold_stop_loss=[-0.03, -0.05], threshold_sell_win=[0.1, 0.2],
+                      threshold_sell_loss=[-0.05, -0.1], move_fund_out_of_market=[True, False])
+
+
+def benchmark(days=2520, seed=0, sample=40, repeat=3):
+    # all parameter sets run vectorized (the best of repeat runs), every sample-th one also
+    # event driven; the event driven time grows linearly with the parameter sets, so it is
+    # scaled to the whole grid. Both are timed in CPU time of this process, so other
+    # processes on a busy machine do not decide the ratio
+    close, decision, fill, out_close = random_prices(days, seed)
+    grid = sweep_grid()
+    vectorized_time = np.inf
+    for _ in range(repeat):
+        start = time.process_time()
+        pipe = pipeline_values(close, grid)
+        equity, trades = run_vectorized(close, decision, fill, grid, out_close, out_close, pipe)
+        vectorized_time = min(vectorized_time, time.process_time() - start)
+
+    checked = range(0, len(grid), sample)
+    start = time.process_time()
+    for i in checked:
+        run_event(close, decision, fill, grid[i], out_close, out_close, pipe, i)
+    event_time = (time.process_time() - start) * len(grid) / len(checked)
+    print('{0} parameter sets x {1} days, {2} trades'.format(len(grid), days, len(trades['day'])))
+    print('vectorized {0:.2f} s, event driven about {1:.0f} s, {2:.0f}x faster'.format(
+        vectorized_time, event_time, event_time / vectorized_time))
+    return event_time / vectorized_time
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,171 @@
+"""
+The vectorized backtest of sma_ema_backtest.py against the event driven one, which is
+written the way trade() of sma_ema.py is, and against trade() of sma_ema.py itself, run
+with stand-ins for the quantopian modules.
+
+Run with python -m pytest in this directory.
+"""
+
+import importlib.util
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import sma_ema_backtest
+
+ALGORITHM = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'algorithms',
+                         'sma_ema.py')
+
+
+def _compare(close, decision, fill, grid, out_close, variant=None, sample=1):
+    pipe = sma_ema_backtest.pipeline_values(close, grid)
+    equity, trades = sma_ema_backtest.run_vectorized(close, decision, fill, grid, out_close,
+                                                     out_close, pipe, variant)
+    if variant is None:
+        variant = np.zeros(len(grid), dtype=np.int64)
+    decision, fill = decision.reshape(len(close), -1), fill.reshape(len(close), -1)
+    for i in range(0, len(grid), sample):
+        expected_equity, expected_trades = sma_ema_backtest.run_event(
+            close, decision[:, variant[i]], fill[:, variant[i]], grid[i], out_close, out_close,
+            pipe, i)
+        assert sma_ema_backtest.trade_list(trades, i) == expected_trades, grid[i]
+        assert np.allclose(equity[i], expected_equity, rtol=1e-12), grid[i]
+    return trades
+
+
+def test_sweep_grid():
+    close, decision, fill, out_close = sma_ema_backtest.random_prices(2520)
+    trades = _compare(close, decision, fill, sma_ema_backtest.sweep_grid(), out_close, sample=40)
+    assert (trades['kind'] == 3).any()
+
+
+def test_without_out_of_market_fund():
+    close, decision, fill, _ = sma_ema_backtest.random_prices(1000, seed=1)
+    grid = sma_ema_backtest.param_grid(threshold_signal_count=[1, 3],
+                                       threshold_stop_loss=[-0.01, -0.05])
+    _compare(close, decision, fill, grid, None)
+
+
+def test_variants_with_missing_prices():
+    # decision_sweep.py: one column of prices per decision time, each with its own gaps;
+    # tight stop losses make many parameter sets leave their group of signal counters
+    close, decision, fill, out_close = sma_ema_backtest.random_prices(1500, seed=2)
+    rng = np.random.default_rng(2)
+    decision = decision[:, None] * np.exp(rng.normal(0, 0.003, (1500, 4)))
+    decision[rng.random(decision.shape) < 0.05] = np.nan
+    fill = decision * np.exp(rng.normal(0, 0.0005, decision.shape))
+    grid = sma_ema_backtest.param_grid(fast_ma_periods=[5, 10], threshold_signal_count=[1, 2, 3],
+                                       aggressive_buy=[True, False],
+                                       threshold_stop_loss=[-0.01, -0.03]) * 4
+    variant = np.repeat(np.arange(4), len(grid) // 4)
+    trades = _compare(close, decision, fill, grid, out_close, variant, sample=3)
+    assert (trades['kind'] == 3).sum() > 100
+
+
+class _Anything(object):
+    # the parts of the quantopian API which initialize() and make_pipeline() only pass around
+    def __getattr__(self, name):
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+
+class _Context(object):
+    def __contains__(self, name):
+        return name in self.__dict__
+
+
+class _Log(object):
+    def __init__(self):
+        self.messages = []
+
+    def info(self, message):
+        self.messages.append(message)
+
+
+@pytest.fixture
+def algorithm(monkeypatch):
+    # sma_ema.py loaded with modules which answer every name with _Anything, except the
+    # order functions which the runs below replace
+    for name in ('quantopian', 'quantopian.algorithm', 'quantopian.optimize',
+                 'quantopian.pipeline', 'quantopian.pipeline.factors',
+                 'quantopian.pipeline.data', 'quantopian.pipeline.filters'):
+        module = types.ModuleType(name)
+        module.__getattr__ = lambda attribute: _Anything()
+        monkeypatch.setitem(sys.modules, name, module)
+        if '.' in name:
+            parent, child = name.rsplit('.', 1)
+            setattr(sys.modules[parent], child, module)
+    sys.modules['quantopian.optimize'].TargetWeights = dict
+    spec = importlib.util.spec_from_file_location('sma_ema', ALGORITHM)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.symbol = lambda name: name
+    module.set_slippage = module.slippage = module.record = _Anything()
+    return module
+
+
+def _run_algorithm(algorithm, close, decision, fill, params, out_close, pipe, index):
+    # trade() of sma_ema.py once per day with params in the context. The orders of a call
+    # fill after it returns at the fill price of the day, the kind of an order is read from
+    # the message trade() logs with it. Returns the equity curve and the trades like run_event
+    asset, out_of_market = 'VGT', 'BND'
+    orders = []
+    log = _Log()
+    algorithm.log = log
+    algorithm.algo.order_optimal_portfolio = lambda objective, constraints: \
+        orders.append(objective)
+    context = _Context()
+    algorithm.initialize(context)
+    context.__dict__.update(params)
+    positions = {asset: types.SimpleNamespace(amount=0.0, cost_basis=0.0),
+                 out_of_market: types.SimpleNamespace(amount=0.0, cost_basis=0.0)}
+    context.portfolio = types.SimpleNamespace(positions=positions, cash=1.0)
+    columns = {name: pipe[name][index] for name in ('fast_ma', 'slow_ma', 'rsi')}
+    kinds = [('Close all positions', 'stop'), ('Buy ', 'buy'), ('Switch to ', 'sell'),
+             ('Sell ', 'sell')]
+    equity, trades = [], []
+    for day in range(len(close)):
+        row = {name: pipe['table'][day, column] for name, column in columns.items()}
+        row['price'] = pipe['price'][day]
+        algorithm.pipeline_output = lambda name: types.SimpleNamespace(
+            loc={asset: types.SimpleNamespace(**row)})
+        data = types.SimpleNamespace(current=lambda a, field: decision[day])
+        del orders[:], log.messages[:]
+        algorithm.trade(context, data)
+        prices = {asset: fill[day], out_of_market: out_close[day]}
+        for objective in orders:
+            value = context.portfolio.cash + sum(p.amount * prices[a] for a, p in positions.items())
+            for a, p in positions.items():
+                amount = objective.get(a, 0.0) * value / prices[a]
+                if amount > p.amount:
+                    p.cost_basis = prices[a]
+                context.portfolio.cash -= (amount - p.amount) * prices[a]
+                p.amount = amount
+        for message in log.messages:
+            kind = [k for prefix, k in kinds if message.startswith(prefix)]
+            if kind:
+                trades.append((day, kind[0], float(fill[day])))
+        equity.append(context.portfolio.cash + positions[asset].amount * close[day] +
+                      positions[out_of_market].amount * out_close[day])
+    return np.array(equity), trades
+
+
+def test_against_sma_ema_trade(algorithm):
+    # the real rules, not a second writing of them: stop loss, aggressive buy and the hold
+    # days all vary over the grid
+    close, decision, fill, out_close = sma_ema_backtest.random_prices(2520)
+    grid = sma_ema_backtest.sweep_grid()[::40]
+    pipe = sma_ema_backtest.pipeline_values(close, grid)
+    equity, trades = sma_ema_backtest.run_vectorized(close, decision, fill, grid, out_close,
+                                                     out_close, pipe)
+    for i in range(len(grid)):
+        expected_equity, expected_trades = _run_algorithm(algorithm, close, decision, fill,
+                                                          grid[i], out_close, pipe, i)
+        assert sma_ema_backtest.trade_list(trades, i) == expected_trades, grid[i]
+        assert np.allclose(equity[i], expected_equity, rtol=1e-9), grid[i]
+    assert set(trades['kind']) == {1, 2, 3}
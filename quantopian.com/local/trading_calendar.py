@@ -0,0 +1,209 @@
+"""
+NYSE trading calendar computed locally, with array lookups instead of date arithmetic.
+
+daily_check_ma.py goes back 100 calendar days and finds the trading dates in the result
+index, and the algorithms schedule on algo.calendars.US_EQUITIES with
+market_close(minutes=N), which moves on the early close days. TradingCalendar computes
+the sessions between two dates once from the holiday rules of the exchange and keeps:
+
+    sessions        datetime64[D] of every session
+    opens, closes   minute of the day (New York time) of the open and the close
+    first_minute    offset of the first minute of every session in one series of all minutes
+    session_of      for every calendar day from start, the index of the session on or before it
+
+so the session of a date, N sessions back and the minute of close - 30 are index
+operations which also take arrays of dates or sessions.
+
+The holidays are the regular rules (with Juneteenth from 2022, Martin Luther King day from
+1998) plus the special closings since 2000; the early closes (13:00) are July 3, the day
+after Thanksgiving and December 24 when they are sessions.
+"""
+
+import datetime
+
+import numpy as np
+
+regular_open = 9 * 60 + 30
+regular_close = 16 * 60
+early_close = 13 * 60
+
+special_closings = [
+    '2001-09-11', '2001-09-12', '2001-09-13', '2001-09-14',   # September 11
+    '2004-06-11',                                           # president Reagan
+    '2007-01-02',                                           # president Ford
+    '2012-10-29', '2012-10-30',                             # hurricane Sandy
+    '2018-12-05',                                           # president G. H. W. Bush
+    '2025-01-09',                                           # president Carter
+]
+
+
+def _easter(year):
+    # Gregorian Easter sunday (anonymous algorithm)
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    # n-th (from 1, or -1 for the last) weekday of the month, monday is 0
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    following = datetime.date(year + month // 12, month % 12 + 1, 1)
+    last = following - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    # a holiday on saturday is taken on friday, on sunday on monday
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+def holidays(year):
+    days = []
+    new_year = datetime.date(year, 1, 1)
+    # the exchange does not close on December 31 for a new year's day on saturday
+    if new_year.weekday() != 5:
+        days.append(_observed(new_year))
+    if year >= 1998:
+        days.append(_nth_weekday(year, 1, 0, 3))
+    days.append(_nth_weekday(year, 2, 0, 3))
+    days.append(_easter(year) - datetime.timedelta(days=2))
+    days.append(_nth_weekday(year, 5, 0, -1))
+    if year >= 2022:
+        days.append(_observed(datetime.date(year, 6, 19)))
+    days.append(_observed(datetime.date(year, 7, 4)))
+    days.append(_nth_weekday(year, 9, 0, 1))
+    days.append(_nth_weekday(year, 11, 3, 4))
+    days.append(_observed(datetime.date(year, 12, 25)))
+    return days
+
+
+def early_closes(year):
+    thanksgiving = _nth_weekday(year, 11, 3, 4)
+    return [datetime.date(year, 7, 3), thanksgiving + datetime.timedelta(days=1),
+            datetime.date(year, 12, 24)]
+
+
+def _day(date):
+    return np.datetime64(date, 'D')
+
+
+class TradingCalendar(object):
+
+    def __init__(self, start='2000-01-01', end='2035-12-31'):
+        self.start, self.end = _day(start), _day(end)
+        days = np.arange(self.start, self.end + 1)
+        years = range(days[0].astype(object).year, days[-1].astype(object).year + 1)
+        closed = [d for y in years for d in holidays(y)] + special_closings
+        weekday = (days.astype(np.int64) + 3) % 7   # 1970-01-01 was a thursday
+        is_session = (weekday < 5) & ~np.isin(days, np.array(closed, dtype='datetime64[D]'))
+        self.sessions = days[is_session]
+        self.is_session = is_session
+
+        early = np.array([d for y in years for d in early_closes(y)], dtype='datetime64[D]')
+        self.opens = np.full(self.sessions.size, regular_open, dtype=np.int16)
+        self.closes = np.where(np.isin(self.sessions, early), early_close,
+                               regular_close).astype(np.int16)
+        self.minutes = (self.closes - self.opens).astype(np.int64)
+        self.first_minute = np.concatenate([[0], np.cumsum(self.minutes)[:-1]])
+        # -1 before the first session
+        self.session_of = (np.cumsum(is_session) - 1).astype(np.int32)
+
+    def _offsets(self, dates):
+        offsets = (np.asarray(dates, dtype='datetime64[D]') - self.start).astype(np.int64)
+        if np.any(offsets < 0) or np.any(offsets >= self.session_of.size):
+            raise ValueError('Dates outside of the calendar {0} to {1}'.format(
+                self.start, self.end))
+        return offsets
+
+    def session_index(self, dates, direction='previous'):
+        # index of the session of every date; a date which is no session gives the session
+        # before it ('previous'), after it ('next') or raises ('none')
+        offsets = self._offsets(dates)
+        index = self.session_of[offsets].astype(np.int64)
+        closed = ~self.is_session[offsets]
+        if np.any(closed):
+            if direction == 'next':
+                index = index + closed
+            elif direction != 'previous':
+                raise ValueError('Not a trading session: {0}'.format(
+                    np.asarray(dates, dtype='datetime64[D]')[closed]))
+        return index
+
+    def sessions_back(self, dates, n):
+        # the session n sessions before the session of every date (n=0 is the date's session)
+        index = self.session_index(dates) - n
+        if np.any(index < 0):
+            raise ValueError('Fewer than {0} sessions before the start of the calendar'.format(n))
+        return self.sessions[index]
+
+    def sessions_between(self, start, end):
+        return self.sessions[self.session_index(start, 'next'):self.session_index(end) + 1]
+
+    def market_close_minute(self, index, minutes=0):
+        # minute of the day of market_close(minutes=minutes) of the sessions
+        return self.closes[index] - minutes
+
+    def market_open_minute(self, index, minutes=0):
+        return self.opens[index] + minutes
+
+    def close_bar(self, index, minutes=0):
+        # bar of market_close(minutes=minutes) counted from the first bar of the session
+        return self.minutes[index] - 1 - minutes
+
+    def minute_offset(self, index, bar):
+        # position of a bar of a session in one series of all the minutes of the calendar
+        return self.first_minute[index] + bar
+
+
+US_EQUITIES = TradingCalendar()
+
+
+if __name__ == '__main__':
+    import time
+
+    calendar = US_EQUITIES
+    counts = {2020: 253, 2021: 252, 2022: 251, 2023: 250, 2024: 252, 2025: 250}
+    for year, count in counts.items():
+        found = calendar.sessions_between('{0}-01-01'.format(year), '{0}-12-31'.format(year))
+        assert found.size == count, (year, found.size)
+    closed_2024 = ['2024-01-01', '2024-01-15', '2024-02-19', '2024-03-29', '2024-05-27',
+                   '2024-06-19', '2024-07-04', '2024-09-02', '2024-11-28', '2024-12-25']
+    assert not calendar.is_session[calendar._offsets(closed_2024)].any()
+    assert calendar.is_session[calendar._offsets(['2021-12-31', '2022-06-17'])].all()
+
+    early = calendar.sessions[calendar.closes == early_close]
+    assert set(['2023-07-03', '2024-07-03', '2024-11-29', '2024-12-24', '2020-11-27']) <= \
+        set(str(d) for d in early)
+    assert '2020-07-03' not in set(str(d) for d in calendar.sessions)
+
+    # market_close(minutes=30) of the day after Thanksgiving is at 12:30, bar 179 of 210
+    index = calendar.session_index('2024-11-29')
+    assert calendar.market_close_minute(index, 30) == 12 * 60 + 30
+    assert calendar.close_bar(index, 30) == 179
+    assert calendar.minute_offset(index + 1, 0) == calendar.minute_offset(index, 210)
+
+    # a weekend date belongs to the friday before, or the monday after
+    assert str(calendar.sessions[calendar.session_index('2024-03-30')]) == '2024-03-28'
+    assert str(calendar.sessions[calendar.session_index('2024-03-30', 'next')]) == '2024-04-01'
+    # the window of daily_check_ma.py in sessions instead of calendar days
+    assert str(calendar.sessions_back('2024-07-05', 2)) == '2024-07-02'
+
+    dates = calendar.start + np.random.default_rng(0).integers(200, 365 * 30, 1000000)
+    start = time.time()
+    calendar.sessions_back(dates, 100)
+    print('1000000 lookups of 100 sessions back in {0:.3f} s'.format(time.time() - start))
+    print('ok')
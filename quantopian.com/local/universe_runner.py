@@ -0,0 +1,208 @@
+"""
+Run the screen of screen_etf.py over many universes in parallel.
+
+The prices of all tickers are loaded once and copied into shared memory; every worker
+process of the pool attaches to the same blocks, so a universe costs no copy of the data.
+For every universe the runner removes the highly correlated tickers the way screen_etf.py
+does, computes the pipeline factors (return_6m, return_1m, return_2w, stoch_d, rsi) on the
+last date, runs the screening funnel and times each step. All candidates go into one CSV
+report together with the timings of every universe.
+
+Usage: python universe_runner.py <prices.csv> <universes.json> [report.csv]
+
+prices.csv has a date column and one close column per ticker; <ticker>_high and
+<ticker>_low columns are used by the stochastic oscillator when they exist.
+universes.json maps a universe name to its list of tickers.
+"""
+
+import csv
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import rolling_stats
+import screen_funnel
+
+# shared_arrays.py is in the top directory of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+import shared_arrays  # noqa: E402
+
+# same parameters as screen_etf.py
+correlation_days = 252
+correlation_limit = 0.99
+return_windows = {'return_6m': 126, 'return_1m': 21, 'return_2w': 10}
+rsi_window = 15
+stoch_window = 14
+stoch_smoothing = 4
+
+# arrays of the pool workers, attached to the shared memory by _attach
+_shared = shared_arrays.attached
+
+
+def load_prices(path):
+    # wide csv -> dates, tickers and {'close', 'high', 'low'} arrays of (dates, tickers)
+    import pandas as pd
+    frame = pd.read_csv(path, index_col=0, parse_dates=True).sort_index()
+    tickers = [c for c in frame.columns if not c.endswith(('_high', '_low'))]
+    close = frame[tickers].to_numpy(dtype=np.float64)
+    arrays = {'close': close}
+    for kind in ('high', 'low'):
+        columns = [t + '_' + kind for t in tickers]
+        if all(c in frame.columns for c in columns):
+            arrays[kind] = frame[columns].to_numpy(dtype=np.float64)
+    return frame.index.to_numpy(), tickers, arrays
+
+
+def _attach(specs, tickers):
+    shared_arrays.attach(specs)
+    _shared['column'] = {t: i for i, t in enumerate(tickers)}
+
+
+def percent_change(close, window):
+    # PercentChange of the pipeline: change over the last window_length prices
+    return close[-1] / close[-window] - 1
+
+
+def rsi(close, window=rsi_window):
+    # RSI of the pipeline: average gain against average loss of the last window_length prices
+    diffs = np.diff(close[-window:], axis=0)
+    ups = np.nanmean(np.clip(diffs, 0, None), axis=0)
+    downs = -np.nanmean(np.clip(diffs, None, 0), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 100 - 100 / (1 + ups / downs)
+
+
+def stoch_d(close, high, low, window=stoch_window, smoothing=stoch_smoothing):
+    # SimpleMovingAverage of the FastStochasticOscillator over the last smoothing days
+    ks = []
+    for day in range(len(close) - smoothing, len(close)):
+        lowest = np.nanmin(low[day - window + 1:day + 1], axis=0)
+        highest = np.nanmax(high[day - window + 1:day + 1], axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ks.append((close[day] - lowest) / (highest - lowest) * 100)
+    return np.mean(ks[-smoothing:], axis=0)
+
+
+def remove_correlated(close, tickers, days=correlation_days, limit=correlation_limit):
+    # screen_etf.py: of every pair correlated above limit, drop the one with the lower 6 month
+    # return ten days ago. Only the pairs above the limit are visited in python.
+    keep = np.ones(len(tickers), dtype=np.bool_)
+    if len(tickers) < 2:
+        return keep
+    cor = rolling_stats.correlation_matrix(close[-days:])
+    momentum = close[-10] / close[-10 - 126] - 1
+    rows, cols = np.nonzero(np.triu(cor > limit, k=1))
+    for i, j in zip(rows, cols):
+        if momentum[i] > momentum[j]:
+            keep[j] = False
+        else:
+            keep[i] = False
+    return keep
+
+
+def compute_factors(close, high, low):
+    factors = {name: percent_change(close, window) for name, window in return_windows.items()}
+    factors['stoch_d'] = stoch_d(close, high, low)
+    factors['rsi'] = rsi(close)
+    return factors
+
+
+def run_universe(job):
+    name, universe, stages = job
+    timings = {}
+    start = time.time()
+    column = _shared['column']
+    found = [t for t in universe if t in column]
+    missing = [t for t in universe if t not in column]
+    index = np.array([column[t] for t in found], dtype=np.int64)
+    close = _shared['close'][:, index]
+    high = _shared['high'][:, index] if 'high' in _shared else close
+    low = _shared['low'][:, index] if 'low' in _shared else close
+    timings['load'] = time.time() - start
+
+    step = time.time()
+    keep = remove_correlated(close, found)
+    timings['dedup'] = time.time() - step
+
+    step = time.time()
+    factors = compute_factors(close[:, keep], high[:, keep], low[:, keep])
+    timings['factors'] = time.time() - step
+
+    step = time.time()
+    order = []
+    if keep.any():
+        mask = screen_funnel.run_funnel(factors, stages)
+        order = screen_funnel.ranked(factors, mask, stages[-1]['column'],
+                                     ascending=stages[-1]['kind'] != 'top')
+    timings['funnel'] = time.time() - step
+    timings['total'] = time.time() - start
+
+    kept = [t for t, k in zip(found, keep) if k]
+    candidates = [(kept[i], {c: float(v[i]) for c, v in factors.items()}) for i in order]
+    return {'universe': name, 'size': len(universe), 'missing': missing,
+            'deduplicated': len(kept), 'candidates': candidates, 'timings': timings,
+            'pid': os.getpid()}
+
+
+def run_all(universes, tickers, arrays, stages=None, workers=None):
+    # universes: {name: [tickers]}, arrays: {'close', optional 'high', 'low'} of (dates, tickers)
+    if stages is None:
+        stages = screen_funnel.SCREEN_ETF_FUNNEL
+    jobs = [(name, list(universe), stages) for name, universe in universes.items()]
+    blocks, specs = shared_arrays.share(arrays)
+    try:
+        if workers is None:
+            workers = min(os.cpu_count() or 1, len(jobs))
+        with Pool(max(workers, 1), initializer=_attach, initargs=(specs, tickers)) as pool:
+            # the biggest universes first, so a large one does not start last
+            jobs.sort(key=lambda job: -len(job[1]))
+            results = pool.map(run_universe, jobs, chunksize=1)
+    finally:
+        shared_arrays.release(blocks)
+    order = {name: i for i, name in enumerate(universes)}
+    return sorted(results, key=lambda r: order[r['universe']])
+
+
+def write_report(results, path):
+    factor_names = list(return_windows) + ['stoch_d', 'rsi']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['universe', 'rank', 'ticker'] + factor_names)
+        for result in results:
+            for rank, (ticker, values) in enumerate(result['candidates'], 1):
+                writer.writerow([result['universe'], rank, ticker] +
+                                ['{0:.6g}'.format(values[c]) for c in factor_names])
+        writer.writerow([])
+        steps = ['load', 'dedup', 'factors', 'funnel', 'total']
+        writer.writerow(['universe', 'tickers', 'missing', 'after dedup', 'candidates'] +
+                        [s + ' ms' for s in steps])
+        for result in results:
+            writer.writerow([result['universe'], result['size'], len(result['missing']),
+                             result['deduplicated'], len(result['candidates'])] +
+                            ['{0:.1f}'.format(result['timings'][s] * 1000) for s in steps])
+
+
+def main(prices_path, universes_path, report_path='candidates_report.csv'):
+    start = time.time()
+    _, tickers, arrays = load_prices(prices_path)
+    with open(universes_path, 'r', encoding='utf-8') as f:
+        universes = json.load(f)
+    print('Loaded {0} tickers x {1} days in {2:.2f} s'.format(
+        len(tickers), arrays['close'].shape[0], time.time() - start))
+    results = run_all(universes, tickers, arrays)
+    write_report(results, report_path)
+    for result in results:
+        print('{0}: {1} candidates of {2} tickers in {3:.1f} ms'.format(
+            result['universe'], len(result['candidates']), result['size'],
+            result['timings']['total'] * 1000))
+        if result['missing']:
+            print('  no prices for ' + ', '.join(result['missing']))
+    print('Report written to {0} in {1:.2f} s'.format(report_path, time.time() - start))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:4])
@@ -0,0 +1,65 @@
+"""
+Numpy arrays in shared memory for the worker processes of a multiprocessing Pool.
+
+The parent copies its arrays into shared memory blocks once with share(), or makes empty
+blocks for the workers to fill with create(), and passes the specs (block name, shape and
+dtype of every array) to the pool with attach() as the initializer:
+
+    blocks, specs = shared_arrays.share({'close': close})
+    try:
+        with Pool(workers, initializer=shared_arrays.attach, initargs=(specs,)) as pool:
+            ...     # the workers read shared_arrays.attached['close']
+    finally:
+        shared_arrays.release(blocks)
+
+Every worker maps the same blocks, so no array is pickled or copied per job. The specs
+are plain tuples, so they pass to the workers with either start method.
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# arrays of a pool worker by name, attached to the shared memory by attach
+attached = {}
+
+
+def create(shapes):
+    # new blocks for {name: (shape, dtype)}; returns the blocks and the specs for attach
+    blocks, specs = [], {}
+    for name, (shape, dtype) in shapes.items():
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        blocks.append(block)
+        specs[name] = (block.name, tuple(shape), dtype.str)
+    return blocks, specs
+
+
+def share(arrays):
+    # copies of {name: array} in new blocks; returns the blocks and the specs for attach
+    arrays = {name: np.asarray(array) for name, array in arrays.items()}
+    blocks, specs = create({name: (a.shape, a.dtype) for name, a in arrays.items()})
+    for block, array in zip(blocks, arrays.values()):
+        view(block, array.shape, array.dtype)[...] = array
+    return blocks, specs
+
+
+def view(block, shape, dtype):
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def attach(specs):
+    # initializer of the pool workers: the arrays of specs into attached
+    attached['blocks'] = []
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        attached['blocks'].append(block)
+        attached[name] = view(block, shape, dtype)
+
+
+def release(blocks):
+    # the parent is done with the blocks, they are freed when no worker maps them any more
+    for block in blocks:
+        block.close()
+        block.unlink()
@@ -2,32 +2,14 @@
 import random
 import time
 
-# Prepare array to be sorted
-source = []
-n = 1000
-for i in range(n):
-    source.append(random.randint(1, 100000))
-# copy the source array
-arr1 = source.copy()
-arr2 = source.copy()
-arr3 = source.copy()
-arr4 = source.copy()
-arr5 = source.copy()
-arr6 = source.copy()
-# sort the source
-start = time.time()
-source = sorted(source)
-end = time.time()
-print('Python Sort', (end-start) * 1000, 'ms')
-
-# Function to verify result
-
-
-def verify(arr1, arr2):
-    for i in range(len(arr1)):
-        if arr1[i] != arr2[i]:
-            return False
-    return True
+import numpy as np
+
+from sort_verify import verify, presortedness
+import sort_parallel
+
+# keys of the parallel sample sort, which only starts workers above sort_parallel.min_parallel
+parallel_keys = 10 ** 6
+
 
 # Function to do insertion sort
 
@@ -230,37 +212,63 @@ def bubble_sort(array):
     return array
 
 
-# Insertion Sort
-start = time.time()
-insertionSort(arr1)
-end = time.time()
-print('Insertion Sort', verify(source, arr1), (end-start) * 1000, 'ms')
-
-
-# Heap Sort
-start = time.time()
-heapSort(arr2)
-end = time.time()
-print('Heap Sort', verify(source, arr2), (end-start) * 1000, 'ms')
-
-
-# Merge Sort
-start = time.time()
-mergeSort(arr3, 0, n-1)
-end = time.time()
-print('Merge Sort', verify(source, arr3), (end-start) * 1000, 'ms')
-
-
-# Quick Sort
-start = time.time()
-quickSort(arr4, 0, n-1)
-end = time.time()
-print('Quick Sort', verify(source, arr4), (end-start) * 1000, 'ms')
-
-
-# Buddble Sort
-start = time.time()
-bubble_sort(arr5)
-end = time.time()
-print('Buddble Sort', verify(source, arr5), (end-start) * 1000, 'ms')
-
+# The timings run only when this file is run, since the worker processes of the parallel
+# sort import it again
+def main():
+    # Prepare array to be sorted
+    source = []
+    n = 1000
+    for i in range(n):
+        source.append(random.randint(1, 100000))
+    # copy the source array
+    arr1 = source.copy()
+    arr2 = source.copy()
+    arr3 = source.copy()
+    arr4 = source.copy()
+    arr5 = source.copy()
+    arr6 = source.copy()
+    # describe how sorted the source already is
+    print('Presortedness', presortedness(source))
+
+    # Python Sort
+    start = time.time()
+    arr6 = sorted(arr6)
+    end = time.time()
+    print('Python Sort', verify(source, arr6), (end-start) * 1000, 'ms')
+
+    # Insertion Sort
+    start = time.time()
+    insertionSort(arr1)
+    end = time.time()
+    print('Insertion Sort', verify(source, arr1), (end-start) * 1000, 'ms')
+
+    # Heap Sort
+    start = time.time()
+    heapSort(arr2)
+    end = time.time()
+    print('Heap Sort', verify(source, arr2), (end-start) * 1000, 'ms')
+
+    # Merge Sort
+    start = time.time()
+    mergeSort(arr3, 0, n-1)
+    end = time.time()
+    print('Merge Sort', verify(source, arr3), (end-start) * 1000, 'ms')
+
+    # Quick Sort
+    start = time.time()
+    quickSort(arr4, 0, n-1)
+    end = time.time()
+    print('Quick Sort', verify(source, arr4), (end-start) * 1000, 'ms')
+
+    # Buddble Sort
+    start = time.time()
+    bubble_sort(arr5)
+    end = time.time()
+    print('Buddble Sort', verify(source, arr5), (end-start) * 1000, 'ms')
+
+    # Parallel Sample Sort, 1 worker up to all cores
+    sort_parallel.scaling(np.random.default_rng(0).integers(1, 1 << 62, parallel_keys))
+
+
+if __name__ == '__main__':
+    main()
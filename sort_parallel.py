@@ -0,0 +1,145 @@
+"""
+Parallel sample sort of a large numpy array with worker processes and shared memory.
+
+The keys are copied once into a shared memory block, and all three steps run in the
+worker processes of a pool, which exchange only small arrays of counts:
+
+1. splitters: a random sample of the keys is sorted and cut into buckets of equal size
+   (several buckets per worker, so an unlucky bucket does not hold up the rest)
+2. partition: every worker takes a chunk of the keys, finds the bucket of every key with
+   np.searchsorted on the splitters and counts the buckets; from the counts of all chunks
+   every (chunk, bucket) gets its place in the output block, and the workers scatter
+   their keys there, so the buckets lie one after the other
+3. every worker sorts whole buckets in place in the output block
+
+The sorted buckets are then already the sorted array, nothing is concatenated or
+pickled. Many equal keys make one bucket larger, but never wrong.
+
+Running this file checks the sort and times it with 1 worker up to all cores; sort.py
+prints the same timings next to the other sorts.
+"""
+
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import shared_arrays
+
+buckets_per_worker = 4
+samples_per_bucket = 256
+# below this number of keys, or with one worker, one np.sort is faster than starting the
+# workers
+min_parallel = 1 << 16
+
+# arrays of the pool workers, attached to the shared memory by shared_arrays.attach
+_shared = shared_arrays.attached
+
+
+def _count(job):
+    start, stop, splitters = job
+    buckets = np.searchsorted(splitters, _shared['keys'][start:stop], side='right')
+    _shared['buckets'][start:stop] = buckets
+    return np.bincount(buckets, minlength=len(splitters) + 1)
+
+
+def _scatter(job):
+    # the keys of the chunk ordered by bucket, each bucket into its place in the output
+    start, stop, offsets, counts = job
+    order = np.argsort(_shared['buckets'][start:stop], kind='stable')
+    keys = _shared['keys'][start:stop][order]
+    out = _shared['out']
+    first = 0
+    for bucket in np.flatnonzero(counts):
+        last = first + counts[bucket]
+        out[offsets[bucket]:offsets[bucket] + counts[bucket]] = keys[first:last]
+        first = last
+
+
+def _sort(job):
+    for start, stop in job:
+        _shared['out'][start:stop].sort()
+
+
+def parallel_sort(values, workers=None, seed=0):
+    # a sorted copy of a 1-d array
+    values = np.asarray(values).ravel()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if values.size < min_parallel or workers < 2:
+        return np.sort(values)
+    n = values.size
+    buckets = workers * buckets_per_worker
+    rng = np.random.default_rng(seed)
+    sample = np.sort(values[rng.integers(0, n, buckets * samples_per_bucket)])
+    splitters = sample[samples_per_bucket::samples_per_bucket][:buckets - 1]
+    bucket_dtype = np.uint16 if buckets <= np.iinfo(np.uint16).max else np.uint32
+
+    blocks, specs = shared_arrays.create({'keys': ((n,), values.dtype),
+                                          'buckets': ((n,), bucket_dtype),
+                                          'out': ((n,), values.dtype)})
+    try:
+        shared_arrays.view(blocks[0], (n,), values.dtype)[...] = values
+        out = shared_arrays.view(blocks[2], (n,), values.dtype)
+        bounds = np.linspace(0, n, workers * 2 + 1).astype(np.int64)
+        chunks = list(zip(bounds[:-1], bounds[1:]))
+        with Pool(workers, initializer=shared_arrays.attach, initargs=(specs,)) as pool:
+            counts = np.array(pool.map(_count, [(a, b, splitters) for a, b in chunks]))
+            # place of every (chunk, bucket): buckets one after the other, the chunks of a
+            # bucket in order inside it
+            places = np.cumsum(counts.T.ravel()) - counts.T.ravel()
+            offsets = places.reshape(counts.shape[1], counts.shape[0]).T
+            pool.map(_scatter, [(a, b, offsets[i], counts[i]) for i, (a, b) in enumerate(chunks)])
+
+            totals = counts.sum(axis=0)
+            ends = np.cumsum(totals)
+            ranges = [(int(e - t), int(e)) for e, t in zip(ends, totals) if t > 1]
+            # the largest buckets first, dealt out to the workers in turn
+            ranges.sort(key=lambda r: r[0] - r[1])
+            pool.map(_sort, [ranges[i::workers] for i in range(workers)])
+        return out.copy()
+    finally:
+        shared_arrays.release(blocks)
+
+
+def scaling(values):
+    # times one np.sort of values, then parallel_sort on 1 worker, 2, 4, ... up to all cores
+    from sort_verify import verify
+
+    start = time.time()
+    np.sort(values)
+    single = time.time() - start
+    print('np.sort {0} keys in {1:.3f} s'.format(values.size, single))
+    cores = os.cpu_count() or 1
+    workers = 1
+    while True:
+        start = time.time()
+        result = parallel_sort(values, workers)
+        elapsed = time.time() - start
+        assert verify(values, result)
+        print('Parallel Sample Sort {0} workers in {1:.3f} s, {2:.2f}x np.sort'.format(
+            workers, elapsed, single / elapsed))
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+
+if __name__ == '__main__':
+    # Usage: python sort_parallel.py [keys]
+    # checks the sort, then times keys (default 10 ** 7) random keys on 1 worker, 2, 4, ... up
+    # to all cores against one np.sort; 10 ** 8 keys need about 3 GB of memory
+    import sys
+
+    from sort_verify import verify
+
+    rng = np.random.default_rng(1)
+    for values in [rng.integers(0, 1 << 62, 3000000), rng.normal(size=1000000),
+                   rng.integers(0, 5, 1000000), np.arange(1000000)[::-1].copy()]:
+        start = time.time()
+        result = parallel_sort(values, workers=4)
+        assert verify(values, result) and np.array_equal(result, np.sort(values))
+        print('{0} {1} keys in {2:.3f} s'.format(values.dtype, values.size, time.time() - start))
+    print('ok')
+
+    scaling(rng.integers(0, 1 << 62, int(float(sys.argv[1])) if len(sys.argv) > 1 else 10 ** 7))
@@ -0,0 +1,178 @@
+"""
+Verify sort results without sorting a second copy, and measure how sorted an input already is.
+
+verify(source, result) checks that result is in non-decreasing order with one vectorized pass,
+and that result is a permutation of source with an order independent multiset hash
+(or exact counts when the values are small integers, or are strings or other objects the
+hash cannot take).
+
+presortedness(arr) reports runs, inversions (counted by a bottom-up merge) and max displacement,
+so the timings in sort.py can be compared with the disorder of the input.
+"""
+
+from collections import Counter
+
+import numpy as np
+
+# constants of the splitmix64 finalizer
+_MIX1 = np.uint64(0xbf58476d1ce4e5b9)
+_MIX2 = np.uint64(0x94d049bb133111eb)
+_GOLDEN = np.uint64(0x9e3779b97f4a7c15)
+
+
+def _as_array(arr):
+    a = np.asarray(arr)
+    if a.dtype == object:
+        a = np.array(list(arr))
+    return a.ravel()
+
+
+def _to_uint64(a):
+    # reinterpret the bits of each value as an unsigned 64 bit integer
+    if a.dtype == np.bool_ or a.dtype.kind in 'iu':
+        return a.astype(np.int64).view(np.uint64)
+    if a.dtype.kind == 'f':
+        a = a.astype(np.float64)
+        # +0.0 and -0.0 are equal, so hash them the same
+        a = np.where(a == 0, 0.0, a)
+        return a.view(np.uint64)
+    raise TypeError('Unsupported dtype for multiset hash: ' + str(a.dtype))
+
+
+def _mix(x, seed):
+    # splitmix64, wraps around modulo 2**64
+    with np.errstate(over='ignore'):
+        z = x + seed * _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * _MIX1
+        z = (z ^ (z >> np.uint64(27))) * _MIX2
+        return z ^ (z >> np.uint64(31))
+
+
+def is_sorted(arr):
+    a = _as_array(arr)
+    if a.size < 2:
+        return True
+    return bool(np.all(a[1:] >= a[:-1]))
+
+
+def multiset_hash(arr):
+    # The sum of mixed values does not depend on the order, but does on the count of every value
+    x = _to_uint64(_as_array(arr))
+    with np.errstate(over='ignore'):
+        h1 = np.add.reduce(_mix(x, np.uint64(1)), dtype=np.uint64)
+        h2 = np.add.reduce(_mix(x, np.uint64(2)), dtype=np.uint64)
+    return int(h1), int(h2)
+
+
+def _small_int_range(a, b):
+    if a.dtype.kind not in 'iub' or b.dtype.kind not in 'iub' or a.size == 0:
+        return None
+    lo = min(int(a.min()), int(b.min()))
+    hi = max(int(a.max()), int(b.max()))
+    # counting needs an array as large as the value range
+    if hi - lo > 4 * a.size + 1024:
+        return None
+    return lo, hi
+
+
+def is_permutation(source, result):
+    a = _as_array(source)
+    b = _as_array(result)
+    if a.size != b.size:
+        return False
+    if a.dtype.kind not in 'biuf' or b.dtype.kind not in 'biuf':
+        # strings and other objects have no fixed bits to hash, count them exactly
+        return Counter(a.tolist()) == Counter(b.tolist())
+    if a.dtype.kind == 'f' or b.dtype.kind == 'f':
+        # the hash takes the bits, so 2 and 2.0 are hashed as the same float64; integers of
+        # any width already are the same int64
+        a, b = a.astype(np.float64), b.astype(np.float64)
+    bounds = _small_int_range(a, b)
+    if bounds is not None:
+        # exact counts for small integer keys
+        lo, hi = bounds
+        size = hi - lo + 1
+        ca = np.bincount((a.astype(np.int64) - lo), minlength=size)
+        cb = np.bincount((b.astype(np.int64) - lo), minlength=size)
+        return bool(np.array_equal(ca, cb))
+    return multiset_hash(a) == multiset_hash(b)
+
+
+def verify(source, result):
+    # result must be in order and hold the same values as source
+    return is_sorted(result) and is_permutation(source, result)
+
+
+def count_runs(arr):
+    # number of maximal non-decreasing runs
+    a = _as_array(arr)
+    if a.size == 0:
+        return 0
+    return int(np.count_nonzero(a[1:] < a[:-1])) + 1
+
+
+def count_inversions(arr):
+    # Bottom-up merge sort over ranks. At every level the left halves of all pairs are searched
+    # at once: adding group * n to the ranks keeps the concatenated halves globally sorted.
+    a = _as_array(arr)
+    n = a.size
+    if n < 2:
+        return 0
+    # stable ranks, so equal values are not counted as inversions
+    order = np.argsort(a, kind='stable')
+    s = np.empty(n, dtype=np.int64)
+    s[order] = np.arange(n, dtype=np.int64)
+    pos = np.arange(n, dtype=np.int64)
+    inversions = 0
+    width = 1
+    while width < n:
+        group = pos // (2 * width)
+        keys = group * n + s
+        is_left = (pos % (2 * width)) < width
+        left = keys[is_left]
+        right = keys[~is_left]
+        right_group = group[~is_left]
+        # number of left elements up to the end of each group
+        left_end = np.minimum((right_group * 2 + 1) * width, n)
+        left_end = left_end - right_group * width
+        not_greater = np.searchsorted(left, right, side='right')
+        inversions += int((left_end - not_greater).sum())
+        # the array is made of sorted runs, timsort merges them in linear time per level
+        s = np.sort(keys, kind='stable') - group * n
+        width *= 2
+    return inversions
+
+
+def max_displacement(arr):
+    # largest distance between the position of an element and its position after a stable sort
+    a = _as_array(arr)
+    if a.size == 0:
+        return 0
+    order = np.argsort(a, kind='stable')
+    return int(np.abs(order - np.arange(a.size)).max())
+
+
+def presortedness(arr):
+    a = _as_array(arr)
+    n = a.size
+    inversions = count_inversions(a)
+    max_inversions = n * (n - 1) // 2
+    return {
+        'n': n,
+        'runs': count_runs(a),
+        'inversions': inversions,
+        'inversion_ratio': inversions / max_inversions if max_inversions else 0.0,
+        'max_displacement': max_displacement(a),
+    }
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 1 << 40, 100000)
+    assert verify(values, np.sort(values)) and not verify(values, np.sort(values) + 1)
+    assert verify(['b', 'a', 'c'], ['a', 'b', 'c']) and not verify(['b', 'a', 'a'], ['a', 'b', 'b'])
+    # equal keys of other dtypes
+    assert verify([1.0, 2.0], [1, 2]) and verify(np.array([2, 1], dtype=np.int8), [1, 2])
+    assert verify([2, 1], [1.0, 2.0]) and not verify([1.0, 2.5], [1, 2])
+    assert presortedness([3, 1, 2])['inversions'] == 2
+    print('ok')
@@ -0,0 +1,115 @@
+"""
+Columnar processing of the ETF records downloaded from etfdb.com.
+
+The records are converted once into arrays: symbols, names and any extra text fields,
+a float matrix with one column per percent tag ("12.3%" -> 12.3, "N/A" -> NaN),
+and the original strings of the same tags so the CSV output stays unchanged.
+Return filters and N/A imputation (mean, median, or per category) then run as
+vectorized masks over the whole matrix.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def to_columns(records, tags, text_fields=()):
+    symbols = np.array([r['symbol']['text'] for r in records], dtype=object)
+    names = np.array([r['name']['text'] for r in records], dtype=object)
+    text = {}
+    values = np.empty((len(records), len(tags)), dtype=np.float64)
+    for j, tag in enumerate(tags):
+        raw = np.array([r.get(tag, 'N/A') for r in records], dtype=object)
+        text[tag] = raw
+        values[:, j] = pd.to_numeric(pd.Series(raw, dtype=object).str.rstrip('%'), errors='coerce')
+    fields = {}
+    for field in text_fields:
+        fields[field] = np.array([_text(r.get(field)) for r in records], dtype=object)
+    return {
+        'symbol': symbols,
+        'name': names,
+        'tags': list(tags),
+        'values': values,
+        'text': text,
+        'fields': fields,
+    }
+
+
+def _text(value):
+    # some etfdb fields are {'text': ..., 'url': ...} objects
+    if isinstance(value, dict):
+        return value.get('text')
+    return value
+
+
+def select(columns, mask):
+    return {
+        'symbol': columns['symbol'][mask],
+        'name': columns['name'][mask],
+        'tags': columns['tags'],
+        'values': columns['values'][mask],
+        'text': {tag: raw[mask] for tag, raw in columns['text'].items()},
+        'fields': {field: raw[mask] for field, raw in columns['fields'].items()},
+    }
+
+
+def non_negative_mask(columns, tags):
+    # True for rows without a negative value in any of the tags, N/A is kept
+    idx = [columns['tags'].index(t) for t in tags]
+    return ~np.any(columns['values'][:, idx] < 0, axis=1)
+
+
+def _group_stat(values, codes, group_count, method):
+    # statistic of every column inside every group, NaN where a group has no value
+    k = values.shape[1]
+    stats = np.full((group_count, k), np.nan)
+    valid = ~np.isnan(values)
+    if method == 'mean':
+        sums = np.zeros((group_count, k))
+        counts = np.zeros((group_count, k))
+        np.add.at(sums, codes, np.where(valid, values, 0.0))
+        np.add.at(counts, codes, valid)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stats = sums / counts
+        return stats
+    for j in range(k):
+        v = values[valid[:, j], j]
+        c = codes[valid[:, j]]
+        order = np.lexsort((v, c))
+        v, c = v[order], c[order]
+        starts = np.searchsorted(c, np.arange(group_count), side='left')
+        ends = np.searchsorted(c, np.arange(group_count), side='right')
+        has = ends > starts
+        lo = (starts + ends - 1) // 2
+        hi = (starts + ends) // 2
+        stats[has, j] = (v[lo[has]] + v[hi[has]]) / 2
+    return stats
+
+
+def impute(columns, tags, method='mean', by=None):
+    # replace N/A of the tags with the mean or median, of the category column 'by' if given
+    if method not in ('mean', 'median'):
+        raise ValueError('Unknown imputation method: ' + method)
+    idx = [columns['tags'].index(t) for t in tags]
+    values = columns['values'][:, idx]
+    overall = _group_stat(values, np.zeros(len(values), dtype=np.int64), 1, method)[0]
+    fill = np.broadcast_to(overall, values.shape)
+    if by is not None:
+        _, codes = np.unique(columns['fields'][by].astype(str), return_inverse=True)
+        per_group = _group_stat(values, codes, codes.max() + 1 if codes.size else 0, method)
+        # a category without any value falls back to the overall statistic
+        fill = np.where(np.isnan(per_group[codes]), overall, per_group[codes])
+    missing = np.isnan(values)
+    values = np.where(missing, fill, values)
+    columns['values'][:, idx] = values
+    for j, tag in enumerate(tags):
+        rows = np.flatnonzero(missing[:, j])
+        raw = columns['text'][tag]
+        for i in rows:
+            raw[i] = str(float(values[i, j])) + '%'
+    return columns
+
+
+def to_lines(columns, tags):
+    # CSV lines in the format extract_eftdb.py always wrote
+    parts = [columns['symbol'], columns['name']] + [columns['text'][t] for t in tags]
+    return [','.join(row) for row in zip(*parts)]
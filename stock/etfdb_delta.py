@@ -0,0 +1,172 @@
+"""
+Incremental daily scrape of etfdb.com.
+
+The previous snapshot is kept in a local SQLite file keyed by symbol, with a digest of
+the metrics of every ETF. A run downloads all pages in parallel, compares the digests,
+and writes only the new listings, the delisted ETFs and the ETFs whose metrics changed,
+so a daily run writes O(changes) rows instead of the whole universe.
+The ticker list for screen_etf.py is regenerated only when the set of symbols changed.
+"""
+
+import hashlib
+import json
+import sqlite3
+from datetime import date
+
+import etfdb_tabs
+
+snapshot_db = 'etfdb_snapshot.sqlite'
+ticker_file = 'etf_tickers.txt'
+
+
+def open_store(path=snapshot_db):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS etf (
+            symbol TEXT PRIMARY KEY,
+            name TEXT,
+            data TEXT,
+            digest TEXT,
+            first_seen TEXT,
+            updated TEXT,
+            delisted TEXT
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            run_date TEXT,
+            symbol TEXT,
+            kind TEXT,
+            fields TEXT
+        );
+        CREATE INDEX IF NOT EXISTS changes_symbol ON changes (symbol, run_date);
+    ''')
+    return conn
+
+
+def _metrics(record):
+    # everything but the symbol, as canonical json
+    data = {k: v for k, v in record.items() if k != 'symbol'}
+    text = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return text, hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+def _changed_fields(old_text, new_text):
+    old = json.loads(old_text)
+    new = json.loads(new_text)
+    return sorted(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+
+
+def is_complete(records, meta):
+    # a page which failed to download would look like delisted ETFs
+    if meta.get('failed_pages') or 'total_records' not in meta:
+        return False
+    return len(records) >= meta['total_records']
+
+
+def apply_snapshot(conn, records, run_date=None, complete=True):
+    # compare the downloaded records with the stored snapshot and write only the differences;
+    # a partial snapshot writes the new and changed ETFs but delists nothing
+    if run_date is None:
+        run_date = date.today().isoformat()
+    previous = {}
+    for symbol, digest, delisted in conn.execute('SELECT symbol, digest, delisted FROM etf'):
+        previous[symbol] = (digest, delisted)
+
+    current = {}
+    for record in records:
+        symbol = etfdb_tabs.symbol_of(record)
+        text, digest = _metrics(record)
+        current[symbol] = (record['name']['text'], text, digest)
+
+    new, relisted, changed, delisted = [], [], [], []
+    for symbol, (name, text, digest) in current.items():
+        old = previous.get(symbol)
+        if old is None:
+            new.append(symbol)
+        elif old[1] is not None:
+            relisted.append(symbol)
+        elif old[0] != digest:
+            changed.append(symbol)
+    for symbol, (digest, was_delisted) in previous.items():
+        if complete and was_delisted is None and symbol not in current:
+            delisted.append(symbol)
+
+    # the old metrics are only read for the ETFs which changed
+    change_rows = []
+    for symbol in changed:
+        old_text = conn.execute('SELECT data FROM etf WHERE symbol = ?', (symbol,)).fetchone()[0]
+        fields = _changed_fields(old_text, current[symbol][1])
+        change_rows.append((run_date, symbol, 'changed', json.dumps(fields)))
+    change_rows += [(run_date, s, 'new', None) for s in new]
+    change_rows += [(run_date, s, 'relisted', None) for s in relisted]
+    change_rows += [(run_date, s, 'delisted', None) for s in delisted]
+
+    with conn:
+        conn.executemany(
+            'INSERT INTO etf (symbol, name, data, digest, first_seen, updated, delisted) '
+            'VALUES (?, ?, ?, ?, ?, ?, NULL)',
+            [(s,) + current[s] + (run_date, run_date) for s in new])
+        conn.executemany(
+            'UPDATE etf SET name = ?, data = ?, digest = ?, updated = ?, delisted = NULL '
+            'WHERE symbol = ?',
+            [current[s] + (run_date, s) for s in changed + relisted])
+        conn.executemany('UPDATE etf SET delisted = ? WHERE symbol = ?',
+                         [(run_date, s) for s in delisted])
+        conn.executemany('INSERT INTO changes VALUES (?, ?, ?, ?)', change_rows)
+
+    return {'new': new, 'relisted': relisted, 'changed': changed, 'delisted': delisted}
+
+
+def active_symbols(conn):
+    return [row[0] for row in conn.execute(
+        'SELECT symbol FROM etf WHERE delisted IS NULL ORDER BY symbol')]
+
+
+def ticker_list_line(symbols):
+    # the same form as the tickers list in screen_etf.py
+    return 'tickers = [' + ', '.join("'{0}'".format(s) for s in symbols) + ']'
+
+
+def update(payload, tabs=('returns',), db_path=snapshot_db, tickers_path=ticker_file):
+    tabs = list(tabs)
+    tab_data, meta = etfdb_tabs.fetch_all(payload, tabs)
+    records, missing = etfdb_tabs.join_by_symbol(tab_data, tabs)
+    etfdb_tabs.print_mismatch_report(missing)
+    complete = is_complete(records, meta)
+    if not complete:
+        print('Partial download of {0} of {1} records, no ETF is delisted'.format(
+            len(records), meta.get('total_records', '?')))
+    conn = open_store(db_path)
+    report = apply_snapshot(conn, records, complete=complete)
+    for kind in ('new', 'relisted', 'delisted'):
+        if report[kind]:
+            print(kind.capitalize() + ': ' + ', '.join(report[kind]))
+    print('Changed metrics: ' + str(len(report['changed'])) + ' of ' + str(len(records)))
+    if report['new'] or report['relisted'] or report['delisted']:
+        with open(tickers_path, 'w', encoding='utf-8') as f:
+            f.write(ticker_list_line(active_symbols(conn)))
+            f.write('\n')
+        print('Regenerated ticker list in ' + tickers_path)
+    conn.close()
+    return report
+
+
+def _record(symbol, value):
+    return {'symbol': {'text': symbol}, 'name': {'text': symbol + ' fund'}, 'ytd': value}
+
+
+if __name__ == '__main__':
+    conn = open_store(':memory:')
+    apply_snapshot(conn, [_record('AAA', 1), _record('BBB', 2), _record('CCC', 3)], '2024-01-02')
+    # the page with BBB and CCC failed: AAA changes, nothing is delisted
+    meta = {'total_records': 3, 'failed_pages': [('returns', 2)]}
+    records = [_record('AAA', 5)]
+    assert not is_complete(records, meta)
+    report = apply_snapshot(conn, records, '2024-01-03', complete=is_complete(records, meta))
+    assert report['changed'] == ['AAA'] and report['delisted'] == []
+    assert conn.execute('SELECT COUNT(*) FROM etf WHERE delisted IS NOT NULL').fetchone()[0] == 0
+    # a complete snapshot without CCC delists it
+    records = [_record('AAA', 5), _record('BBB', 2)]
+    report = apply_snapshot(conn, records, '2024-01-04',
+                            complete=is_complete(records, {'total_records': 2, 'failed_pages': []}))
+    assert report['delisted'] == ['CCC']
+    print('ok')
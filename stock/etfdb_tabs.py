@@ -0,0 +1,110 @@
+"""
+Download several tabs of the etfdb.com screener and join them by symbol.
+
+All (page, tab) requests run concurrently in a thread pool, after the first page has told
+how many pages there are. The tabs are joined through a dict keyed by symbol, so the
+order of the responses does not matter, and the join is O(n) over all records.
+A report lists the symbols which are missing from each tab.
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+url = 'https://etfdb.com/api/screener/'
+headers = {
+    'X-Requested-With': 'XMLHttpRequest',
+    'Content-Type': 'application/json'
+}
+# tabs of the screener, any of them can be passed to fetch_all
+all_tabs = ['returns', 'risk', 'expenses', 'holdings', 'dividends', 'technicals']
+# requests in flight at the same time
+max_workers = 8
+max_retries = 3
+
+
+def fetch_page(payload, tab, page):
+    payload = dict(payload)
+    payload['page'] = page
+    payload['tab'] = tab
+    payload['only'] = ['meta', 'data']
+    error_count = 0
+    while True:
+        try:
+            response = requests.request(
+                'POST', url, headers=headers, data=json.dumps(payload))
+            raw_response = response.text.encode('utf8')
+            return json.loads(raw_response)
+        except Exception:
+            error_count = error_count + 1
+            if error_count >= max_retries:
+                print('Failed to download tab ' + tab + ' from page ' + str(page))
+                return None
+
+
+def fetch_all(payload, tabs, workers=max_workers):
+    # returns {tab: [records of all pages]} and the meta data of the first page, with the
+    # pages which failed in 'failed_pages'
+    first = fetch_page(payload, tabs[0], 1)
+    if first is None:
+        return {tab: [] for tab in tabs}, {'failed_pages': [(tabs[0], 1)]}
+    meta = first['meta']
+    pages = range(1, meta['total_pages'] + 1)
+    jobs = [(tab, page) for page in pages for tab in tabs if (tab, page) != (tabs[0], 1)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda job: fetch_page(payload, job[0], job[1]), jobs))
+    responses = {(tabs[0], 1): first}
+    responses.update(zip(jobs, results))
+    tab_data = {}
+    # the (tab, page) pairs which could not be downloaded; their records are missing
+    meta = dict(meta, failed_pages=[job for job in jobs if responses[job] is None])
+    for tab in tabs:
+        records = []
+        for page in pages:
+            response = responses[(tab, page)]
+            if response is not None:
+                records.extend(response['data'])
+        tab_data[tab] = records
+        print('Download ' + str(len(records)) + ' records of tab ' + tab)
+    return tab_data, meta
+
+
+def symbol_of(record):
+    return record['symbol']['text']
+
+
+def join_by_symbol(tab_data, tabs):
+    # The first tab decides which ETFs are in the result and in which order.
+    # Symbols of later tabs which are not in the first one are only reported.
+    index = {}
+    merged = []
+    for record in tab_data[tabs[0]]:
+        symbol = symbol_of(record)
+        if symbol in index:
+            # the same ETF on two pages, when the sort moved while paging
+            index[symbol].update(record)
+            continue
+        etf = dict(record)
+        index[symbol] = etf
+        merged.append(etf)
+    missing = {tabs[0]: []}
+    for tab in tabs[1:]:
+        seen = set()
+        for record in tab_data[tab]:
+            symbol = symbol_of(record)
+            seen.add(symbol)
+            etf = index.get(symbol)
+            if etf is None:
+                missing[tabs[0]].append(symbol)
+            else:
+                etf.update(record)
+        missing[tab] = [symbol for symbol in index if symbol not in seen]
+    missing[tabs[0]] = list(dict.fromkeys(missing[tabs[0]]))
+    return merged, missing
+
+
+def print_mismatch_report(missing):
+    for tab, symbols in missing.items():
+        if symbols:
+            print('Missing from tab ' + tab + ': ' + ', '.join(symbols))
@@ -1,115 +1,65 @@
 # Extract data from etddb.com
 
-import requests
-import json
+import etfdb_columns
+import etfdb_tabs
+import history_store
 # import statistics
 
 # the file path to save ETF data
 etf_csv_file = 'c:\\temp\\etf_screen_result.csv'
+# columns written to the csv file, in order
+tags = ['four_week_return', 'fifty_two_week', 'three_ytd', 'five_ytd', 'ytd', 'standard_deviation',
+        'twenty_day_volatility', 'fifty_day_volatility', 'two_hundred_day_volatility']
+# etf which has a negative value in any of these is removed
+return_tags = ['four_week_return', 'three_ytd', 'five_ytd', 'fifty_two_week', 'ytd']
+# N/A values of these are replaced by the mean
+impute_tags = ['fifty_two_week', 'three_ytd', 'five_ytd']
+# 'mean' or 'median', and None or a record field to impute per category
+impute_method = 'mean'
+impute_by = None
 
 
-def replace_na_with_mean(data, tag):
-    total = 0
-    count = 0
-    indexes = []
-    for i in range(len(data)):
-        if(data[i][tag] == 'N/A'):
-            indexes.append(i)
-        else:
-            count = count + 1
-            total = total + float(data[i][tag].strip('%'))
-    avg = total / count
-    for i in indexes:
-        data[i][tag] = str(avg) + '%'
-    return data
+# tabs downloaded for every page and joined by symbol
+tabs = ['returns', 'risk']
 
-
-url = 'https://etfdb.com/api/screener/'
-headers = {
-    'X-Requested-With': 'XMLHttpRequest',
-    'Content-Type': 'application/json'
+payload = {
+    "sort_by": "fifty_two_week",
+    "sort_direction": "desc",
+    "asset_class": "equity",
+    "leveraged": "false",
+    "inverse": "false",
+    "expense_ratio_end": "0.8",
+    "average_volume_start": "100000",
+    #"fifty_two_week_start": "1",
+    "ytd_start": "1",
+    # "four_week_ff_start": "0",
+    # "one_year_ff_start": "0",
 }
-page = 1
-max_page = 100000
-count = 0
-total_count = 0
-data = []
 
 # Get JSON from etfdb.com web api
-while(page <= max_page):
-    payload = {
-        "page": 1,
-        "tab": "returns",
-        "sort_by": "fifty_two_week",
-        "sort_direction": "desc",
-        "asset_class": "equity",
-        "leveraged": "false",
-        "inverse": "false",
-        "expense_ratio_end": "0.8",
-        "average_volume_start": "100000",
-        #"fifty_two_week_start": "1",
-        "ytd_start": "1",
-        # "four_week_ff_start": "0",
-        # "one_year_ff_start": "0",
-        "only": [
-            "meta",
-            "data"
-        ]
-    }
-
-    error_count = 0
-    try:
-        payload['page'] = page
-        payload['tab'] = 'returns'
-        response = requests.request(
-            'POST', url, headers=headers, data=json.dumps(payload))
-        raw_response = response.text.encode('utf8')
-        data_returns = json.loads(raw_response)
-        # only get/assign max_page and total_count once
-        if(max_page == 100000):
-            max_page = data_returns['meta']['total_pages']
-        if(total_count == 0):
-            total_count = data_returns['meta']['total_records']
-
-        payload['tab'] = 'risk'
-        response = requests.request(
-            'POST', url, headers=headers, data=json.dumps(payload))
-        raw_response = response.text.encode('utf8')
-        data_risk = json.loads(raw_response)
+tab_data, meta = etfdb_tabs.fetch_all(payload, tabs)
+data, missing = etfdb_tabs.join_by_symbol(tab_data, tabs)
+etfdb_tabs.print_mismatch_report(missing)
+print('Get ' + str(len(data)) + ' of ' + str(meta.get('total_records', 0)) + ' records from etfdb.')
 
-        for i in range(len(data_returns['data'])):
-            # remove etf which has negative returns
-            etf = data_returns['data'][i]
-            if(etf['four_week_return'][0] == '-' or etf['three_ytd'][0] == '-' or etf['five_ytd'][0] == '-' or etf['fifty_two_week'][0] == '-' or etf['ytd'][0] == '-'):
-                print('Removed ' + etf['symbol']['text'] + ' from the list.')
-                continue
-            etf_risk = data_risk['data'][i]
-            etf.update(etf_risk)
-            data.append(etf)
-            count = count + 1
-
-        print('Download date from page ' + str(page))
-        page = page + 1
-    except:
-        # page = max_page + 1
-        error_count = error_count + 1
-        if error_count > 2:
-            page = max_page + 1
-            print('Failed to download data from page ' + str(page))
-print('Get ' + str(count) + ' of ' + str(total_count) + ' records from etfdb.')
-
-# Process and clean up data
+# Process and clean up data in columns
+text_fields = [impute_by] if impute_by else []
+columns = etfdb_columns.to_columns(data, tags, text_fields)
+# remove etf which has negative returns
+keep = etfdb_columns.non_negative_mask(columns, return_tags)
+for symbol in columns['symbol'][~keep]:
+    print('Removed ' + symbol + ' from the list.')
+columns = etfdb_columns.select(columns, keep)
 # get means of 1y, 3y, 5y returns. The means will be used to replace N/A values
-data = replace_na_with_mean(data, 'fifty_two_week')
-data = replace_na_with_mean(data, 'three_ytd')
-data = replace_na_with_mean(data, 'five_ytd')
+columns = etfdb_columns.impute(columns, impute_tags, impute_method, impute_by)
+
+# keep the history in the local store as well
+conn = history_store.open_history()
+history_store.save_screener(conn, columns['symbol'], tags, columns['values'])
+conn.close()
 
 lines = ['Symbol,Name,4 Weeks,1 Year,3 Year,5 Year,YTD,std,20d v,50d v,200d v']
-for d in data:
-    line = d['symbol']['text'] + ',' + d['name']['text'] + ',' + d['four_week_return'] + ',' + d['fifty_two_week'] + ',' + d['three_ytd'] + ',' + d['five_ytd'] + \
-        ',' + d['ytd'] + ',' + d["standard_deviation"] + ',' + d['twenty_day_volatility'] + \
-        ',' + d['fifty_day_volatility'] + ',' + d['two_hundred_day_volatility']
-    lines.append(line)
+lines += etfdb_columns.to_lines(columns, tags)
 
 with open(etf_csv_file, 'w', encoding='utf-8') as f:
     for line in lines:
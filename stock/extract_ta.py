@@ -28,6 +28,7 @@ Complete List of columns
 import requests
 import json
 from datetime import date
+import history_store
 
 # the file path to save TA data
 save_path = '.'
@@ -78,6 +79,12 @@ with open(ta_csv_file, 'w', encoding='utf-8') as f:
         f.write(t+'\n')
     f.close()
 
+# keep the history in the local store as well
+conn = history_store.open_history()
+saved = [t for t in tickers if data[t]]
+history_store.save_ta(conn, saved, [data[t] for t in saved])
+conn.close()
+
 print('| Ticker | SMA10 | SMA20 |')
 for t in tickers:
     sma10 = data[t]['SMA10']
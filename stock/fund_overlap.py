@@ -0,0 +1,195 @@
+"""
+Overlap and similarity of the holdings of every pair of funds.
+
+screen_etf.py drops one of two funds whose prices correlated above 0.99 over a year,
+which needs a year of prices of every fund and says nothing about why they move alike.
+The holdings in the history store answer it directly. With the weights of every fund
+scaled to a sum of 1:
+
+    overlap     sum over the securities of min(weight in fund a, weight in fund b), the
+                share of a fund which is also in the other one (1 for the same holdings)
+    cosine      cosine of the two weight vectors, one sparse product of the row
+                normalized weights with their transpose
+
+min() is no product, so the overlap is computed exactly from the pairs which share a
+security: the funds are taken in blocks, every holding of the block gathers the funds of
+its security from the CSC form of the matrix, and np.bincount adds min() of the pairs
+into a dense block x funds array. The blocks are sized by the number of pairs, so a block
+of funds which hold popular securities stays as small in memory as any other. Of every
+fund only the top k most overlapping other funds are kept.
+
+remove_overlapping() is the dedup of screen_etf.py on the overlap instead of the
+correlation.
+
+Usage: python fund_overlap.py [<history.sqlite> [date]]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import look_through
+
+# pairs of holdings gathered at once, 8 bytes each for several arrays
+block_pairs = 1 << 23
+
+
+def _normalized(weights, order):
+    weights = sparse.csr_matrix(weights, dtype=np.float64)
+    weights.data = np.clip(weights.data, 0, None)
+    if order == 1:
+        norms = np.asarray(weights.sum(axis=1)).ravel()
+    else:
+        norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+    with np.errstate(divide='ignore'):
+        scale = np.where(norms > 0, 1 / norms, 0)
+    return sparse.csr_matrix(sparse.diags(scale) @ weights)
+
+
+def _blocks(weights, csc):
+    # (start, stop) of row blocks with about block_pairs pairs each
+    # pairs of every fund: the funds of its securities summed over its holdings, as a
+    # difference of one running sum, so a fund without holdings has none
+    per_column = np.diff(csc.indptr)
+    cumulative = np.concatenate([[0], np.cumsum(per_column[weights.indices])])[weights.indptr[1:]]
+    bounds = [0]
+    while bounds[-1] < weights.shape[0]:
+        done = cumulative[bounds[-1] - 1] if bounds[-1] > 0 else 0
+        stop = int(np.searchsorted(cumulative, done + block_pairs, side='right'))
+        bounds.append(max(stop, bounds[-1] + 1))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _overlap_block(weights, csc, start, stop):
+    # dense (stop - start, funds) of the sum of min() over the shared securities
+    lo, hi = weights.indptr[start], weights.indptr[stop]
+    rows = np.repeat(np.arange(stop - start), np.diff(weights.indptr[start:stop + 1]))
+    columns = weights.indices[lo:hi]
+    own = weights.data[lo:hi]
+    counts = csc.indptr[columns + 1] - csc.indptr[columns]
+    # position of every partner in the CSC arrays
+    first = np.repeat(csc.indptr[columns] - np.cumsum(counts) + counts, counts)
+    positions = first + np.arange(counts.sum())
+    partners = csc.indices[positions]
+    values = np.minimum(np.repeat(own, counts), csc.data[positions])
+    keys = np.repeat(rows, counts) * weights.shape[0] + partners
+    funds = weights.shape[0]
+    return np.bincount(keys, weights=values, minlength=(stop - start) * funds).reshape(-1, funds)
+
+
+def _top(block, start, k):
+    # the k largest of every row without the fund itself, best first
+    block[np.arange(block.shape[0]), start + np.arange(block.shape[0])] = -np.inf
+    k = min(k, block.shape[1] - 1)
+    best = np.argpartition(-block, k - 1, axis=1)[:, :k] if k > 0 else \
+        np.zeros((block.shape[0], 0), dtype=np.int64)
+    order = np.argsort(-np.take_along_axis(block, best, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(best, order, axis=1)
+
+
+def overlap_top_k(weights, k=10):
+    # for every fund the k funds with the largest overlap: (funds, k) arrays of the other
+    # fund, the overlap and the cosine
+    overlap_weights = _normalized(weights, 1)
+    cosine_weights = _normalized(weights, 2)
+    csc = overlap_weights.tocsc()
+    funds = weights.shape[0]
+    k = min(k, funds - 1)
+    others = np.empty((funds, k), dtype=np.int64)
+    overlaps = np.empty((funds, k))
+    cosines = np.empty((funds, k))
+    for start, stop in _blocks(overlap_weights, csc):
+        block = _overlap_block(overlap_weights, csc, start, stop)
+        best = _top(block, start, k)
+        rows = np.arange(stop - start)[:, None]
+        others[start:stop] = best
+        overlaps[start:stop] = block[rows, best]
+        cosine = (cosine_weights[start:stop] @ cosine_weights.T).toarray()
+        cosines[start:stop] = cosine[rows, best]
+    return others, overlaps, cosines
+
+
+def overlap_table(holdings, k=10):
+    # holdings: fund, symbol, weight frame -> one row per fund and one of its top k
+    weights, funds, _ = look_through.weight_matrix(holdings['fund'], holdings['symbol'],
+                                                   holdings['weight'])
+    others, overlaps, cosines = overlap_top_k(weights, k)
+    names = np.array(funds)
+    return pd.DataFrame({'fund': np.repeat(names, others.shape[1]),
+                         'other': names[others.ravel()],
+                         'rank': np.tile(np.arange(1, others.shape[1] + 1), len(names)),
+                         'overlap': overlaps.ravel(), 'cosine': cosines.ravel()})
+
+
+def remove_overlapping(table, scores, limit=0.8):
+    # screen_etf.py on the overlap: of every pair above limit the fund with the lower score
+    # (the 6 month return there) is removed; returns the funds which are kept
+    pairs = table[table['overlap'] > limit]
+    removed = set()
+    for fund, other in zip(pairs['fund'], pairs['other']):
+        if fund in removed or other in removed:
+            continue
+        removed.add(other if scores.get(fund, -np.inf) >= scores.get(other, -np.inf) else fund)
+    return [f for f in pd.unique(table['fund']) if f not in removed]
+
+
+def _check():
+    holdings = look_through._random_holdings(2000, 30000, 300)
+    start = time.time()
+    table = overlap_table(holdings, k=10)
+    print('{0} funds, {1} holdings, top 10 in {2:.2f} s'.format(
+        table['fund'].nunique(), len(holdings), time.time() - start))
+
+    # a small case against the definitions
+    small = look_through._random_holdings(40, 300, 30, seed=3)
+    weights, funds, _ = look_through.weight_matrix(small['fund'], small['symbol'], small['weight'])
+    dense = weights.toarray()
+    dense /= dense.sum(axis=1, keepdims=True)
+    expected = np.minimum(dense[:, None, :], dense[None, :, :]).sum(axis=2)
+    unit = dense / np.linalg.norm(dense, axis=1, keepdims=True)
+    cosine = unit @ unit.T
+    global block_pairs
+    saved, block_pairs = block_pairs, 500
+    others, overlaps, cosines = overlap_top_k(weights, k=39)
+    block_pairs = saved
+    rows = np.arange(40)[:, None]
+    assert np.allclose(overlaps, expected[rows, others])
+    assert np.allclose(cosines, cosine[rows, others])
+    np.fill_diagonal(expected, -1)
+    assert np.allclose(overlaps[:, 0], expected.max(axis=1))
+
+    # the same fund twice under two names overlaps fully and one is removed
+    twin = small[small['fund'] == 'F1'].assign(fund='TWIN')
+    table = overlap_table(pd.concat([small, twin]), k=3)
+    top = table[(table['fund'] == 'TWIN') & (table['rank'] == 1)].iloc[0]
+    assert top['other'] == 'F1' and np.isclose(top['overlap'], 1) and np.isclose(top['cosine'], 1)
+    kept = remove_overlapping(table, {'F1': 0.2, 'TWIN': 0.1}, limit=0.99)
+    assert 'F1' in kept and 'TWIN' not in kept
+
+    # a fund of only cash keeps its row, without holdings, also as the last row
+    cash_only = pd.DataFrame({'fund': ['A', 'A', 'B', 'C'], 'symbol': ['X', 'Y', 'X', None],
+                              'weight': [1, 1, 1, 1.]})
+    table = overlap_table(cash_only, k=2)
+    top = table[table['rank'] == 1].set_index('fund')
+    assert top.loc['A', 'other'] == 'B' and np.isclose(top.loc['A', 'overlap'], 0.5)
+    assert top.loc['B', 'other'] == 'A' and np.isclose(top.loc['B', 'overlap'], 0.5)
+    assert (table.loc[table['fund'] == 'C', 'overlap'] == 0).all()
+    print('ok')
+
+
+def main(args):
+    if not args:
+        _check()
+        return
+    conn = look_through.history_store.open_history(args[0])
+    day = args[1] if len(args) > 1 else None
+    table = overlap_table(look_through.holdings_from_store(conn, day))
+    conn.close()
+    print(table.to_string(float_format=lambda x: '{0:.4f}'.format(x)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,231 @@
+"""
+Local history of the screener, TA and fund holdings snapshots in one SQLite file.
+
+Every table is keyed by (date, symbol), and a covering index on (symbol, date, values)
+answers the history of one symbol from the index alone, so a question such as the
+RSI history of ARKG over two years reads a few index pages instead of globbing CSV files.
+Inserts are batched with executemany inside one transaction.
+Dates are stored as ISO 'YYYY-MM-DD' text, which sorts in date order.
+"""
+
+import sqlite3
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+history_db = 'stock_history.sqlite'
+
+SCREENER_COLUMNS = ['four_week_return', 'fifty_two_week', 'three_ytd', 'five_ytd', 'ytd',
+                    'standard_deviation', 'twenty_day_volatility', 'fifty_day_volatility',
+                    'two_hundred_day_volatility']
+TA_COLUMNS = ['rsi', 'sma10', 'sma20']
+HOLDING_COLUMNS = ['name', 'shares', 'market_value', 'weight']
+
+
+def open_history(path=history_db):
+    conn = sqlite3.connect(path)
+    screener = ', '.join(c + ' REAL' for c in SCREENER_COLUMNS)
+    ta = ', '.join(c + ' REAL' for c in TA_COLUMNS)
+    conn.executescript('''
+        PRAGMA journal_mode = WAL;
+        CREATE TABLE IF NOT EXISTS screener (
+            date TEXT, symbol TEXT, {0},
+            PRIMARY KEY (date, symbol)
+        );
+        CREATE INDEX IF NOT EXISTS screener_symbol ON screener (symbol, date, {1});
+        CREATE TABLE IF NOT EXISTS ta (
+            date TEXT, symbol TEXT, {2},
+            PRIMARY KEY (date, symbol)
+        );
+        CREATE INDEX IF NOT EXISTS ta_symbol ON ta (symbol, date, {3});
+        CREATE TABLE IF NOT EXISTS holdings (
+            date TEXT, fund TEXT, symbol TEXT, name TEXT, shares REAL, market_value REAL, weight REAL,
+            PRIMARY KEY (date, fund, symbol)
+        );
+        CREATE INDEX IF NOT EXISTS holdings_symbol ON holdings (symbol, date, fund, weight);
+        CREATE INDEX IF NOT EXISTS holdings_fund ON holdings (fund, date);
+    '''.format(screener, ', '.join(SCREENER_COLUMNS), ta, ', '.join(TA_COLUMNS)))
+    return conn
+
+
+def _day(day):
+    if day is None:
+        return date.today().isoformat()
+    if isinstance(day, str):
+        return pd.Timestamp(day).date().isoformat()
+    return day.isoformat()[:10]
+
+
+def _insert(conn, table, columns, rows):
+    sql = 'INSERT OR REPLACE INTO {0} ({1}) VALUES ({2})'.format(
+        table, ', '.join(columns), ', '.join('?' * len(columns)))
+    with conn:
+        conn.executemany(sql, rows)
+
+
+def clean_symbol(symbol):
+    # 'NASDAQ:IBUY' and ' ibuy' are both IBUY; extract_ta.py writes the exchange prefix
+    return str(symbol).split(':')[-1].strip().upper()
+
+
+def _clean(value):
+    # NaN is stored as NULL
+    if value is None:
+        return None
+    value = float(value)
+    return None if value != value else value
+
+
+def save_screener(conn, symbols, columns, values, day=None):
+    # values: one row per symbol, in the order of columns, which are names of SCREENER_COLUMNS
+    unknown = [c for c in columns if c not in SCREENER_COLUMNS]
+    if unknown:
+        raise ValueError('Unknown screener columns: ' + ', '.join(unknown))
+    day = _day(day)
+    rows = [(day, s) + tuple(_clean(v) for v in row) for s, row in zip(symbols, values)]
+    _insert(conn, 'screener', ['date', 'symbol'] + list(columns), rows)
+    return len(rows)
+
+
+def save_ta(conn, symbols, values, day=None):
+    # values: one row per symbol, in the order of TA_COLUMNS; exchange prefixes are dropped
+    day = _day(day)
+    rows = [(day, clean_symbol(s)) + tuple(_clean(v) for v in row) for s, row in zip(symbols, values)]
+    _insert(conn, 'ta', ['date', 'symbol'] + TA_COLUMNS, rows)
+    return len(rows)
+
+
+def _add(total, value):
+    # a sum of the values which are not NULL
+    if value is None:
+        return total
+    return value if total is None else total + value
+
+
+def save_holdings(conn, fund, holdings, day=None):
+    # holdings: (symbol, name, shares, market_value, weight) tuples. The table has one row per
+    # (date, fund, symbol), so a symbol listed more than once (several lots) is stored once
+    # with the sums, and the holdings without a symbol (cash, futures) together under ''
+    # with their names joined
+    day = _day(day)
+    merged = OrderedDict()
+    for symbol, name, shares, market_value, weight in holdings:
+        symbol = (symbol or '').strip()
+        values = [_clean(shares), _clean(market_value), _clean(weight)]
+        if symbol not in merged:
+            merged[symbol] = [[name], values]
+            continue
+        names, total = merged[symbol]
+        if name not in names:
+            names.append(name)
+        merged[symbol][1] = [_add(a, b) for a, b in zip(total, values)]
+    rows = [(day, fund, symbol, '; '.join(str(n) for n in names if n is not None) or None,
+             *values) for symbol, (names, values) in merged.items()]
+    _insert(conn, 'holdings', ['date', 'fund', 'symbol'] + HOLDING_COLUMNS, rows)
+    return len(rows)
+
+
+def _frame(cursor, columns, index='date'):
+    frame = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+    frame[index] = pd.to_datetime(frame[index])
+    values = [c for c in columns if c != index]
+    # NULL comes back as None
+    frame[values] = frame[values].astype(np.float64)
+    return frame.set_index(index)
+
+
+def _history(conn, table, columns, symbol, start, end):
+    sql = 'SELECT date, {0} FROM {1} WHERE symbol = ?'.format(', '.join(columns), table)
+    params = [symbol]
+    if start is not None:
+        sql += ' AND date >= ?'
+        params.append(_day(start))
+    if end is not None:
+        sql += ' AND date <= ?'
+        params.append(_day(end))
+    return _frame(conn.execute(sql + ' ORDER BY date', params), ['date'] + columns)
+
+
+def ta_history(conn, symbol, start=None, end=None, columns=TA_COLUMNS):
+    return _history(conn, 'ta', list(columns), symbol, start, end)
+
+
+def screener_history(conn, symbol, start=None, end=None, columns=SCREENER_COLUMNS):
+    return _history(conn, 'screener', list(columns), symbol, start, end)
+
+
+def holdings_on(conn, fund, day):
+    cursor = conn.execute(
+        'SELECT symbol, name, shares, market_value, weight FROM holdings '
+        'WHERE fund = ? AND date = (SELECT MAX(date) FROM holdings WHERE fund = ? AND date <= ?)',
+        (fund, fund, _day(day)))
+    return pd.DataFrame.from_records(cursor.fetchall(), columns=['symbol'] + HOLDING_COLUMNS)
+
+
+def funds_holding(conn, symbol, start=None, end=None):
+    # weight of symbol in every fund over time, dates x funds
+    sql = 'SELECT date, fund, weight FROM holdings WHERE symbol = ?'
+    params = [symbol]
+    if start is not None:
+        sql += ' AND date >= ?'
+        params.append(_day(start))
+    if end is not None:
+        sql += ' AND date <= ?'
+        params.append(_day(end))
+    frame = pd.DataFrame.from_records(conn.execute(sql, params).fetchall(),
+                                      columns=['date', 'fund', 'weight'])
+    frame['date'] = pd.to_datetime(frame['date'])
+    return frame.pivot(index='date', columns='fund', values='weight')
+
+
+def panel(conn, table, column, symbols=None, start=None, end=None):
+    # one column of the screener or ta table as a dates x symbols float32 array
+    if table not in ('screener', 'ta'):
+        raise ValueError('Unknown table: ' + table)
+    if column not in (SCREENER_COLUMNS if table == 'screener' else TA_COLUMNS):
+        raise ValueError('Unknown column: ' + column)
+    sql = 'SELECT date, symbol, {0} FROM {1} WHERE 1 = 1'.format(column, table)
+    params = []
+    if symbols is not None:
+        sql += ' AND symbol IN ({0})'.format(', '.join('?' * len(symbols)))
+        params += list(symbols)
+    if start is not None:
+        sql += ' AND date >= ?'
+        params.append(_day(start))
+    if end is not None:
+        sql += ' AND date <= ?'
+        params.append(_day(end))
+    rows = conn.execute(sql, params).fetchall()
+    if not rows:
+        return np.zeros((0, 0), dtype=np.float32), [], []
+    days, names, values = zip(*rows)
+    day_index, day_codes = np.unique(np.array(days), return_inverse=True)
+    symbol_index, symbol_codes = np.unique(np.array(names), return_inverse=True)
+    result = np.full((day_index.size, symbol_index.size), np.nan, dtype=np.float32)
+    result[day_codes, symbol_codes] = np.array(values, dtype=np.float64)
+    return result, day_index.tolist(), symbol_index.tolist()
+
+
+if __name__ == '__main__':
+    conn = open_history(':memory:')
+    save_holdings(conn, 'VWUSX', [('AAPL', 'Apple Inc', 10, 1500.0, 0.5),
+                                  ('AAPL', 'Apple Inc', 5, 750.0, 0.25),
+                                  ('', 'Cash', None, 500.0, 1 / 6.0),
+                                  (None, 'Futures', None, 250.0, 1 / 12.0)], '2024-01-02')
+    holdings = holdings_on(conn, 'VWUSX', '2024-01-02').set_index('symbol')
+    assert holdings.loc['AAPL', 'shares'] == 15 and holdings.loc['AAPL', 'weight'] == 0.75
+    assert holdings.loc['', 'name'] == 'Cash; Futures' and holdings.loc['', 'market_value'] == 750
+    assert abs(holdings['weight'].sum() - 1) < 1e-12
+
+    # only the named columns are written, in their order
+    save_screener(conn, ['VGT'], ['ytd', 'four_week_return'], [[0.2, 0.03]], '2024-01-02')
+    row = screener_history(conn, 'VGT').iloc[0]
+    assert row['ytd'] == 0.2 and row['four_week_return'] == 0.03 and row['five_ytd'] != row['five_ytd']
+    try:
+        save_screener(conn, ['VGT'], ['ytd', 'yield'], [[0.2, 0.01]], '2024-01-02')
+        raise AssertionError('unknown column accepted')
+    except ValueError:
+        pass
+    print('ok')
@@ -0,0 +1,137 @@
+"""
+Backfill the _YYYYMMDD.csv snapshots written by extract_ta.py into one columnar file.
+
+The files are found by name, parsed in batches by worker processes with plain string
+splitting (the files are small, so pandas would spend more time starting than parsing),
+deduplicated by (date, ticker) keeping the last file read (the tickers without the
+exchange prefix, as history_store.py stores them), and written sorted by
+(ticker, date) either as Parquet or, without pyarrow, as a folder of .npy arrays which
+load_ta_history opens memory-mapped.
+
+Usage: python import_ta_history.py <folder with snapshots> <output .parquet or folder>
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import history_store
+
+VALUE_COLUMNS = ['rsi', 'sma10', 'sma20']
+_SNAPSHOT = re.compile(r'_(\d{4})(\d{2})(\d{2})\.csv$')
+
+
+def discover(folder):
+    # extract_ta.py on Linux writes a literal backslash into the name, so match the name end
+    found = []
+    for root, _, names in os.walk(folder):
+        for name in names:
+            m = _SNAPSHOT.search(name)
+            if m:
+                day = np.datetime64('-'.join(m.groups()), 'D')
+                found.append((day, os.path.join(root, name)))
+    found.sort()
+    return found
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _parse_batch(batch):
+    days, tickers, values = [], [], []
+    for day, path in batch:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        for line in lines[1:]:
+            parts = line.split(',')
+            if len(parts) < len(VALUE_COLUMNS) + 1:
+                continue
+            tickers.append(history_store.clean_symbol(parts[-1]))
+            values.append([_to_float(p) for p in parts[:len(VALUE_COLUMNS)]])
+            days.append(day)
+    return (np.array(days, dtype='datetime64[D]'), tickers,
+            np.array(values, dtype=np.float32).reshape(-1, len(VALUE_COLUMNS)))
+
+
+def parse_all(files, workers=None, batch_size=200):
+    batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(batches) > 1:
+        with Pool(workers) as pool:
+            # map keeps the batches in file order, which the dedupe relies on
+            results = pool.map(_parse_batch, batches)
+    else:
+        results = [_parse_batch(b) for b in batches]
+    if not results:
+        return (np.array([], dtype='datetime64[D]'), [],
+                np.zeros((0, len(VALUE_COLUMNS)), dtype=np.float32))
+    days = np.concatenate([r[0] for r in results])
+    tickers = [t for r in results for t in r[1]]
+    values = np.concatenate([r[2] for r in results])
+    return days, tickers, values
+
+
+def dedupe(days, tickers, values):
+    # keep the last row of every (date, ticker), sorted by (ticker, date)
+    names, codes = np.unique(np.array(tickers, dtype=object).astype(str), return_inverse=True)
+    day_numbers = days.astype(np.int64)
+    order = np.lexsort((np.arange(codes.size), day_numbers, codes))
+    codes, day_numbers = codes[order], day_numbers[order]
+    last = np.ones(order.size, dtype=np.bool_)
+    last[:-1] = (codes[1:] != codes[:-1]) | (day_numbers[1:] != day_numbers[:-1])
+    keep = order[last]
+    return days[keep], names, codes[last].astype(np.int32), values[keep]
+
+
+def write_columnar(output, days, names, codes, values):
+    if output.endswith('.parquet'):
+        import pandas as pd
+        frame = pd.DataFrame({'date': days, 'ticker': pd.Categorical.from_codes(codes, names)})
+        for j, column in enumerate(VALUE_COLUMNS):
+            frame[column] = values[:, j]
+        frame.to_parquet(output, index=False)
+        return
+    os.makedirs(output, exist_ok=True)
+    np.save(os.path.join(output, 'date.npy'), days)
+    np.save(os.path.join(output, 'ticker.npy'), codes)
+    for j, column in enumerate(VALUE_COLUMNS):
+        np.save(os.path.join(output, column + '.npy'), np.ascontiguousarray(values[:, j]))
+    with open(os.path.join(output, 'tickers.json'), 'w', encoding='utf-8') as f:
+        json.dump([str(n) for n in names], f)
+
+
+def load_ta_history(folder):
+    # columns memory-mapped, plus the ticker names and where every ticker starts
+    columns = {}
+    for name in ['date', 'ticker'] + VALUE_COLUMNS:
+        columns[name] = np.load(os.path.join(folder, name + '.npy'), mmap_mode='r')
+    with open(os.path.join(folder, 'tickers.json'), 'r', encoding='utf-8') as f:
+        names = json.load(f)
+    starts = np.searchsorted(columns['ticker'], np.arange(len(names) + 1))
+    return columns, names, starts
+
+
+def import_snapshots(folder, output, workers=None):
+    start = time.time()
+    files = discover(folder)
+    days, tickers, values = parse_all(files, workers)
+    days, names, codes, values = dedupe(days, tickers, values)
+    write_columnar(output, days, names, codes, values)
+    seconds = max(time.time() - start, 1e-9)
+    print('Imported {0} files, {1} rows, {2} unique rows in {3:.2f} s, {4:.0f} rows/s'.format(
+        len(files), len(tickers), len(days), seconds, len(tickers) / seconds))
+    return len(days)
+
+
+if __name__ == '__main__':
+    import_snapshots(sys.argv[1], sys.argv[2])
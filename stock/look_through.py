@@ -0,0 +1,197 @@
+"""
+Fund level indicators looked through the holdings of the funds.
+
+parse_vanguard_jsonp.py keeps the weight of every holding of a fund and extract_ta.py the
+indicators of every ticker, both in the history store. Here the holdings of all funds
+become one sparse funds x securities matrix of weights and the indicators one dense
+securities x indicators matrix, and the weighted indicators of every fund are one sparse
+product. Holdings without the indicator are left out and the rest reweighted; the
+coverage, the weight with a value, comes out of the same product.
+
+Every symbol gets its column once in a SymbolMap, a hash table from the symbol to the
+column, and whole arrays of symbols are looked up at once (with the exchange prefix of
+extract_ta.py dropped), so building the matrices never searches a list.
+
+Usage: python look_through.py [<history.sqlite> [date]]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import history_store
+
+
+class SymbolMap(object):
+
+    def __init__(self, symbols=()):
+        self.symbols = []
+        self.column = {}
+        self.add(symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def add(self, symbols):
+        # the columns of the symbols, new symbols are appended and -1 for a missing or blank
+        # symbol; a holdings list repeats the same symbols many times, so only the distinct
+        # ones are cleaned and looked up
+        raw_codes, distinct = pd.factorize(np.asarray(symbols, dtype=object))
+        codes = np.empty(len(distinct) + 1, dtype=np.int64)
+        # factorize gives None and NaN the code -1, the last entry
+        codes[-1] = -1
+        for i, symbol in enumerate(distinct):
+            symbol = history_store.clean_symbol(symbol)
+            if not symbol:
+                codes[i] = -1
+                continue
+            code = self.column.get(symbol)
+            if code is None:
+                code = self.column[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+            codes[i] = code
+        return codes[raw_codes]
+
+    def codes(self, symbols):
+        # the columns of the symbols, -1 for an unknown symbol
+        return np.array([self.column.get(history_store.clean_symbol(s), -1) for s in symbols], dtype=np.int64)
+
+
+def weight_matrix(funds, symbols, weights, symbol_map=None):
+    # one (fund, symbol, weight) per holding -> csr funds x securities, the fund names and
+    # the symbol map; a holding listed twice adds up, one without a fund or a symbol (cash,
+    # futures) is left out
+    if symbol_map is None:
+        symbol_map = SymbolMap()
+    fund_codes, fund_index = pd.factorize(np.asarray(funds, dtype=object), sort=True)
+    columns = symbol_map.add(symbols)
+    weights = np.nan_to_num(np.asarray(weights, dtype=np.float64))
+    known = (fund_codes >= 0) & (columns >= 0)
+    fund_codes, columns, weights = fund_codes[known], columns[known], weights[known]
+    matrix = sparse.csr_matrix((weights, (fund_codes, columns)),
+                               shape=(fund_index.size, len(symbol_map)))
+    matrix.sum_duplicates()
+    return matrix, fund_index.tolist(), symbol_map
+
+
+def indicator_matrix(symbol_map, symbols, values):
+    # (securities, indicators) in the columns of the symbol map, NaN where there is none
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full((len(symbol_map), values.shape[1]), np.nan)
+    codes = symbol_map.codes(symbols)
+    known = codes >= 0
+    result[codes[known]] = values[known]
+    return result
+
+
+def look_through(weights, indicators):
+    # weighted indicators (funds, indicators) and their coverage, from one sparse product
+    # of the weights with the values and the masks of the values side by side
+    if weights.shape[1] < indicators.shape[0]:
+        # symbols added to the map after the weights were built are in no fund
+        weights = sparse.csr_matrix(weights, shape=(weights.shape[0], indicators.shape[0]))
+    valid = ~np.isnan(indicators)
+    stacked = np.hstack([np.where(valid, indicators, 0.0), valid.astype(np.float64)])
+    product = weights @ stacked
+    k = indicators.shape[1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = product[:, :k] / product[:, k:]
+    total = np.asarray(weights.sum(axis=1)).ravel()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        coverage = product[:, k:] / total[:, None]
+    return values, coverage
+
+
+def holdings_from_store(conn, day=None):
+    # the latest holdings of every fund on or before day
+    cursor = conn.execute(
+        'SELECT h.fund, h.symbol, h.weight FROM holdings h '
+        'JOIN (SELECT fund, MAX(date) AS date FROM holdings WHERE date <= ? GROUP BY fund) l '
+        'ON h.fund = l.fund AND h.date = l.date', (history_store._day(day),))
+    return pd.DataFrame.from_records(cursor.fetchall(), columns=['fund', 'symbol', 'weight'])
+
+
+def indicators_from_store(conn, day=None):
+    # the latest TA of every symbol on or before day: rsi and the distance of SMA10 to SMA20
+    cursor = conn.execute(
+        'SELECT t.symbol, t.rsi, t.sma10, t.sma20 FROM ta t '
+        'JOIN (SELECT symbol, MAX(date) AS date FROM ta WHERE date <= ? GROUP BY symbol) l '
+        'ON t.symbol = l.symbol AND t.date = l.date', (history_store._day(day),))
+    frame = pd.DataFrame.from_records(cursor.fetchall(),
+                                      columns=['symbol', 'rsi', 'sma10', 'sma20'])
+    frame[['rsi', 'sma10', 'sma20']] = frame[['rsi', 'sma10', 'sma20']].astype(np.float64)
+    frame['sma10_vs_sma20'] = frame['sma10'] / frame['sma20'] - 1
+    return frame[['symbol', 'rsi', 'sma10_vs_sma20']]
+
+
+def fund_indicators(holdings, indicators):
+    # holdings: fund, symbol, weight frame; indicators: symbol and indicator columns
+    weights, funds, symbol_map = weight_matrix(holdings['fund'], holdings['symbol'],
+                                               holdings['weight'])
+    names = [c for c in indicators.columns if c != 'symbol']
+    table = indicator_matrix(symbol_map, indicators['symbol'].tolist(), indicators[names])
+    values, coverage = look_through(weights, table)
+    result = pd.DataFrame(values, index=funds, columns=names)
+    for i, name in enumerate(names):
+        result[name + '_coverage'] = coverage[:, i]
+    return result
+
+
+def _random_holdings(funds, securities, holdings_per_fund, seed=0):
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(holdings_per_fund // 2, holdings_per_fund * 2, funds)
+    fund_names = np.repeat(['F{0}'.format(i) for i in range(funds)], sizes)
+    # popular securities are held by many funds
+    symbols = np.minimum(rng.zipf(1.3, sizes.sum()) - 1, securities - 1)
+    spread = rng.integers(0, securities, sizes.sum()) * (rng.random(sizes.sum()) < 0.5)
+    symbols = (symbols + spread) % securities
+    weights = rng.random(sizes.sum())
+    return pd.DataFrame({'fund': fund_names, 'symbol': ['S{0}'.format(s) for s in symbols],
+                         'weight': weights})
+
+
+def _check():
+    holdings = _random_holdings(300, 20000, 300)
+    rng = np.random.default_rng(1)
+    symbols = ['S{0}'.format(i) for i in range(20000)]
+    indicators = pd.DataFrame({'symbol': symbols, 'rsi': rng.uniform(0, 100, 20000),
+                               'ret_1m': rng.normal(0, 0.05, 20000)})
+    indicators.loc[rng.random(20000) < 0.1, 'rsi'] = np.nan
+    start = time.time()
+    result = fund_indicators(holdings, indicators)
+    print('{0} funds, {1} holdings in {2:.3f} s'.format(len(result), len(holdings),
+                                                        time.time() - start))
+    by_symbol = indicators.set_index('symbol')
+    for fund in ['F0', 'F17', 'F299']:
+        held = holdings[holdings['fund'] == fund].groupby('symbol')['weight'].sum()
+        rsi = by_symbol.loc[held.index, 'rsi']
+        known = rsi.notna()
+        expected = (held[known] * rsi[known]).sum() / held[known].sum()
+        assert np.isclose(result.loc[fund, 'rsi'], expected)
+        assert np.isclose(result.loc[fund, 'rsi_coverage'], held[known].sum() / held.sum())
+    symbol_map = SymbolMap(['NASDAQ:IBUY', 'AMEX:VGT'])
+    assert list(symbol_map.codes(['VGT', 'ibuy', 'XYZ'])) == [1, 0, -1]
+    # holdings without a symbol or a fund are left out, not charged to another row
+    weights, funds, symbol_map = weight_matrix(['A', 'A', 'A', None, 'B'],
+                                               ['X', None, ' ', 'X', 'Y'], [1, 2, 3, 4, 5])
+    assert funds == ['A', 'B'] and symbol_map.symbols == ['X', 'Y']
+    assert (weights.toarray() == [[1, 0], [0, 5]]).all()
+    print('ok')
+
+
+def main(args):
+    if not args:
+        _check()
+        return
+    conn = history_store.open_history(args[0])
+    day = args[1] if len(args) > 1 else None
+    result = fund_indicators(holdings_from_store(conn, day), indicators_from_store(conn, day))
+    conn.close()
+    print(result.to_string(float_format=lambda x: '{0:.4f}'.format(x)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,12 +4,25 @@ For example, visit url https://investor.vanguard.com/mutual-funds/profile/portfo
 Use Chrome developer console to capture JS network flow
 Filter stock.jsonp
 And save it to a local file
+
+Usage: python parse_vanguard_jsonp.py [<fund symbol> [stock.jsonp]]
+The fund symbol (VWUSX for the url above) is the key of the holdings in the history store;
+without arguments fund_symbol and jsonp_file below are used.
 """
 
 import json
+import sys
+import history_store
 
 jsonp_file = 'd:\\temp\\stock.jsonp'
 output_csv_file = 'd:\\temp\\vanguard.csv' 
+# the fund the holdings belong to, used as key in the history store
+fund_symbol = 'VWUSX'
+
+if len(sys.argv) > 1:
+    fund_symbol = sys.argv[1].strip().upper()
+if len(sys.argv) > 2:
+    jsonp_file = sys.argv[2]
 
 def extract_json_from_jsonp(jsonp_text):
     i = jsonp_text.find('{')
@@ -44,4 +57,11 @@ with open(output_csv_file, 'w', encoding='utf-8') as f:
         f.write('\n')
     f.close()
 
+# keep the history in the local store as well
+conn = history_store.open_history()
+history_store.save_holdings(conn, fund_symbol, [
+    (fund['ticker'], fund['longName'], fund['sharesHeld'], fund['marketValue'], fund['weight'])
+    for fund in funds])
+conn.close()
+
 print('Extract vanguard fund data and save to ' + output_csv_file)
@@ -0,0 +1,205 @@
+"""
+Load the CSV files written by the scripts in this folder into typed, compact DataFrames.
+
+Every file layout has a schema: symbols and names become categoricals, returns,
+volatilities and indicators become float32, and percent strings such as "12.3%" or "N/A"
+are parsed while loading, with one regex pass per chunk and the C parser of pandas.
+The writers do not quote names, so one free text column per schema absorbs any extra commas.
+A line with more fields than a schema without free text (a truncated or garbled scrape) is
+left out, and the numbers of those lines are printed and kept in frame.attrs['skipped_lines'].
+
+read_typed(path) returns a DataFrame, read_typed(path, chunksize=n) yields DataFrames
+of n rows, and load(path) keeps a Parquet copy next to the CSV for faster reloads.
+"""
+
+import io
+import itertools
+import os
+import re
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# columns: (name, type), type is one of category, str, float32, float64, percent
+SCHEMAS = {
+    # extract_eftdb.py
+    'etfdb_screen': {
+        'header': 'Symbol,Name,4 Weeks,1 Year,3 Year,5 Year,YTD,std,20d v,50d v,200d v',
+        'columns': [('Symbol', 'category'), ('Name', 'category'),
+                    ('4 Weeks', 'percent'), ('1 Year', 'percent'), ('3 Year', 'percent'),
+                    ('5 Year', 'percent'), ('YTD', 'percent'), ('std', 'percent'),
+                    ('20d v', 'percent'), ('50d v', 'percent'), ('200d v', 'percent')],
+        'text_column': 'Name',
+    },
+    # extract_eft_list_only.py, the first line is the python ticker list
+    'etfdb_list': {
+        'header': 'Symbol,Name',
+        'columns': [('Symbol', 'category'), ('Name', 'category')],
+        'text_column': 'Name',
+    },
+    # parse_vanguard_jsonp.py
+    'vanguard_holdings': {
+        'header': 'Long Name,Short Name,Ticker,Shares,Market Value,Weight',
+        'columns': [('Long Name', 'category'), ('Short Name', 'category'), ('Ticker', 'category'),
+                    ('Shares', 'float64'), ('Market Value', 'float64'), ('Weight', 'float32')],
+        'text_column': 'Long Name',
+    },
+    # extract_ta.py
+    'ta': {
+        'header': 'RSI,SMA10,SMA20,Ticker',
+        'columns': [('RSI', 'float32'), ('SMA10', 'float32'), ('SMA20', 'float32'),
+                    ('Ticker', 'category')],
+        'text_column': None,
+    },
+}
+
+_TA_DATE = re.compile(r'_(\d{8})\.csv$')
+_PERCENT = re.compile(r'(?<=\d)%(?=,|\r?\n|$)')
+
+
+def detect_schema(path):
+    # the header is the first or, for the ticker list, the second line
+    with open(path, 'r', encoding='utf-8') as f:
+        for skip in range(2):
+            line = f.readline().strip()
+            for name, schema in SCHEMAS.items():
+                if line == schema['header']:
+                    return name, skip + 1
+    raise ValueError('Unknown CSV layout: ' + path)
+
+
+def _quote_text(line, schema):
+    # the text column absorbs the extra commas, fields right of it are split from the right
+    names = [c[0] for c in schema['columns']]
+    t = names.index(schema['text_column'])
+    right = len(names) - t - 1
+    parts = line.rstrip('\r\n').rsplit(',', right) if right else [line.rstrip('\r\n')]
+    head = parts[0].split(',', t)
+    fields = head[:t] + ['"' + head[t].replace('"', '""') + '"'] + parts[1:]
+    return ','.join(fields) + '\n'
+
+
+def _parse_lines(lines, schema):
+    names = [c[0] for c in schema['columns']]
+    commas = len(names) - 1
+    if schema['text_column'] is not None:
+        lines = [l if l.count(',') == commas else _quote_text(l, schema) for l in lines]
+    text = ''.join(lines)
+    if any(kind == 'percent' for _, kind in schema['columns']):
+        # one regex pass over the chunk turns "12.3%" into "12.3"
+        text = _PERCENT.sub('', text)
+    dtypes = {}
+    for name, kind in schema['columns']:
+        dtypes[name] = 'float32' if kind == 'percent' else kind
+    return pd.read_csv(io.StringIO(text), header=None, names=names, dtype=dtypes,
+                       na_values=['N/A', ''], skipinitialspace=True, on_bad_lines='warn')
+
+
+def _bad_lines(lines, schema):
+    # the lines with more fields than the schema; with a free text column the extra commas
+    # are quoted into it instead
+    if schema['text_column'] is not None:
+        return set()
+    commas = len(schema['columns']) - 1
+    return set(i for i, l in enumerate(lines) if l.count(',') > commas)
+
+
+def _read_chunks(path, schema, skip, chunksize):
+    # frames of the chunks, with the line numbers in the file of the lines left out
+    with open(path, 'r', encoding='utf-8') as f:
+        for _ in range(skip):
+            f.readline()
+        numbered = enumerate(f, skip + 1)
+        while True:
+            chunk = list(itertools.islice(numbered, chunksize or 100000))
+            if not chunk:
+                break
+            chunk = [(n, l) for n, l in chunk if l.strip()]
+            bad = _bad_lines([l for _, l in chunk], schema)
+            frame = _parse_lines([l for i, (_, l) in enumerate(chunk) if i not in bad], schema)
+            frame.attrs['skipped_lines'] = [chunk[i][0] for i in sorted(bad)]
+            yield frame
+
+
+def _report_skipped(path, frame):
+    skipped = frame.attrs['skipped_lines']
+    if skipped:
+        print('{0}: skipped {1} malformed lines: {2}{3}'.format(
+            path, len(skipped), ', '.join(str(n) for n in skipped[:20]),
+            ' ...' if len(skipped) > 20 else ''))
+    return frame
+
+
+def _concat(frames):
+    # concatenate chunks and keep categoricals as categoricals
+    if not frames:
+        return None
+    result = pd.concat(frames, ignore_index=True)
+    for name in frames[0].columns:
+        if isinstance(frames[0][name].dtype, pd.CategoricalDtype):
+            result[name] = union_categoricals([f[name] for f in frames])
+    return result
+
+
+def _add_date(frame, path, schema_name):
+    # the TA snapshots carry their date only in the file name
+    m = _TA_DATE.search(os.path.basename(path))
+    if schema_name == 'ta' and m:
+        frame['Date'] = pd.Timestamp(m.group(1))
+    return frame
+
+
+def read_typed(path, schema_name=None, chunksize=None):
+    if schema_name is None:
+        schema_name, skip = detect_schema(path)
+    else:
+        skip = detect_schema(path)[1]
+    schema = SCHEMAS[schema_name]
+    chunks = _read_chunks(path, schema, skip, chunksize)
+    if chunksize:
+        return (_add_date(_report_skipped(path, c), path, schema_name) for c in chunks)
+    chunks = list(chunks)
+    frame = _concat(chunks)
+    if frame is None:
+        frame = _parse_lines([], schema)
+    frame.attrs['skipped_lines'] = [n for c in chunks for n in c.attrs['skipped_lines']]
+    return _add_date(_report_skipped(path, frame), path, schema_name)
+
+
+def to_parquet(frame, path):
+    frame.to_parquet(path, index=False)
+
+
+def load(path, schema_name=None):
+    # Parquet copy next to the CSV, rebuilt when the CSV is newer
+    parquet_path = os.path.splitext(path)[0] + '.parquet'
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        try:
+            return pd.read_parquet(parquet_path)
+        except ImportError:
+            pass
+    frame = read_typed(path, schema_name)
+    try:
+        to_parquet(frame, parquet_path)
+    except ImportError:
+        # pyarrow or fastparquet is not installed, keep working from the CSV
+        pass
+    return frame
+
+
+def memory_report(path):
+    # compare with the plain read_csv which the notebooks used so far
+    _, skip = detect_schema(path)
+    plain = pd.read_csv(path, skiprows=skip - 1, on_bad_lines='warn')
+    typed = read_typed(path)
+    plain_bytes = plain.memory_usage(deep=True).sum()
+    typed_bytes = typed.memory_usage(deep=True).sum()
+    print('{0}: {1} rows, object/float64 {2} bytes, typed {3} bytes, {4:.1f}x smaller'.format(
+        path, len(typed), plain_bytes, typed_bytes, plain_bytes / max(typed_bytes, 1)))
+    return plain_bytes, typed_bytes
+
+
+if __name__ == '__main__':
+    import sys
+    for p in sys.argv[1:]:
+        memory_report(p)